@@ -3,14 +3,47 @@ ASGI config for Blood_Bridge project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is what the Procfile's ``web`` process serves. Only the SSE stream at
+``/feed/`` goes through Django's ASGI handler, where an open tab costs a
+coroutine rather than a worker thread. Every other request goes to the WSGI
+application. asgiref runs it on one thread per worker process, so each
+worker keeps its database connection between requests (DB_CONN_MAX_AGE) as
+a sync gunicorn worker would.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
 
 import os
 
+from asgiref.wsgi import WsgiToAsgi
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Blood_Bridge.settings')
 
-application = get_asgi_application()
+django_asgi = get_asgi_application()
+
+from django.urls import reverse  # noqa: E402  (needs the settings loaded above)
+
+from .wsgi import application as django_wsgi  # noqa: E402
+
+ASGI_PATHS = frozenset([reverse('request_feed')])
+
+
+def _closing(environ, start_response):
+    # WsgiToAsgi never calls close(), which is what sends request_finished
+    response = django_wsgi(environ, start_response)
+    try:
+        yield from response
+    finally:
+        response.close()
+
+
+wsgi = WsgiToAsgi(_closing)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] not in ASGI_PATHS:
+        await wsgi(scope, receive, send)
+    else:
+        await django_asgi(scope, receive, send)
@@ -29,7 +29,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, able to run without a thread hop under ASGI
+    'core.static.StaticFilesMiddleware',
+    # after WhiteNoise, so static files stay out of the per-view metrics
+    'core.metrics.MetricsMiddleware',
+    # inside the metrics, so response sizes are the bytes actually sent
+    'core.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -40,6 +45,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'Blood_Bridge.urls'
 
+# No 'loaders' option: Django then wraps the default loaders in the cached
+# loader, which parses each template once per process (and, with DEBUG,
+# reloads templates when their files change)
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -57,11 +65,21 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Blood_Bridge.wsgi.application'
+ASGI_APPLICATION = 'Blood_Bridge.asgi.application'
 
 # CRITICAL FIX: Tell Django to use your custom User model to avoid the E304 Clash
 AUTH_USER_MODEL = 'core.User'
 
 # 4. FINAL DATABASE CONFIGURATION
+# Connection reuse. Each WSGI worker thread keeps its connection open for
+# DB_CONN_MAX_AGE seconds instead of reconnecting per request, which is why
+# asgi.py hands every page but the SSE feed to the WSGI application. The feed
+# closes its connection once it has loaded the user. On PostgreSQL,
+# DB_POOL_MAX_SIZE turns on Django's connection pool (needs psycopg[pool])
+# instead.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '600'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '0'))
+
 if os.environ.get('MYSQLHOST'):
     DATABASES = {
         'default': {
@@ -74,16 +92,25 @@ if os.environ.get('MYSQLHOST'):
             'OPTIONS': {
                 'charset': 'utf8mb4',
             },
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 elif os.environ.get('DATABASE_URL'):
     DATABASES = {
         'default': dj_database_url.config(
             default=os.environ.get('DATABASE_URL'),
-            conn_max_age=600,
+            conn_max_age=DB_CONN_MAX_AGE,
             conn_health_checks=True,
         )
     }
+    if DB_POOL_MAX_SIZE and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+        # the pool hands connections out per request; Django forbids combining it with CONN_MAX_AGE
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': DB_POOL_MAX_SIZE,
+        }
 else:
     # Local fallback
     DATABASES = {
@@ -97,6 +124,40 @@ else:
         }
     }
 
+# Request list cache (core.caching). Its version stamps live in the cache
+# too, so with local memory a write only reaches the lists of the worker
+# that made it: the other workers serve old lists for up to
+# REQUEST_CACHE_TIMEOUT seconds. Fine for one worker; with more, set
+# REDIS_URL (needs the redis package). `manage.py check` warns when
+# WEB_CONCURRENCY asks for several workers on local memory.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'blood-bridge',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+REQUEST_CACHE_TIMEOUT = 300
+
+# Live request feed (core.feed). Events travel between processes through
+# the feed_events table; core.feed.InProcessBroker only reaches donors
+# connected to the process that saved the request.
+REQUEST_FEED_BROKER = 'core.feed.DatabaseBroker'
+REQUEST_FEED_POLL_SECONDS = 1
+
+# Per-view metrics (core.metrics): /metrics also accepts this bearer token;
+# set METRICS_SLOW_QUERY_MS to log slower queries with their stacks
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_SLOW_QUERY_MS = float(os.environ['METRICS_SLOW_QUERY_MS']) if os.environ.get('METRICS_SLOW_QUERY_MS') else None
+
 # 5. REMAINING SETTINGS
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -0,0 +1,116 @@
+"""
+State changes on blood requests that must be safe under concurrency.
+
+Each action is one conditional UPDATE: the WHERE clause carries the state
+the request must be in, so when several donors race for the same request the
+database lets exactly one UPDATE match and the others see zero rows. The
+statistics counters, the supply rollup, the match index, the live feed and
+the list cache are updated here too, since queryset updates bypass
+``BloodRequest.save`` and its signals.
+
+The ``*_many`` variants move a whole batch with that same single UPDATE and
+report a result per request id.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import invalidate_on_commit
+from .feed import publish_request
+from .models import BloodRequest
+from .stats import record_changes
+from .supply import record_request_changes
+
+
+ACCEPTED = 'accepted'
+CANCELLED = 'cancelled'
+ALREADY_TAKEN = 'already_taken'
+NOT_ALLOWED = 'not_allowed'
+NOT_FOUND = 'not_found'
+
+
+def _publish_all(blood_requests):
+    for blood_request in blood_requests:
+        publish_request(blood_request)
+
+
+def _transition(queryset, from_status, to_status, **changes):
+    """Move the matched requests from ``from_status`` to ``to_status``; returns the moved rows"""
+    now = timezone.now()
+    with transaction.atomic():
+        updated = queryset.filter(status=from_status).update(status=to_status, updated_at=now, **changes)
+        if not updated:
+            return []
+        moved = list(queryset.filter(status=to_status, updated_at=now, **changes))
+        record_changes(
+            ((from_status, r.blood_group, r.location), (to_status, r.blood_group, r.location))
+            for r in moved
+        )
+        record_request_changes(
+            ((from_status, r.blood_group, r.location, r.units_required),
+             (to_status, r.blood_group, r.location, r.units_required))
+            for r in moved
+        )
+        for blood_request in moved:
+            invalidate_on_commit(blood_request.location, blood_request.blood_group, {from_status, to_status})
+        transaction.on_commit(lambda: _publish_all(moved))
+    return moved
+
+
+def _owners(request_ids):
+    return dict(BloodRequest.objects.filter(request_id__in=request_ids).values_list('request_id', 'requested_by_id'))
+
+
+def accept_many(request_ids, donor):
+    """
+    Assign every pending request in ``request_ids`` to ``donor``.
+
+    Returns ``{request_id: result}``. However many callers race, each
+    request is ``ACCEPTED`` by exactly one of them.
+    """
+    request_ids = list(dict.fromkeys(request_ids))
+    queryset = BloodRequest.objects.filter(request_id__in=request_ids)
+    moved = _transition(queryset, 'Pending', 'In Progress', assigned_to=donor)
+    results = {blood_request.request_id: ACCEPTED for blood_request in moved}
+
+    rest = [request_id for request_id in request_ids if request_id not in results]
+    owners = _owners(rest) if rest else {}
+    for request_id in rest:
+        results[request_id] = ALREADY_TAKEN if request_id in owners else NOT_FOUND
+    return results
+
+
+def accept(request_id, donor):
+    """
+    Assign a pending request to ``donor``.
+
+    Returns ``(result, blood_request)``. Only one of any number of concurrent
+    callers gets ``ACCEPTED``; the rest get ``ALREADY_TAKEN``.
+    """
+    result = accept_many([request_id], donor)[request_id]
+    if result == NOT_FOUND:
+        return result, None
+    return result, BloodRequest.objects.get(request_id=request_id)
+
+
+def cancel_many(request_ids, user):
+    """
+    Cancel every pending request in ``request_ids`` that ``user`` may cancel
+    (their own, or any request for staff). Returns ``{request_id: result}``.
+    """
+    request_ids = list(dict.fromkeys(request_ids))
+    queryset = BloodRequest.objects.filter(request_id__in=request_ids)
+    if not user.is_staff:
+        queryset = queryset.filter(requested_by=user)
+    moved = _transition(queryset, 'Pending', 'Cancelled')
+    results = {blood_request.request_id: CANCELLED for blood_request in moved}
+
+    rest = [request_id for request_id in request_ids if request_id not in results]
+    owners = _owners(rest) if rest else {}
+    for request_id in rest:
+        if request_id not in owners:
+            results[request_id] = NOT_FOUND
+        elif not user.is_staff and owners[request_id] != user.pk:
+            results[request_id] = NOT_ALLOWED
+        else:
+            results[request_id] = ALREADY_TAKEN
+    return results
@@ -0,0 +1,310 @@
+"""
+Compact JSON API used by ``static/js/main.js``.
+
+Plain function views returning ``JsonResponse``; session authentication and
+CSRF protection work as they do for the HTML views (send the ``csrftoken``
+cookie back in an ``X-CSRFToken`` header). Listings are serialized straight
+from ``values()`` rows without building model instances, and batch endpoints
+take at most ``API_BATCH_LIMIT`` ids per call.
+"""
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods, require_POST
+
+from . import actions
+from .caching import cache_stats
+from .ids import next_request_id
+from .matching import nearby_donors, refresh_donors
+from .models import BloodRequest
+from .pagination import REQUEST_FILTERS, get_page_size, get_request_filters, paginate
+from .search import search
+from .supply import get_trend_days, matrix, record_donor_changes, trend
+
+User = get_user_model()
+
+DEFAULT_BATCH_LIMIT = 100
+DEFAULT_MAX_RADIUS_KM = 100
+
+LIST_FIELDS = (
+    'id', 'request_id', 'blood_group', 'units_required', 'hospital_name', 'location',
+    'emergency_level', 'status', 'created_at',
+)
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'separators': (',', ':')})
+
+
+def error(message, status=400, **extra):
+    return json_response({'error': message, **extra}, status=status)
+
+
+def api_login_required(view):
+    """Like ``login_required``, but answers 401 instead of redirecting"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return error('Authentication required', status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def read_json(request):
+    """The request body as a dict; raises ValueError for anything else"""
+    data = json.loads(request.body or b'{}')
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    return data
+
+
+def read_batch(data, key):
+    """A non-empty, size-limited list of strings from ``data[key]``"""
+    values = data.get(key)
+    limit = getattr(settings, 'API_BATCH_LIMIT', DEFAULT_BATCH_LIMIT)
+    if not isinstance(values, list) or not values or not all(isinstance(v, str) for v in values):
+        raise ValueError(f'"{key}" must be a non-empty list of strings')
+    if len(values) > limit:
+        raise ValueError(f'At most {limit} items per call')
+    return values
+
+
+@api_login_required
+@require_http_methods(['GET', 'POST'])
+def requests_collection(request):
+    """GET: one page of requests. POST: create a request"""
+    if request.method == 'POST':
+        return create_request(request)
+
+    filters = get_request_filters(request.GET)
+    page = paginate(
+        BloodRequest.objects.filter(**filters).values(*LIST_FIELDS),
+        cursor=request.GET.get('cursor'),
+        page_size=get_page_size(request.GET.get('page_size')),
+    )
+    return json_response({
+        'results': page.object_list,
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    })
+
+
+def create_request(request):
+    try:
+        data = read_json(request)
+    except ValueError as exc:
+        return error(str(exc))
+
+    errors = {}
+    if data.get('blood_group') not in REQUEST_FILTERS['blood_group']:
+        errors['blood_group'] = 'Unknown blood group'
+    if data.get('emergency_level') not in REQUEST_FILTERS['emergency_level']:
+        errors['emergency_level'] = 'Unknown emergency level'
+    units = data.get('units_required')
+    if not isinstance(units, int) or isinstance(units, bool) or units < 1:
+        errors['units_required'] = 'Must be a positive integer'
+    for field, max_length in (('hospital_name', 200), ('location', 200)):
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip() or len(value) > max_length:
+            errors[field] = f'Required, at most {max_length} characters'
+    if errors:
+        return error('Invalid request', errors=errors)
+
+    blood_request = BloodRequest.objects.create(
+        request_id=next_request_id(),
+        blood_group=data['blood_group'],
+        units_required=units,
+        hospital_name=data['hospital_name'].strip(),
+        location=data['location'].strip(),
+        emergency_level=data['emergency_level'],
+        requested_by=request.user,
+    )
+    return json_response({'request_id': blood_request.request_id, 'status': blood_request.status}, status=201)
+
+
+@api_login_required
+@require_POST
+def accept_request(request, request_id):
+    """Accept one request for the current user"""
+    result = actions.accept_many([request_id], request.user)[request_id]
+    status = {actions.ACCEPTED: 200, actions.NOT_FOUND: 404}.get(result, 409)
+    return json_response({'request_id': request_id, 'result': result}, status=status)
+
+
+@api_login_required
+@require_POST
+def accept_requests(request):
+    """Accept many requests for the current user: {"request_ids": [...]}"""
+    try:
+        request_ids = read_batch(read_json(request), 'request_ids')
+    except ValueError as exc:
+        return error(str(exc))
+    return json_response({'results': actions.accept_many(request_ids, request.user)})
+
+
+@api_login_required
+@require_POST
+def cancel_requests(request):
+    """Cancel many of the user's own requests (any, for staff): {"request_ids": [...]}"""
+    try:
+        request_ids = read_batch(read_json(request), 'request_ids')
+    except ValueError as exc:
+        return error(str(exc))
+    return json_response({'results': actions.cancel_many(request_ids, request.user)})
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def request_donors(request, request_id):
+    """Available compatible donors near a request, nearest first: ?radius_km=10&limit=25"""
+    blood_request = BloodRequest.objects.filter(request_id=request_id).first()
+    if blood_request is None:
+        return error('Request not found', status=404)
+    if blood_request.requested_by_id != request.user.pk and not request.user.is_staff:
+        return error('Only the requester can list donors', status=403)
+
+    max_radius = getattr(settings, 'MATCH_RADIUS_MAX_KM', DEFAULT_MAX_RADIUS_KM)
+    try:
+        radius_km = float(request.GET.get('radius_km', getattr(settings, 'MATCH_RADIUS_KM', 25)))
+    except ValueError:
+        return error('"radius_km" must be a number')
+    if not 0 < radius_km <= max_radius:
+        return error(f'"radius_km" must be above 0 and at most {max_radius}')
+
+    donors = nearby_donors(blood_request, radius_km, limit=get_page_size(request.GET.get('limit')))
+    return json_response({
+        'request_id': request_id,
+        'radius_km': radius_km,
+        'located': blood_request.latitude is not None,
+        'results': [
+            {
+                'id': donor.pk, 'full_name': donor.full_name, 'blood_group': donor.blood_group,
+                'city': donor.city, 'distance_km': donor.distance_km,
+            }
+            for donor in donors
+        ],
+    })
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def search_collection(request):
+    """Ranked search: ?q=apollo chennai&kind=requests (default) or kind=donors (staff only)"""
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('kind', 'requests')
+    if not query:
+        return error('"q" is required')
+    limit = get_page_size(request.GET.get('limit'))
+
+    if kind == 'requests':
+        queryset = BloodRequest.objects.filter(**get_request_filters(request.GET)).only(*LIST_FIELDS)
+        results = [
+            {**{field: getattr(blood_request, field) for field in LIST_FIELDS}, 'score': blood_request.search_score}
+            for blood_request in search('request', query, limit, queryset)
+        ]
+    elif kind == 'donors':
+        if not request.user.is_staff:
+            return error('Admin privileges required', status=403)
+        queryset = User.objects.only('pk', 'full_name', 'blood_group', 'city', 'is_available')
+        results = [
+            {
+                'id': donor.pk, 'full_name': donor.full_name, 'blood_group': donor.blood_group,
+                'city': donor.city, 'is_available': donor.is_available, 'score': donor.search_score,
+            }
+            for donor in search('donor', query, limit, queryset)
+        ]
+    else:
+        return error('"kind" must be requests or donors')
+    return json_response({'query': query, 'kind': kind, 'results': results})
+
+
+@api_login_required
+@require_POST
+def update_availability(request):
+    """Set the current user's availability: {"available": true}"""
+    try:
+        available = read_json(request).get('available')
+    except ValueError as exc:
+        return error(str(exc))
+    if not isinstance(available, bool):
+        return error('"available" must be true or false')
+
+    request.user.is_available = available
+    request.user.save(update_fields=['is_available'])
+    return json_response({'available': available})
+
+
+@api_login_required
+@require_POST
+def bulk_availability(request):
+    """Staff only: set availability for many donors, {"updates": [{"id": 1, "available": false}, ...]}"""
+    if not request.user.is_staff:
+        return error('Admin privileges required', status=403)
+    try:
+        updates = read_json(request).get('updates')
+    except ValueError as exc:
+        return error(str(exc))
+
+    limit = getattr(settings, 'API_BATCH_LIMIT', DEFAULT_BATCH_LIMIT)
+    if not isinstance(updates, list) or not updates or len(updates) > limit:
+        return error(f'"updates" must be a list of 1 to {limit} items')
+    by_value = {True: [], False: []}
+    for item in updates:
+        if (not isinstance(item, dict) or not isinstance(item.get('id'), int)
+                or not isinstance(item.get('available'), bool)):
+            return error('Each update needs an integer "id" and a boolean "available"')
+        by_value[item['available']].append(item['id'])
+
+    # at most two UPDATE statements, whatever the batch size
+    updated = 0
+    with transaction.atomic():
+        for available, pks in by_value.items():
+            if not pks:
+                continue
+            # queryset updates skip User.save, so the supply rollup is moved here
+            flipped = list(
+                User.objects.filter(pk__in=pks).exclude(is_available=available)
+                .select_for_update().values_list(*User.SUPPLY_FIELDS)
+            )
+            updated += User.objects.filter(pk__in=pks).update(is_available=available, updated_at=timezone.now())
+            record_donor_changes(
+                ((blood_group, city, was_available, is_active), (blood_group, city, available, is_active))
+                for blood_group, city, was_available, is_active in flipped
+            )
+    refresh_donors(by_value[True] + by_value[False])
+    return json_response({'updated': updated})
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def cache_statistics(request):
+    """Staff only: request list cache hits and misses for this worker process"""
+    if not request.user.is_staff:
+        return error('Admin privileges required', status=403)
+    return json_response(cache_stats())
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def supply_demand(request):
+    """
+    Staff only: the supply-vs-demand matrix, largest shortage first
+    (?limit= cities). With ?city=, that city only plus its history
+    (&blood_group=, &days=).
+    """
+    if not request.user.is_staff:
+        return error('Admin privileges required', status=403)
+    city = request.GET.get('city', '').strip()
+    data = {'results': matrix(city or None, limit=get_page_size(request.GET.get('limit')))}
+    if city:
+        blood_group = request.GET.get('blood_group')
+        if blood_group not in REQUEST_FILTERS['blood_group']:
+            blood_group = None
+        days = get_trend_days(request.GET.get('days'))
+        data.update(city=city, blood_group=blood_group, days=days, history=trend(city, blood_group, days))
+    return json_response(data)
@@ -0,0 +1,123 @@
+"""
+Hot/cold split of the request table.
+
+``manage.py archive_requests`` moves Completed and Cancelled requests that
+have not changed for ``ARCHIVE_AFTER_DAYS`` out of ``blood_requests`` into
+``blood_requests_archive``. The archive table keeps the same ids and
+columns. The run walks the primary key in windows of ``--batch-size`` ids.
+Each window is its own short transaction: its closed rows are locked, copied,
+then deleted from the live table. A run can be stopped at any point, and the
+next run picks up where it left off.
+
+Listings, the match index and search only ever read the live table. History
+pages and exports opt in to the archive. The statistics counters describe
+the whole history, so they keep counting archived requests, and
+``request_stats`` recounts both tables. An archived request loses its
+notification rows.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .caching import invalidate_listings_on_commit
+from .models import ArchivedRequest, BloodRequest, Notification, NotificationJob
+from .search import unindex_objects
+
+
+CLOSED_STATUSES = ('Completed', 'Cancelled')
+DEFAULT_ARCHIVE_AFTER_DAYS = 180
+DEFAULT_BATCH_SIZE = 1000
+CHUNK_SIZE = 500
+
+COPIED_COLUMNS = [field.column for field in ArchivedRequest._meta.concrete_fields if field.name != 'archived_at']
+
+
+def archive_cutoff(days=None):
+    """Requests closed and untouched since before this moment are archived"""
+    if days is None:
+        days = getattr(settings, 'ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable(cutoff):
+    return BloodRequest.objects.filter(status__in=CLOSED_STATUSES, updated_at__lt=cutoff)
+
+
+def request_model(archived=False):
+    """The model a listing reads: the live table unless history is asked for"""
+    return ArchivedRequest if archived else BloodRequest
+
+
+def _move(ids, archived_at):
+    """Copy rows to the archive inside the database, then delete them from the live table"""
+    quote = connection.ops.quote_name
+    live = quote(BloodRequest._meta.db_table)
+    archive = quote(ArchivedRequest._meta.db_table)
+    columns = ', '.join(quote(column) for column in COPIED_COLUMNS)
+    stamp = connection.ops.adapt_datetimefield_value(archived_at)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                f'INSERT INTO {archive} ({columns}, {quote("archived_at")}) '
+                f'SELECT {columns}, %s FROM {live} WHERE id IN ({placeholders})',
+                [stamp, *chunk],
+            )
+            # a plain DELETE: the ORM's per-row delete signals would also take
+            # the requests out of the counters, which still count archived history
+            cursor.execute(f'DELETE FROM {live} WHERE id IN ({placeholders})', chunk)
+
+
+def archive_range(cutoff):
+    """(first, last) id of the archivable requests, or None when there are none"""
+    bounds = archivable(cutoff).aggregate(first=Min('pk'), last=Max('pk'))
+    return None if bounds['first'] is None else (bounds['first'], bounds['last'])
+
+
+def archive_batch(cutoff, after, batch_size=DEFAULT_BATCH_SIZE):
+    """Archive the archivable requests with ids in (after, after + batch_size]; returns how many moved"""
+    now = timezone.now()
+    with transaction.atomic():
+        # only the key is constrained in SQL: given a status too, planners
+        # without statistics walk the status index instead of the key range
+        window = (
+            BloodRequest.objects.filter(pk__gt=after, pk__lte=after + batch_size).order_by()
+            .select_for_update().values_list('pk', 'status', 'updated_at')
+        )
+        rows = [row for row in window if row[1] in CLOSED_STATUSES and row[2] < cutoff]
+        if not rows:
+            return 0
+        ids = [row[0] for row in rows]
+        # _move skips the ORM cascade, so dependents go first
+        Notification.objects.filter(blood_request_id__in=ids).delete()
+        NotificationJob.objects.filter(blood_request_id__in=ids).delete()
+        _move(ids, now)
+        unindex_objects('request', ids)
+        invalidate_listings_on_commit({row[1] for row in rows})
+    return len(rows)
+
+
+def table_size(model):
+    """(rows, bytes on disk with indexes) of a model's table; bytes is None when the backend cannot tell"""
+    table = model._meta.db_table
+    queries = {
+        'sqlite': 'SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                  '(SELECT name FROM sqlite_master WHERE tbl_name = %s)',
+        'mysql': 'SELECT data_length + index_length FROM information_schema.tables '
+                 'WHERE table_schema = DATABASE() AND table_name = %s',
+        'postgresql': 'SELECT pg_total_relation_size(%s)',
+    }
+    size = None
+    if connection.vendor in queries:
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(queries[connection.vendor], [table])
+                size = cursor.fetchone()[0]
+        except DatabaseError:
+            # e.g. SQLite built without the dbstat table
+            pass
+    return model.objects.count(), size
@@ -0,0 +1,150 @@
+"""
+Cache for the pending-request lists behind ``donor_dashboard`` and
+``blood_requests``.
+
+Entries are never deleted on a write. Every key embeds version stamps
+instead, and a write just replaces the stamps it affects:
+
+* one stamp per (city, request blood group), read by the dashboard list of
+  every donor who could give to that group in that city;
+* one stamp per status, read by listing pages filtered on that status (an
+  unfiltered listing reads all of them).
+
+After a write the next read builds a new key, and the superseded entries
+age out with ``REQUEST_CACHE_TIMEOUT``. Stamps are read with one
+``get_many`` and written with one ``set_many``.
+
+The cache alias is ``REQUEST_CACHE_ALIAS`` (``default``: local memory unless
+configured otherwise). ``cache_stats()`` reports the per-process hit and miss
+counters.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .matching import normalize_city, recipient_groups_for
+from .models import BloodRequest
+
+
+PREFIX = 'reqcache'
+STATUSES = [value for value, _ in BloodRequest.STATUS_CHOICES]
+
+_counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_counters_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'REQUEST_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'REQUEST_CACHE_TIMEOUT', 300)
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def cache_stats():
+    """Hit/miss/invalidation counters for this process, plus the hit ratio"""
+    with _counters_lock:
+        stats = dict(_counters)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
+
+
+def reset_cache_stats():
+    with _counters_lock:
+        for name in _counters:
+            _counters[name] = 0
+
+
+def _hash(value):
+    # city names and cursors are user controlled; keep keys short and safe
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def _group_stamp(city, blood_group):
+    return f'{PREFIX}:stamp:group:{_hash(normalize_city(city))}:{blood_group}'
+
+
+def _status_stamp(status):
+    return f'{PREFIX}:stamp:status:{status.replace(" ", "_")}'
+
+
+def _stamps(keys):
+    """Current values of the given stamps, joined into one key fragment"""
+    cache = _cache()
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # a stamp lost to eviction must not fall back to a value used before
+        stamp = time.time_ns()
+        for key in missing:
+            cache.add(key, stamp, None)
+        found.update(cache.get_many(missing))
+    return '.'.join(str(found.get(key, 0)) for key in keys)
+
+
+def _cached(key, build):
+    cache = _cache()
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+    value = build()
+    cache.set(key, value, _timeout())
+    return value
+
+
+def invalidate(location, blood_group, statuses):
+    """Retire every cached list a request with these values can appear in"""
+    stamp = time.time_ns()
+    keys = [_group_stamp(location, blood_group)]
+    keys += [_status_stamp(status) for status in statuses if status]
+    _cache().set_many({key: stamp for key in keys}, None)
+    _count('invalidations')
+
+
+def invalidate_on_commit(location, blood_group, statuses):
+    """
+    ``invalidate`` now and again once the surrounding transaction commits,
+    so a reader that cached the old rows in between is retired as well.
+    """
+    invalidate(location, blood_group, statuses)
+    transaction.on_commit(lambda: invalidate(location, blood_group, statuses))
+
+
+def invalidate_listings_on_commit(statuses):
+    """Retire the listing pages of these statuses, for closed requests, which no dashboard shows"""
+    def bump():
+        _cache().set_many({_status_stamp(status): time.time_ns() for status in statuses}, None)
+        _count('invalidations')
+    bump()
+    transaction.on_commit(bump)
+
+
+def dashboard_requests(user, build, limit=10):
+    """The donor dashboard list for (blood group, city), built on a miss"""
+    city = normalize_city(user.city)
+    groups = recipient_groups_for(user.blood_group)
+    stamps = _stamps([_group_stamp(city, group) for group in groups])
+    key = f'{PREFIX}:dash:{user.blood_group}:{_hash(city)}:{limit}:{stamps}'
+    return _cached(key, lambda: list(build()))
+
+
+def listing_page(filters, cursor, page_size, build):
+    """One page of the blood_requests listing, built on a miss"""
+    status = filters.get('status')
+    stamps = _stamps([_status_stamp(s) for s in ([status] if status else STATUSES)])
+    params = sorted(filters.items()) + [('cursor', cursor or ''), ('page_size', page_size)]
+    page = '&'.join(f'{name}={value}' for name, value in params)
+    key = f'{PREFIX}:list:{_hash(page)}:{stamps}'
+    return _cached(key, build)
@@ -0,0 +1,25 @@
+import os
+
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def request_cache_is_shared(app_configs, **kwargs):
+    """The request list cache must be shared once gunicorn runs more than one worker"""
+    alias = getattr(settings, 'REQUEST_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    # gunicorn's default worker count
+    workers = int(os.environ.get('WEB_CONCURRENCY') or 1)
+    if workers > 1 and backend.endswith('.LocMemCache'):
+        timeout = getattr(settings, 'REQUEST_CACHE_TIMEOUT', 300)
+        return [Warning(
+            f'The request list cache ({alias!r}) is local memory, but WEB_CONCURRENCY runs {workers} workers.',
+            hint=(
+                'A write only bumps the version stamps of the worker that made it, so the others keep '
+                f'serving the old lists for up to REQUEST_CACHE_TIMEOUT ({timeout} s). Set REDIS_URL, '
+                'or point REQUEST_CACHE_ALIAS at another shared cache.'
+            ),
+            id='core.W001',
+        )]
+    return []
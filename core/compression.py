@@ -0,0 +1,82 @@
+"""
+Compression of dynamic responses.
+
+``CompressionMiddleware`` answers with brotli when the client accepts
+``br`` and the ``brotli`` package is installed, and with gzip (Django's
+``GZipMiddleware``) otherwise. Both add up to ``max_random_bytes`` of
+random padding, so the compressed length of a page carrying a CSRF token
+or echoing the query does not leak its contents (BREACH). Brotli is applied
+to complete responses only, so streaming responses (exports) stay gzip.
+The Server-Sent Events feed is never compressed, because a compressor
+would hold events back. Static files never reach this middleware:
+WhiteNoise serves its own precompressed copies.
+
+``COMPRESSION_BROTLI_QUALITY`` (default 5) trades CPU for size; levels
+4-6 compress HTML smaller than gzip at about the same cost.
+"""
+import re
+import secrets
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+DEFAULT_BROTLI_QUALITY = 5
+MIN_SIZE = 200
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+
+def accepts_brotli(request):
+    return brotli is not None and bool(re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def _padding(size):
+    # a metadata meta-block (RFC 7932, 9.2): MNIBBLES=0, one MSKIPLEN byte; decoders skip its contents
+    header = (3 << 1) | (1 << 4) | ((size - 1) << 6)
+    return header.to_bytes(2, 'little') + secrets.token_bytes(size)
+
+
+def compress_brotli(content, quality, max_random_bytes=0):
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+    compressed = compressor.process(content)
+    if max_random_bytes:
+        # flush() leaves the stream byte-aligned between meta-blocks
+        compressed += compressor.flush() + _padding(1 + secrets.randbelow(min(max_random_bytes, 256)))
+    return compressed + compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+
+    async def __acall__(self, request):
+        # compressing is CPU work with no I/O: skip the thread MiddlewareMixin would use
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        if response.streaming or not accepts_brotli(request):
+            return super().process_response(request, response)
+        if len(response.content) < MIN_SIZE or response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)
+        compressed = compress_brotli(response.content, quality, self.max_random_bytes)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # a compressed body is no longer byte-for-byte the one a strong ETag names
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
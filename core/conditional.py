@@ -0,0 +1,81 @@
+"""
+Conditional GET for the dashboard and listing pages.
+
+A page's validators come from the data it shows, not from its HTML: the
+ETag hashes the requests on the page (id, ``updated_at`` and priority),
+the viewer's own fields, the full URL, any extra values the view passes
+(such as the admin counters) and the current release of the templates.
+``Last-Modified`` is the newest ``updated_at`` on the page. The rows come
+from the same (usually cached) queries the view runs anyway. When the
+client's copy still matches, the view answers 304 without rendering the
+template.
+
+A request that is deleted or archived drops off the page, which changes
+the hash, so the ETag covers removals that ``Last-Modified`` alone would
+miss. Pages with pending flash messages get no validators: the message
+must be rendered, and it must not be cached.
+
+Responses are ``Cache-Control: private, no-cache``, so browsers store them
+but revalidate on every visit, and shared caches do not store them.
+"""
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib import messages
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+USER_FIELDS = ('pk', 'last_login', 'full_name', 'blood_group', 'city', 'is_available', 'is_staff')
+
+
+@lru_cache(maxsize=None)
+def release():
+    """Hash of the templates and the static manifest, so a deploy retires every ETag"""
+    digest = hashlib.blake2b(digest_size=8)
+    paths = []
+    for engine in settings.TEMPLATES:
+        for directory in engine.get('DIRS', []):
+            paths += sorted(path for path in Path(directory).rglob('*') if path.is_file())
+    manifest = Path(settings.STATIC_ROOT or '', 'staticfiles.json')
+    if settings.STATIC_ROOT and manifest.is_file():
+        paths.append(manifest)
+    for path in paths:
+        digest.update(str(path).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def page_validators(request, rows, extra=()):
+    """(etag, last_modified) of a page showing ``rows`` to ``request.user``"""
+    digest = hashlib.blake2b(digest_size=16)
+    user = request.user
+    parts = [release(), request.get_full_path(), *(getattr(user, name, None) for name in USER_FIELDS), *extra]
+    newest = None
+    for row in rows:
+        parts += [row.pk, row.updated_at, getattr(row, 'priority', None)]
+        if newest is None or row.updated_at > newest:
+            newest = row.updated_at
+    digest.update(repr(parts).encode())
+    return digest.hexdigest(), newest
+
+
+def render_conditional(request, template_name, context, rows, extra=()):
+    """``render``, unless the client's copy is current: then 304 without rendering"""
+    if len(messages.get_messages(request)):
+        response = render(request, template_name, context)
+    else:
+        etag, newest = page_validators(request, rows, extra)
+        # HTTP dates have whole seconds
+        last_modified = int(newest.timestamp()) if newest else None
+        response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+        if response is None:
+            response = render(request, template_name, context)
+        response.headers['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
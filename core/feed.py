@@ -0,0 +1,265 @@
+"""
+Live request feed.
+
+Saved requests are published as small JSON messages to a broker, and
+``REQUEST_FEED_BROKER`` names the broker class. The default
+``DatabaseBroker`` passes messages through the ``feed_events`` table. A save
+in any web worker or background process then reaches donors connected to
+any other process. ``InProcessBroker`` only reaches subscribers in the
+publishing process. It serializes messages just as they would cross a
+process boundary, so it suits a single process and the tests. Another
+broker only has to implement ``publish``/``subscribe``/``unsubscribe``.
+
+Each process runs one ``FeedHub``. The hub starts listening on the broker
+when the first donor connects, so processes that only publish never poll.
+It fans events out to the donors connected to it. Subscribers are bucketed
+by city and carry their compatibility bit, so an event only touches
+connections that can act on it. An idle connection is one small bounded
+``asyncio.Queue``; it holds no thread and no database connection.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .matching import GROUP_BITS, RECEIVES_FROM_MASK, normalize_city
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'blood-requests'
+
+EVENT_FIELDS = (
+    'request_id', 'blood_group', 'units_required', 'hospital_name',
+    'location', 'emergency_level', 'status',
+)
+
+
+class InProcessBroker:
+    """Pub/sub within one process, with the message format of a real broker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+
+    def unsubscribe(self, channel, callback):
+        with self._lock:
+            self._callbacks.get(channel, []).remove(callback)
+
+
+class DatabaseBroker(InProcessBroker):
+    """
+    Pub/sub between processes through the ``feed_events`` table.
+
+    Publishing is one INSERT. A process with subscribers reads the rows past
+    the last id it has seen every ``REQUEST_FEED_POLL_SECONDS`` (default 1),
+    from one background thread. Ids are handed out before commit, so an id
+    skipped over may still commit. Such gaps are re-read for
+    ``GAP_SECONDS`` before they are given up. Every ``PRUNE_EVERY``
+    publishes, rows older than ``REQUEST_FEED_RETENTION_SECONDS`` (default
+    600) are deleted.
+    """
+    GAP_SECONDS = 30
+    PRUNE_EVERY = 100
+
+    def __init__(self):
+        super().__init__()
+        self._published = itertools.count(1)
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_id = None
+        # id -> monotonic time it was first missed
+        self.gaps = {}
+
+    def publish(self, channel, message):
+        from .models import FeedEvent
+
+        FeedEvent.objects.create(channel=channel, message=message)
+        if next(self._published) % self.PRUNE_EVERY == 0:
+            retention = getattr(settings, 'REQUEST_FEED_RETENTION_SECONDS', 600)
+            FeedEvent.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=retention)).delete()
+
+    def subscribe(self, channel, callback):
+        super().subscribe(channel, callback)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='feed-broker', daemon=True)
+                self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @staticmethod
+    def _latest_id():
+        from .models import FeedEvent
+
+        return FeedEvent.objects.aggregate(last=Max('id'))['last'] or 0
+
+    def poll(self):
+        """Hand the messages committed since the last poll to the subscribers"""
+        from .models import FeedEvent
+
+        rows = FeedEvent.objects.filter(Q(id__gt=self.last_id) | Q(id__in=list(self.gaps))).order_by('id')
+        now = time.monotonic()
+        for pk, channel, message in rows.values_list('id', 'channel', 'message'):
+            self.gaps.pop(pk, None)
+            if pk > self.last_id:
+                for missing in range(self.last_id + 1, pk):
+                    self.gaps[missing] = now
+                self.last_id = pk
+            super().publish(channel, message)
+        for pk, missed_at in list(self.gaps.items()):
+            if now - missed_at > self.GAP_SECONDS:
+                # rolled back, or taken by another auto-increment step
+                del self.gaps[pk]
+
+    def _run(self):
+        interval = getattr(settings, 'REQUEST_FEED_POLL_SECONDS', 1)
+        while not self._stop.is_set():
+            try:
+                close_old_connections()
+                if self.last_id is None:
+                    # only what is published from now on
+                    self.last_id = self._latest_id()
+                else:
+                    self.poll()
+            except Exception:
+                logger.exception('Reading the request feed failed')
+            self._stop.wait(interval)
+        connection.close()
+
+
+class Subscription:
+    """One connected donor: a bounded queue on the loop that serves them"""
+
+    def __init__(self, blood_group, city, maxsize):
+        self.bit = GROUP_BITS.get(blood_group, 0)
+        self.city = normalize_city(city)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, event):
+        """Queue an event; a consumer that fell behind loses its oldest one"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class FeedHub:
+    """Fans broker messages out to the subscriptions in this process"""
+
+    def __init__(self, broker, queue_size=100):
+        self.broker = broker
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._by_city = {}
+        self._listening = False
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._by_city.values())
+
+    def subscribe(self, blood_group, city):
+        """Register a donor; must be called from the event loop serving them"""
+        subscription = Subscription(blood_group, city, self.queue_size)
+        with self._lock:
+            self._by_city.setdefault(subscription.city, set()).add(subscription)
+            listen, self._listening = not self._listening, True
+        if listen:
+            self.broker.subscribe(CHANNEL, self.dispatch)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._by_city.get(subscription.city)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    del self._by_city[subscription.city]
+
+    def publish(self, event):
+        self.broker.publish(CHANNEL, json.dumps(event))
+
+    def dispatch(self, message):
+        """Broker callback; may run on any thread"""
+        event = json.loads(message)
+        mask = RECEIVES_FROM_MASK.get(event.get('blood_group'), 0)
+        with self._lock:
+            targets = [
+                sub for sub in self._by_city.get(normalize_city(event.get('location')), ())
+                if sub.bit & mask
+            ]
+        for sub in targets:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # the loop serving this connection has shut down
+                self.unsubscribe(sub)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                broker_class = import_string(
+                    getattr(settings, 'REQUEST_FEED_BROKER', 'core.feed.DatabaseBroker')
+                )
+                _hub = FeedHub(broker_class(), getattr(settings, 'REQUEST_FEED_QUEUE_SIZE', 100))
+    return _hub
+
+
+def reset_hub():
+    """Drop this process's hub, closing its broker; for tests"""
+    global _hub
+    with _hub_lock:
+        hub, _hub = _hub, None
+    if hub is not None and hasattr(hub.broker, 'close'):
+        hub.broker.close()
+
+
+def request_event(blood_request, kind):
+    event = {field: getattr(blood_request, field) for field in EVENT_FIELDS}
+    event['type'] = kind
+    event['id'] = blood_request.pk
+    return event
+
+
+def publish_request(blood_request, kind='updated'):
+    """Announce a created or changed request to every connected donor"""
+    get_hub().publish(request_event(blood_request, kind))
+
+
+def format_sse(event):
+    data = json.dumps(event, separators=(',', ':'))
+    return f'event: {event["type"]}\nid: {event["id"]}\ndata: {data}\n\n'
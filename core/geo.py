@@ -0,0 +1,170 @@
+"""
+Coordinates for donors and requests, without any network lookup.
+
+``geocode`` resolves free text such as "Adyar, Chennai" against an offline
+gazetteer (``core/data/gazetteer.csv``, or the file named by the
+``GAZETTEER_PATH`` setting), trying the most specific comma-separated part
+first.
+
+``GeoGrid`` groups points by place (their exact coordinates), then by
+compatibility mask. Stored positions are gazetteer centroids, so a few
+hundred places hold every donor. Places are bucketed into square cells of
+about ``cell_km`` a side. A radius query measures the distance to each place
+in the cells that overlap the search circle, once per place rather than
+once per donor, then walks the places nearest first and stops at ``limit``.
+Incompatible donors are skipped without looking at them. Cells are laid out
+in plain degrees, which is fine away from the poles and the antimeridian
+(all of India).
+"""
+import csv
+import heapq
+import itertools
+import math
+import threading
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+DEFAULT_GAZETTEER = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points, in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _load_gazetteer():
+    path = getattr(settings, 'GAZETTEER_PATH', None) or DEFAULT_GAZETTEER
+    places = {}
+    with open(path, newline='', encoding='utf-8') as source:
+        for row in csv.DictReader(source):
+            places[row['name'].strip().casefold()] = (float(row['latitude']), float(row['longitude']))
+    return places
+
+
+def get_gazetteer():
+    """Place name (casefolded) -> (latitude, longitude), loaded once per process"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = _load_gazetteer()
+    return _gazetteer
+
+
+def geocode(text):
+    """(latitude, longitude) for a city or location, or None if no part of it is known"""
+    if not text:
+        return None
+    places = get_gazetteer()
+    for part in text.split(','):
+        point = places.get(part.strip().casefold())
+        if point:
+            return point
+    return None
+
+
+class GeoGrid:
+    """Points grouped by place, places bucketed by grid cell"""
+
+    def __init__(self, cell_km=5.0):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.clear()
+
+    def clear(self):
+        # (lat, lon) -> mask -> {pk: sequence number}
+        self._places = {}
+        # (row, col) -> {(lat, lon): None}
+        self._cells = {}
+        self._keys = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def place_count(self):
+        return len(self._places)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def put(self, pk, lat, lon, mask):
+        key = ((lat, lon), mask)
+        if self._keys.get(pk) == key:
+            return
+        self.remove(pk)
+        by_mask = self._places.get(key[0])
+        if by_mask is None:
+            by_mask = self._places[key[0]] = {}
+            self._cells.setdefault(self._cell(lat, lon), {})[key[0]] = None
+        by_mask.setdefault(mask, {})[pk] = next(self._sequence)
+        self._keys[pk] = key
+
+    def remove(self, pk):
+        key = self._keys.pop(pk, None)
+        if key is None:
+            return
+        place, mask = key
+        by_mask = self._places[place]
+        bucket = by_mask[mask]
+        del bucket[pk]
+        if not bucket:
+            del by_mask[mask]
+            if not by_mask:
+                del self._places[place]
+                cell = self._cell(*place)
+                del self._cells[cell][place]
+                if not self._cells[cell]:
+                    del self._cells[cell]
+
+    def places_within(self, lat, lon, radius_km):
+        """(distance_km, place) pairs within ``radius_km``, nearest first"""
+        dlat = radius_km / KM_PER_DEGREE
+        # the circle is widest (in degrees of longitude) at its edge nearest a pole
+        widest = min(abs(lat) + dlat, 89.9)
+        dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+        row_lo, col_lo = self._cell(lat - dlat, lon - dlon)
+        row_hi, col_hi = self._cell(lat + dlat, lon + dlon)
+
+        found = []
+        for row in range(row_lo, row_hi + 1):
+            for col in range(col_lo, col_hi + 1):
+                for place in self._cells.get((row, col), ()):
+                    distance = haversine_km(lat, lon, *place)
+                    if distance <= radius_km:
+                        found.append((distance, place))
+        found.sort()
+        return found
+
+    def within(self, lat, lon, radius_km, bit=None, limit=None):
+        """
+        (distance_km, pk) pairs within ``radius_km``, nearest first. Points at
+        the same place come most recently added first.
+        """
+        found = []
+        for distance, place in self.places_within(lat, lon, radius_km):
+            buckets = [
+                reversed(bucket.items())
+                for mask, bucket in self._places[place].items()
+                if bit is None or mask & bit
+            ]
+            newest = heapq.merge(*buckets, key=itemgetter(1), reverse=True)
+            if limit is not None:
+                newest = itertools.islice(newest, limit - len(found))
+            found.extend((distance, pk) for pk, _ in newest)
+            if limit is not None and len(found) >= limit:
+                break
+        return found
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.archive import DEFAULT_BATCH_SIZE, archivable, archive_batch, archive_cutoff, archive_range, table_size
+from core.models import ArchivedRequest, BloodRequest
+
+
+def _size(rows, size):
+    if size is None:
+        return f'{rows} rows'
+    return f'{rows} rows, {size / 1024 / 1024:.1f} MiB'
+
+
+class Command(BaseCommand):
+    help = 'Move closed requests older than a cutoff into the archive table, in short batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            help='Archive requests closed before this many days ago (default: ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Request ids covered per batch (and transaction)')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches, to leave room for other writers')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches; rerun to go on')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be moved')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['older_than_days'])
+        if options['dry_run']:
+            self.stdout.write(f'{archivable(cutoff).count()} requests closed before {cutoff:%Y-%m-%d} would be archived')
+            return
+
+        before = {model: table_size(model) for model in (BloodRequest, ArchivedRequest)}
+        batch_size = max(1, options['batch_size'])
+        moved = batches = 0
+        start = time.perf_counter()
+        bounds = archive_range(cutoff)
+        if bounds:
+            after, last = bounds[0] - 1, bounds[1]
+            while after < last and (options['max_batches'] is None or batches < options['max_batches']):
+                count = archive_batch(cutoff, after, batch_size)
+                after += batch_size
+                moved += count
+                batches += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'batch {batches}: {count} requests, ids up to {after}')
+                if options['sleep'] and count:
+                    time.sleep(options['sleep'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} requests in {batches} batches, {elapsed:.1f}s '
+            f'({moved / elapsed if elapsed else moved:.0f} rows/s)'
+        ))
+        for model in (BloodRequest, ArchivedRequest):
+            self.stdout.write(f'{model._meta.db_table}: {_size(*before[model])} -> {_size(*table_size(model))}')
@@ -0,0 +1,113 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from core import actions
+from core.models import BloodRequest, User
+from core.supply import record_donor_changes
+
+
+def race_accept(request_id, donors, retries=50):
+    """
+    Let every donor accept ``request_id`` at the same moment, one thread each.
+
+    Returns ``(results, elapsed)`` where ``results`` maps donor pk to the
+    action result. SQLite answers concurrent writers with "database is
+    locked", so a locked attempt is retried like a busy client would.
+    """
+    barrier = threading.Barrier(len(donors))
+    results = {}
+
+    def worker(donor):
+        try:
+            barrier.wait()
+            for attempt in range(retries):
+                try:
+                    # accept() reads the row back after committing; a lock error there
+                    # would make the retry of a winning attempt report ALREADY_TAKEN
+                    results[donor.pk] = actions.accept_many([request_id], donor)[request_id]
+                    break
+                except OperationalError as exc:
+                    if 'locked' not in str(exc):
+                        raise
+                    time.sleep(0.001 * (attempt + 1))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(donor,)) for donor in donors]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Fire simultaneous accepts at blood requests and check each has exactly one winner'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32, help='Concurrent donors per request')
+        parser.add_argument('--rounds', type=int, default=10, help='Number of requests to race for')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            requester = User.objects.create_user(
+                username=f'bench-{tag}@example.com', full_name='Bench requester', blood_group='O+', city='Bench'
+            )
+            donors = User.objects.bulk_create(
+                User(username=f'bench-{tag}-{i}@example.com', full_name=f'Bench donor {i}',
+                     blood_group='O-', city='Bench')
+                for i in range(options['threads'])
+            )
+            # bulk_create skips User.save, which keeps the supply rollup
+            record_donor_changes((None, donor._supply_values()) for donor in donors)
+        # bulk_create does not set pks on every backend
+        donors = list(User.objects.filter(username__startswith=f'bench-{tag}-'))
+
+        failures = 0
+        attempts = 0
+        total_time = 0.0
+        try:
+            for round_no in range(options['rounds']):
+                blood_request = BloodRequest.objects.create(
+                    request_id=f'B{tag}{round_no:04}', blood_group='A+', units_required=1,
+                    hospital_name='Bench Hospital', location='Bench', emergency_level='Critical',
+                    requested_by=requester,
+                )
+                results, elapsed = race_accept(blood_request.request_id, donors)
+                close_old_connections()
+                attempts += len(results)
+                total_time += elapsed
+
+                winners = [pk for pk, result in results.items() if result == actions.ACCEPTED]
+                losers = [pk for pk, result in results.items() if result == actions.ALREADY_TAKEN]
+                blood_request.refresh_from_db()
+                ok = (
+                    len(winners) == 1
+                    and len(losers) == len(donors) - 1
+                    and blood_request.assigned_to_id == winners[0]
+                    and blood_request.status == 'In Progress'
+                )
+                failures += not ok
+                self.stdout.write(
+                    f'round {round_no}: {len(winners)} winner(s), {len(losers)} already taken, '
+                    f'{elapsed * 1000:.1f} ms {"ok" if ok else "FAILED"}'
+                )
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=f'bench-{tag}').delete()
+
+        self.stdout.write(
+            f'{attempts} accepts in {total_time:.3f}s ({attempts / total_time:.0f} accepts/s) '
+            f'across {options["rounds"]} requests'
+        )
+        if failures:
+            self.stderr.write(self.style.ERROR(f'{failures} round(s) did not have exactly one winner'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every request had exactly one winner'))
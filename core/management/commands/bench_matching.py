@@ -0,0 +1,61 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.matching import BLOOD_GROUPS, GROUP_WEIGHTS, MatchIndex, can_donate, normalize_city
+
+
+CITIES = ['Chennai', 'Bengaluru', 'Mumbai', 'Delhi', 'Hyderabad', 'Kolkata', 'Pune', 'Ahmedabad',
+          'Jaipur', 'Lucknow', 'Kochi', 'Coimbatore', 'Madurai', 'Mysuru', 'Nagpur', 'Indore']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-memory match index against a linear scan (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--donors', type=int, default=100_000)
+        parser.add_argument('--lookups', type=int, default=2_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        donors = [
+            (pk, rng.choices(BLOOD_GROUPS, GROUP_WEIGHTS)[0], rng.choice(CITIES))
+            for pk in range(1, options['donors'] + 1)
+        ]
+
+        index = MatchIndex()
+        start = time.perf_counter()
+        for pk, group, city in donors:
+            index.update_donor(pk, group, city)
+        build = time.perf_counter() - start
+        self.stdout.write(f'index build: {len(index)} rows in {build * 1000:.1f} ms')
+
+        probes = [(rng.choice(BLOOD_GROUPS), rng.choice(CITIES)) for _ in range(options['lookups'])]
+
+        def donors_scan(group, city):
+            key = normalize_city(city)
+            return [pk for pk, g, c in donors if normalize_city(c) == key and can_donate(g, group)]
+
+        cases = [
+            ('donors_for_request', index.donors_for_request, donors_scan),
+        ]
+        for name, indexed, scan in cases:
+            start = time.perf_counter()
+            hits = sum(len(indexed(group, city)) for group, city in probes)
+            indexed_time = time.perf_counter() - start
+
+            # the scan is far slower, so it only runs over a sample of the probes
+            sample = probes[:max(1, len(probes) // 20)]
+            start = time.perf_counter()
+            for group, city in sample:
+                scan(group, city)
+            scan_time = (time.perf_counter() - start) * len(probes) / len(sample)
+
+            self.stdout.write(
+                f'{name}: {indexed_time / len(probes) * 1e6:.1f} us/lookup indexed, '
+                f'{scan_time / len(probes) * 1e6:.1f} us/lookup scan, '
+                f'{hits / len(probes):.0f} results/lookup, '
+                f'speed-up x{scan_time / indexed_time:.0f}'
+            )
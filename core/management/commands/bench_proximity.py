@@ -0,0 +1,86 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.geo import get_gazetteer, haversine_km
+from core.matching import BLOOD_GROUPS, GROUP_WEIGHTS, MatchIndex, can_donate
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the nearest-donor grid lookup against a brute-force haversine scan (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--donors', type=int, default=500_000)
+        parser.add_argument('--lookups', type=int, default=1_000)
+        parser.add_argument('--radius', type=float, default=10.0, help='Search radius in km')
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--places', type=int, help='Spread donors and hospitals over this many places (default all)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # stored positions are gazetteer centroids (see core.signals); aliases share one
+        places = sorted(set(get_gazetteer().values()))
+        if options['places']:
+            places = rng.sample(places, min(options['places'], len(places)))
+
+        donors = [
+            (pk, rng.choices(BLOOD_GROUPS, GROUP_WEIGHTS)[0], *rng.choice(places))
+            for pk in range(1, options['donors'] + 1)
+        ]
+
+        index = MatchIndex()
+        start = time.perf_counter()
+        for pk, group, lat, lon in donors:
+            index.update_donor(pk, group, '', True, lat, lon)
+        build = time.perf_counter() - start
+        self.stdout.write(
+            f'grid build: {index.donor_count} donors at {len(places)} places in {build * 1000:.0f} ms'
+        )
+
+        radius, limit = options['radius'], options['limit']
+        probes = [
+            (rng.choices(BLOOD_GROUPS, GROUP_WEIGHTS)[0], *rng.choice(places))
+            for _ in range(options['lookups'])
+        ]
+
+        def scan(group, lat, lon):
+            found = {}
+            for pk, donor_group, plat, plon in donors:
+                if can_donate(donor_group, group):
+                    distance = haversine_km(lat, lon, plat, plon)
+                    if distance <= radius:
+                        found[pk] = distance
+            return found
+
+        def agrees(result, found):
+            # donors at one place tie, and the grid breaks ties newest first rather than by id
+            nearest = sorted(found.values())[:limit]
+            return (
+                [distance for distance, _ in result] == nearest
+                and len({pk for _, pk in result}) == len(result)
+                and all(math.isclose(found.get(pk, -1), distance) for distance, pk in result)
+            )
+
+        start = time.perf_counter()
+        results = [index.donors_near(group, lat, lon, radius, limit) for group, lat, lon in probes]
+        grid_time = time.perf_counter() - start
+
+        # the scan is far slower, so it only runs over a sample of the probes
+        sample = probes[:max(1, len(probes) // 100)]
+        start = time.perf_counter()
+        expected = [scan(group, lat, lon) for group, lat, lon in sample]
+        scan_time = (time.perf_counter() - start) * len(probes) / len(sample)
+
+        if not all(agrees(result, found) for result, found in zip(results, expected)):
+            self.stderr.write(self.style.ERROR('grid and scan results differ'))
+        hits = sum(len(result) for result in results)
+        self.stdout.write(
+            f'donors within {radius:g} km, nearest {limit}: '
+            f'{grid_time / len(probes) * 1000:.3f} ms/lookup grid, '
+            f'{scan_time / len(probes) * 1000:.1f} ms/lookup scan, '
+            f'{hits / len(probes):.1f} results/lookup, '
+            f'speed-up x{scan_time / grid_time:.0f}'
+        )
@@ -0,0 +1,86 @@
+import json
+import statistics
+import time
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from core.compression import brotli
+from core.management.commands.bench_views import PLAIN_STORAGES, _bench_user, percentile
+
+
+class Command(BaseCommand):
+    help = 'Measure response bytes and server CPU per page refresh: plain, gzip, brotli and conditional GET'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        overrides = {}
+        try:
+            staticfiles_storage.url('css/style.css')
+        except ValueError:
+            overrides['STORAGES'] = PLAIN_STORAGES
+
+        donor = _bench_user('bench-donor')
+        admin = _bench_user('bench-admin', is_staff=True)
+        pages = {
+            'donor_dashboard': (donor, reverse('donor_dashboard')),
+            'blood_requests': (donor, reverse('blood_requests')),
+            'admin_dashboard': (admin, reverse('admin_dashboard')),
+        }
+        modes = {'identity': {}, 'gzip': {'HTTP_ACCEPT_ENCODING': 'gzip'}}
+        if brotli is not None:
+            modes['br'] = {'HTTP_ACCEPT_ENCODING': 'gzip, br'}
+
+        results = {}
+        with override_settings(**overrides):
+            for name, (user, url) in pages.items():
+                client = Client()
+                client.force_login(user)
+                etag = client.get(url)['ETag']
+                runs = {mode: self.measure(client, url, headers, options) for mode, headers in modes.items()}
+                runs['revalidate'] = self.measure(client, url, {'HTTP_IF_NONE_MATCH': etag}, options)
+                results[name] = runs
+                self.report(name, runs)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                json.dump(results, out, indent=2, sort_keys=True)
+                out.write('\n')
+
+    def measure(self, client, url, headers, options):
+        for _ in range(options['warmup']):
+            client.get(url, **headers)
+        wall, cpu, sizes, statuses = [], [], [], set()
+        for _ in range(options['iterations']):
+            start, start_cpu = time.perf_counter(), time.process_time()
+            response = client.get(url, **headers)
+            cpu.append((time.process_time() - start_cpu) * 1000)
+            wall.append((time.perf_counter() - start) * 1000)
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+        wall.sort()
+        return {
+            'bytes': round(statistics.fmean(sizes)),
+            'cpu_ms': round(statistics.fmean(cpu), 3),
+            'p50_ms': round(percentile(wall, 50), 3),
+            'p95_ms': round(percentile(wall, 95), 3),
+            'status_codes': sorted(statuses),
+        }
+
+    def report(self, name, runs):
+        base = runs['identity']
+        self.stdout.write(name)
+        for mode, run in runs.items():
+            saved_bytes = base['bytes'] - run['bytes']
+            saved_cpu = base['cpu_ms'] - run['cpu_ms']
+            self.stdout.write(
+                f"  {mode:<11} {run['bytes']:>8} B  cpu {run['cpu_ms']:7.2f} ms  p50 {run['p50_ms']:7.2f} ms  "
+                f"p95 {run['p95_ms']:7.2f} ms  saved {saved_bytes:>7} B, {saved_cpu:+6.2f} ms cpu  "
+                f"status {run['status_codes']}"
+            )
@@ -0,0 +1,62 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.management.commands.bench_views import percentile
+from core.models import BloodRequest, SearchToken
+from core.search import get_vocabulary, search
+
+
+# (kind, query): exact words, prefixes, typos, several words and request ids
+QUERIES = [
+    ('request', 'apollo'),
+    ('request', 'apol'),
+    ('request', 'apolo hospital'),
+    ('request', 'fortis mumbai'),
+    ('request', 'manipl bengaluru'),
+    ('request', 'kokilaben'),
+    ('request', 'government general chennai'),
+    ('request', 'medanta gurugram'),
+    ('request', 'christian medical'),
+    ('request', 'narayna helth'),
+    ('donor', 'donor 12345'),
+    ('donor', 'pune'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Measure search latency over the current database (run seed_data first)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=25)
+
+    def handle(self, *args, **options):
+        if not SearchToken.objects.exists():
+            raise CommandError('The search index is empty; run seed_data or rebuild_search_index first')
+
+        start = time.perf_counter()
+        for kind in ('request', 'donor'):
+            get_vocabulary(kind)
+        self.stdout.write(f'vocabulary load: {(time.perf_counter() - start) * 1000:.0f} ms')
+
+        newest = BloodRequest.objects.order_by('-pk').values_list('request_id', flat=True).first()
+        queries = QUERIES + ([('request', newest), ('request', newest[:-2])] if newest else [])
+
+        limit = options['limit']
+        for kind, query in queries:
+            timings = []
+            for _ in range(options['iterations']):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    results = search(kind, query, limit)
+                    timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{kind:<8} {query!r:<32} p50 {percentile(timings, 50):7.2f} ms  '
+                f'p95 {percentile(timings, 95):7.2f} ms  mean {statistics.fmean(timings):7.2f} ms  '
+                f'queries {len(captured):>3}  results {len(results)}'
+            )
@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from core.management.commands.bench_views import _bench_user, percentile
+
+
+# how each deployment is started; 'asgi' is the Procfile's web process, which hands
+# everything but the feed to the WSGI application
+SERVERS = {
+    'wsgi': ['Blood_Bridge.wsgi:application'],
+    'asgi': ['Blood_Bridge.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def _fetch(url, cookie):
+    request = urllib.request.Request(url, headers={'Cookie': cookie})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        status = exc.code
+    except OSError:
+        status = None
+    return (time.perf_counter() - start) * 1000, status
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent-request throughput of the WSGI and ASGI deployments against the current database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='*', choices=list(SERVERS), default=list(SERVERS))
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per WSGI worker (gthread)')
+        parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 8, 32])
+        parser.add_argument('--requests', type=int, default=300, help='Requests per page and concurrency level')
+        parser.add_argument('--pages', nargs='*', default=['donor_dashboard', 'blood_requests'])
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if shutil.which('gunicorn') is None:
+            raise CommandError('gunicorn is not installed (pip install -r requirements.txt)')
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError('The servers need a database they can open too, not an in-memory one')
+        try:
+            staticfiles_storage.url('css/style.css')
+        except ValueError:
+            raise CommandError('The pages need the static manifest: run collectstatic first')
+
+        client = Client()
+        client.force_login(_bench_user('bench-donor'))
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        base = f'http://127.0.0.1:{options["port"]}'
+
+        results = {}
+        for server in options['servers']:
+            process = self.start(server, options)
+            try:
+                self.wait_until_ready(base, process)
+                results[server] = {}
+                for page in options['pages']:
+                    url = base + reverse(page)
+                    results[server][page] = {
+                        str(level): self.load(url, cookie, level, options['requests'])
+                        for level in options['concurrency']
+                    }
+                    for level, run in results[server][page].items():
+                        self.stdout.write(
+                            f"{server:<5} {page:<16} c={level:<4} {run['rps']:8.1f} req/s  "
+                            f"p50 {run['p50_ms']:8.2f} ms  p95 {run['p95_ms']:8.2f} ms  "
+                            f"p99 {run['p99_ms']:8.2f} ms  errors {run['errors']}"
+                        )
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+        if options['output']:
+            meta = {
+                'workers': options['workers'], 'threads': options['threads'], 'cpus': os.cpu_count(),
+                'database': connection.vendor, 'python': sys.version.split()[0],
+            }
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                json.dump({'meta': meta, 'servers': results}, out, indent=2, sort_keys=True)
+                out.write('\n')
+
+    def start(self, server, options):
+        command = [
+            'gunicorn', *SERVERS[server], '--workers', str(options['workers']),
+            '--bind', f'127.0.0.1:{options["port"]}', '--log-level', 'warning',
+        ]
+        if server == 'wsgi':
+            command += ['--threads', str(options['threads'])]
+        return subprocess.Popen(command, cwd=settings.BASE_DIR)
+
+    def wait_until_ready(self, base, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'The server exited with status {process.returncode}')
+            if _fetch(base + reverse('home'), '')[1] == 200:
+                return
+            time.sleep(0.2)
+        raise CommandError('The server did not start in time')
+
+    def load(self, url, cookie, concurrency, total):
+        # warm every worker's caches and connections first
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: _fetch(url, cookie), range(max(concurrency, 10))))
+            start = time.perf_counter()
+            runs = list(pool.map(lambda _: _fetch(url, cookie), range(total)))
+            elapsed = time.perf_counter() - start
+        timings = sorted(ms for ms, _ in runs)
+        return {
+            'rps': round(total / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'errors': sum(1 for _, status in runs if status != 200),
+        }
@@ -0,0 +1,211 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.models import BloodRequest, User
+from core.pagination import paginate
+
+
+PLAIN_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+BENCH_DOMAIN = 'bench.example'
+DEEP_PAGES = 20
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = -(-len(sorted_values) * pct // 100)
+    return sorted_values[max(1, rank) - 1]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _bench_user(name, **extra):
+    email = f'{name}@{BENCH_DOMAIN}'
+    user, _ = User.objects.get_or_create(username=email, defaults={
+        'email': email, 'password': make_password(None), 'full_name': name,
+        'blood_group': 'O+', 'city': 'Mumbai', **extra,
+    })
+    return user
+
+
+def _deep_cursor(pages):
+    """Cursor of the listing page ``pages`` pages in, or None if there are fewer"""
+    cursor = None
+    for _ in range(pages):
+        cursor = paginate(BloodRequest.objects.values('id', 'created_at'), cursor).next_cursor
+        if cursor is None:
+            return None
+    return cursor
+
+
+class Command(BaseCommand):
+    help = 'Measure latency percentiles, query counts and peak memory of the core views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--memory-iterations', type=int, default=10,
+                            help='Extra runs under tracemalloc, kept out of the latency numbers')
+        parser.add_argument('--only', nargs='*', help='Scenario names to run (default: all)')
+        parser.add_argument('--cold', action='store_true', help='Disable the cache, so every request misses')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Earlier JSON results to compare against')
+
+    def handle(self, *args, **options):
+        overrides = {}
+        try:
+            staticfiles_storage.url('css/style.css')
+        except ValueError:
+            # the manifest storage needs collectstatic first; plain storage costs about the same
+            overrides['STORAGES'] = PLAIN_STORAGES
+        if options['cold']:
+            overrides['CACHES'] = DUMMY_CACHES
+
+        with override_settings(**overrides):
+            scenarios = self.scenarios()
+            names = options['only'] or list(scenarios)
+            unknown = set(names) - set(scenarios)
+            if unknown:
+                raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+            results = {name: self.measure(name, *scenarios[name], options) for name in names}
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'users': User.objects.count(),
+                'requests': BloodRequest.objects.count(),
+                'iterations': options['iterations'],
+                'cold_cache': options['cold'],
+                'plain_static_storage': 'STORAGES' in overrides,
+            },
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                json.dump(report, out, indent=2, sort_keys=True)
+                out.write('\n')
+        if options['baseline']:
+            self.compare(results, options['baseline'])
+
+    def scenarios(self):
+        """name -> (user, method, url, data)"""
+        donor = _bench_user('bench-donor')
+        admin = _bench_user('bench-admin', is_staff=True)
+        listing = reverse('blood_requests')
+        scenarios = {
+            'donor_dashboard': (donor, 'get', reverse('donor_dashboard'), None),
+            'blood_requests': (donor, 'get', listing, None),
+            'blood_requests_filtered': (donor, 'get', listing, {'status': 'Pending', 'blood_group': 'O+'}),
+            'admin_dashboard': (admin, 'get', reverse('admin_dashboard'), None),
+            'request_blood': (donor, 'post', reverse('request_blood'), {
+                'blood_group': 'O+', 'units_required': '2', 'hospital_name': 'Bench Hospital',
+                'location': 'Mumbai', 'emergency_level': 'High',
+            }),
+            'api_requests': (donor, 'get', reverse('api_requests'), None),
+        }
+        cursor = _deep_cursor(DEEP_PAGES)
+        if cursor:
+            scenarios['blood_requests_deep'] = (donor, 'get', listing, {'cursor': cursor})
+        return scenarios
+
+    def measure(self, name, user, method, url, data, options):
+        client = Client()
+        client.force_login(user)
+
+        def call():
+            if method == 'get':
+                return client.get(url, data)
+            # writes are rolled back, so every run sees the same database
+            with transaction.atomic():
+                response = client.post(url, data)
+                transaction.set_rollback(True)
+            return response
+
+        for _ in range(options['warmup']):
+            call()
+
+        timings, queries, statuses = [], [], set()
+        for _ in range(options['iterations']):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            statuses.add(response.status_code)
+
+        peak = 0
+        tracemalloc.start()
+        try:
+            for _ in range(options['memory_iterations']):
+                tracemalloc.reset_peak()
+                call()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        result = {
+            'method': method.upper(),
+            'url': url,
+            'iterations': len(timings),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'max_ms': round(timings[-1], 3),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+            'peak_memory_kib': round(peak / 1024, 1),
+            'status_codes': sorted(statuses),
+        }
+        self.stdout.write(
+            f"{name:<24} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+            f"p99 {result['p99_ms']:8.2f} ms  queries {result['queries_median']:>4}  "
+            f"peak {result['peak_memory_kib']:8.1f} KiB  status {result['status_codes']}"
+        )
+        return result
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as source:
+            baseline = json.load(source)['scenarios']
+        self.stdout.write(f'\nchange against {path}:')
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            changes = []
+            for metric in ('p50_ms', 'p95_ms', 'queries_median', 'peak_memory_kib'):
+                if before[metric]:
+                    changes.append(f'{metric} {(result[metric] - before[metric]) / before[metric] * 100:+.1f}%')
+            self.stdout.write(f'{name:<24} ' + '  '.join(changes))
@@ -0,0 +1,225 @@
+import csv
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from core.caching import invalidate_on_commit
+from core.geo import geocode
+from core.ids import BlockAllocator, REQUEST_ID_PREFIX
+from core.models import BloodRequest, User
+from core.pagination import REQUEST_FILTERS
+from core.priority import fill_triage_fields
+from core.search import index_rows
+from core.stats import record_changes
+from core.supply import record_donor_changes, record_request_changes
+
+
+DONOR_COLUMNS = {'full_name', 'email', 'blood_group', 'city'}
+REQUEST_COLUMNS = {'blood_group', 'units_required', 'hospital_name', 'location', 'emergency_level', 'requested_by'}
+
+
+class RowError(Exception):
+    pass
+
+
+def _required(row, field, max_length):
+    value = (row.get(field) or '').strip()
+    if not value:
+        raise RowError(f'{field} is required')
+    if len(value) > max_length:
+        raise RowError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _choice(row, field, allowed, default=None):
+    value = (row.get(field) or '').strip() or default
+    if value not in allowed:
+        raise RowError(f'{field} {value!r} is not one of {", ".join(allowed)}')
+    return value
+
+
+def _flag(row, field, default=True):
+    value = (row.get(field) or '').strip().lower()
+    if not value:
+        return default
+    if value in ('1', 'true', 'yes', 'y'):
+        return True
+    if value in ('0', 'false', 'no', 'n'):
+        return False
+    raise RowError(f'{field} {value!r} is not a yes/no value')
+
+
+class Command(BaseCommand):
+    help = 'Stream donors or blood requests from a CSV file into the database in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['donors', 'requests'])
+        parser.add_argument('path', help='CSV file with a header row')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rejects', help='Write rejected rows, with the reason, to this CSV file')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        self.rejected = 0
+        self.rejects_writer = None
+        rejects_file = None
+
+        try:
+            source = open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(f'Cannot read {options["path"]}: {exc}')
+
+        with source:
+            reader = csv.DictReader(source)
+            required = DONOR_COLUMNS if options['kind'] == 'donors' else REQUEST_COLUMNS
+            missing = required - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f'Missing columns: {", ".join(sorted(missing))}')
+
+            if options['rejects']:
+                rejects_file = open(options['rejects'], 'w', newline='', encoding='utf-8')
+                self.rejects_writer = csv.writer(rejects_file)
+                self.rejects_writer.writerow(['line', 'error', *reader.fieldnames])
+
+            try:
+                start = time.perf_counter()
+                if options['kind'] == 'donors':
+                    imported = self.import_donors(reader, batch_size)
+                else:
+                    imported = self.import_requests(reader, batch_size)
+                elapsed = time.perf_counter() - start
+            finally:
+                if rejects_file is not None:
+                    rejects_file.close()
+
+        total = imported + self.rejected
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} {options["kind"]}, rejected {self.rejected}, '
+            f'{total} rows in {elapsed:.2f}s ({rate:.0f} rows/s)'
+        ))
+
+    def reject(self, line, row, message):
+        self.rejected += 1
+        if self.rejects_writer is not None:
+            self.rejects_writer.writerow([line, message, *row.values()])
+        elif self.rejected <= 20:
+            self.stderr.write(f'line {line}: {message}')
+
+    def batches(self, reader, batch_size):
+        """(line number, row) pairs from the reader, batch_size at a time"""
+        rows = enumerate(reader, start=2)
+        while batch := list(islice(rows, batch_size)):
+            yield batch
+
+    # -- donors -----------------------------------------------------------
+
+    def import_donors(self, reader, batch_size):
+        # every username and email already taken, loaded once
+        taken = set()
+        for username, email in User.objects.values_list('username', 'email').iterator(chunk_size=10000):
+            taken.add(username.lower())
+            if email:
+                taken.add(email.lower())
+
+        blood_groups = REQUEST_FILTERS['blood_group']
+        unusable = make_password(None)
+        imported = 0
+        for batch in self.batches(reader, batch_size):
+            users = []
+            for line, row in batch:
+                try:
+                    email = _required(row, 'email', 150).lower()
+                    try:
+                        validate_email(email)
+                    except ValidationError:
+                        raise RowError(f'{email!r} is not a valid email address')
+                    if email in taken:
+                        raise RowError(f'{email} is already registered')
+                    password = (row.get('password') or '').strip()
+                    city = _required(row, 'city', 100)
+                    latitude, longitude = geocode(city) or (None, None)
+                    # bulk_create skips the pre_save signal that places donors on the map
+                    users.append(User(
+                        username=email,
+                        email=email,
+                        full_name=_required(row, 'full_name', 200),
+                        blood_group=_choice(row, 'blood_group', blood_groups),
+                        city=city,
+                        latitude=latitude,
+                        longitude=longitude,
+                        phone=(row.get('phone') or '').strip()[:15],
+                        is_available=_flag(row, 'is_available'),
+                        # hashing is deliberately slow; only pay for it when a password is given
+                        password=make_password(password) if password else unusable,
+                    ))
+                    taken.add(email)
+                except RowError as exc:
+                    self.reject(line, row, str(exc))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                record_donor_changes((None, user._supply_values()) for user in users)
+                # not every backend returns the new ids, so they are read back by username
+                index_rows('donor', User.objects.filter(username__in=[u.username for u in users])
+                           .values_list('pk', 'full_name', 'city'))
+            imported += len(users)
+        return imported
+
+    # -- requests ---------------------------------------------------------
+
+    def import_requests(self, reader, batch_size):
+        request_numbers = BlockAllocator('request_id', block_size=batch_size)
+        imported = 0
+        for batch in self.batches(reader, batch_size):
+            emails = {(row.get('requested_by') or '').strip().lower() for _, row in batch}
+            requesters = dict(User.objects.filter(username__in=emails).values_list('username', 'pk'))
+
+            blood_requests = []
+            for line, row in batch:
+                try:
+                    email = (row.get('requested_by') or '').strip().lower()
+                    if email not in requesters:
+                        raise RowError(f'requested_by {email!r} is not a registered user')
+                    try:
+                        units = int((row.get('units_required') or '').strip())
+                    except ValueError:
+                        raise RowError('units_required must be a whole number')
+                    if units < 1:
+                        raise RowError('units_required must be at least 1')
+                    location = _required(row, 'location', 200)
+                    latitude, longitude = geocode(location) or (None, None)
+                    blood_requests.append(BloodRequest(
+                        request_id=f'{REQUEST_ID_PREFIX}{request_numbers()}',
+                        blood_group=_choice(row, 'blood_group', REQUEST_FILTERS['blood_group']),
+                        units_required=units,
+                        hospital_name=_required(row, 'hospital_name', 200),
+                        location=location,
+                        latitude=latitude,
+                        longitude=longitude,
+                        emergency_level=_choice(row, 'emergency_level', REQUEST_FILTERS['emergency_level']),
+                        status=_choice(row, 'status', REQUEST_FILTERS['status'], default='Pending'),
+                        requested_by_id=requesters[email],
+                    ))
+                except RowError as exc:
+                    self.reject(line, row, str(exc))
+
+            # bulk_create skips BloodRequest.save and its signals, so triage fields, counters, supply rollup,
+            # cache and search index are updated here
+            for blood_request in blood_requests:
+                fill_triage_fields(blood_request)
+            changes = [(None, (r.status, r.blood_group, r.location)) for r in blood_requests]
+            with transaction.atomic():
+                BloodRequest.objects.bulk_create(blood_requests)
+                record_changes(changes)
+                record_request_changes((None, r._tracked_values()) for r in blood_requests)
+                index_rows('request', BloodRequest.objects.filter(request_id__in=[r.request_id for r in blood_requests])
+                           .values_list('pk', 'hospital_name', 'location'))
+                for status, blood_group, location in {new for _, new in changes}:
+                    invalidate_on_commit(location, blood_group, {status})
+            imported += len(blood_requests)
+        return imported
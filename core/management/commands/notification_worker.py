@@ -0,0 +1,45 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.notifications import NotificationWorker, notification_stats, queue_depth
+
+
+class Command(BaseCommand):
+    help = 'Send queued donor notifications, fanning each batch out over a thread pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent sends per batch')
+        parser.add_argument('--batch-size', type=int, default=None, help='Donors per batch')
+        parser.add_argument('--jobs', type=int, default=4, help='Jobs claimed per poll')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is due')
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        before = notification_stats()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, options['threads'])) as pool:
+            worker = NotificationWorker(worker_id, pool, batch_size=options['batch_size'])
+            try:
+                while True:
+                    close_old_connections()
+                    if not worker.run_once(options['jobs']):
+                        if options['once']:
+                            break
+                        time.sleep(options['poll'])
+            except KeyboardInterrupt:
+                pass
+
+        elapsed = time.perf_counter() - start
+        stats = {name: value - before[name] for name, value in notification_stats().items()}
+        self.stdout.write(
+            f"{stats['jobs_done']} jobs done, {stats['jobs_retried']} retried, {stats['jobs_failed']} failed; "
+            f"{stats['sent']} sent, {stats['failed']} failed, {stats['skipped']} already told "
+            f"in {elapsed:.1f}s ({stats['sent'] / elapsed if elapsed else 0:.0f} sends/s)"
+        )
+        self.stdout.write(f'queue: {queue_depth()}')
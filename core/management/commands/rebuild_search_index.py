@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.search import DEFAULT_BATCH_SIZE, KINDS, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of requests and donors from their tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=KINDS, action='append', help='Only this kind (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or KINDS:
+            start = time.perf_counter()
+            objects, postings = rebuild(kind, max(1, options['batch_size']))
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: {objects} objects, {postings} postings in {time.perf_counter() - start:.1f}s'
+            ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.stats import diff_counts, rebuild_counts, recount, stored_counts
+
+
+class Command(BaseCommand):
+    help = 'Verify or rebuild the request statistics counters from the live and archived requests'
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--verify', action='store_true', help='Report counters that disagree with a recount')
+        action.add_argument('--rebuild', action='store_true', help='Recount everything and replace the counters')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            counts = rebuild_counts()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(counts)} counters'))
+            return
+
+        diffs = diff_counts(recount(), stored_counts())
+        if not diffs:
+            self.stdout.write(self.style.SUCCESS('All counters match'))
+            return
+        for (scope, key), (expected, stored) in sorted(diffs.items()):
+            self.stdout.write(f'{scope}:{key or "-"} expected {expected}, stored {stored}')
+        raise CommandError(f'{len(diffs)} counters are off; run with --rebuild to fix them')
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.priority import rescore
+
+
+class Command(BaseCommand):
+    help = 'Re-score pending requests as they age, so triage ordering stays current'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running, re-scoring every this many seconds (default: once)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                start = time.perf_counter()
+                checked, changed = rescore(batch_size=max(1, options['batch_size']))
+                self.stdout.write(
+                    f'{checked} pending requests checked, {changed} re-scored in {time.perf_counter() - start:.2f}s'
+                )
+                if options['every'] is None:
+                    break
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
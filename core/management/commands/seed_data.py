@@ -0,0 +1,164 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.geo import geocode
+from core.ids import BlockAllocator, REQUEST_ID_PREFIX
+from core.matching import BLOOD_GROUPS, GROUP_WEIGHTS
+from core.models import BloodRequest, User
+from core.priority import fill_triage_fields
+from core.search import KINDS, rebuild
+from core.stats import rebuild_counts
+from core.supply import rebuild_rollup
+
+
+SEED_DOMAIN = 'seed.example'
+
+# roughly proportional to metro population
+CITY_WEIGHTS = {
+    'Mumbai': 20, 'Delhi': 19, 'Kolkata': 15, 'Bengaluru': 12, 'Chennai': 11, 'Hyderabad': 10,
+    'Ahmedabad': 8, 'Pune': 7, 'Surat': 6, 'Jaipur': 4, 'Lucknow': 4, 'Kanpur': 3, 'Nagpur': 3,
+    'Indore': 3, 'Thane': 2, 'Bhopal': 2, 'Visakhapatnam': 2, 'Patna': 2, 'Vadodara': 2,
+    'Coimbatore': 2, 'Kochi': 2, 'Madurai': 1.5, 'Navi Mumbai': 1.5, 'Noida': 1, 'Gurugram': 1,
+    'Tambaram': 1, 'Mysuru': 1,
+}
+
+HOSPITALS = [
+    'Apollo Hospital', 'Fortis Hospital', 'Government General Hospital', 'Manipal Hospital',
+    'Max Super Speciality Hospital', 'Kokilaben Hospital', 'AIIMS', 'Narayana Health',
+    'Christian Medical College', 'Ruby Hall Clinic', 'Medanta', 'KIMS Hospital',
+]
+
+EMERGENCY_WEIGHTS = {'Low': 30, 'Medium': 35, 'High': 25, 'Critical': 10}
+
+# recent requests are mostly open, old ones mostly closed
+RECENT_STATUS_WEIGHTS = {'Pending': 60, 'In Progress': 25, 'Completed': 10, 'Cancelled': 5}
+OLD_STATUS_WEIGHTS = {'Pending': 3, 'In Progress': 2, 'Completed': 80, 'Cancelled': 15}
+
+
+@contextmanager
+def _keep_timestamps(model):
+    """Let generated created_at/updated_at values through bulk_create"""
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with reproducible synthetic donors and requests for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--requests', type=int, default=1_000_000)
+        parser.add_argument('--days', type=int, default=365, help='Spread requests over this many days')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--force', action='store_true', help='Allow a database other than SQLite')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' and not options['force']:
+            raise CommandError('Refusing to seed a non-SQLite database without --force')
+        if User.objects.filter(email__endswith=f'@{SEED_DOMAIN}').exists():
+            raise CommandError('The database is already seeded; start from an empty one')
+
+        self.rng = random.Random(options['seed'])
+        # timestamps are relative to midnight, so same-day runs give identical rows
+        self.now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        batch_size = max(1, options['batch_size'])
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # a throwaway benchmark database does not need fsync per batch
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+        start = time.perf_counter()
+        user_ids = self.seed_users(options['users'], batch_size)
+        users_done = time.perf_counter()
+        self.stdout.write(f'{len(user_ids)} users in {users_done - start:.1f}s')
+
+        created = self.seed_requests(options['requests'], options['days'], user_ids, batch_size)
+        rebuild_counts()
+        rebuild_rollup()
+        elapsed = time.perf_counter() - users_done
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} requests in {elapsed:.1f}s ({created / elapsed if elapsed else created:.0f} rows/s)'
+        ))
+
+        # bulk_create skips the signals that index rows for search, so the index is built in one pass
+        start = time.perf_counter()
+        postings = sum(rebuild(kind, batch_size)[1] for kind in KINDS)
+        self.stdout.write(f'search index: {postings} postings in {time.perf_counter() - start:.1f}s')
+
+    def seed_users(self, count, batch_size):
+        unusable = make_password(None)
+        for start in range(0, count, batch_size):
+            users = []
+            for n in range(start, min(start + batch_size, count)):
+                city = _weighted(self.rng, CITY_WEIGHTS)
+                latitude, longitude = geocode(city)
+                email = f'donor{n:07d}@{SEED_DOMAIN}'
+                users.append(User(
+                    username=email, email=email, password=unusable,
+                    full_name=f'Donor {n}', phone=f'9{n:09d}',
+                    blood_group=self.rng.choices(BLOOD_GROUPS, GROUP_WEIGHTS)[0],
+                    city=city, latitude=latitude, longitude=longitude,
+                    is_available=self.rng.random() < 0.7,
+                ))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+        return list(
+            User.objects.filter(email__endswith=f'@{SEED_DOMAIN}').order_by('pk').values_list('pk', flat=True)
+        )
+
+    def seed_requests(self, count, days, user_ids, batch_size):
+        request_numbers = BlockAllocator('request_id', block_size=batch_size)
+        span = timedelta(days=days).total_seconds()
+        created = 0
+        with _keep_timestamps(BloodRequest):
+            for start in range(0, count, batch_size):
+                blood_requests = []
+                for _ in range(start, min(start + batch_size, count)):
+                    created_at = self.now - timedelta(seconds=self.rng.random() * span)
+                    recent = self.now - created_at < timedelta(days=7)
+                    status = _weighted(self.rng, RECENT_STATUS_WEIGHTS if recent else OLD_STATUS_WEIGHTS)
+                    city = _weighted(self.rng, CITY_WEIGHTS)
+                    hospital = self.rng.choice(HOSPITALS)
+                    latitude, longitude = geocode(city)
+                    blood_request = BloodRequest(
+                        request_id=f'{REQUEST_ID_PREFIX}{request_numbers()}',
+                        blood_group=self.rng.choices(BLOOD_GROUPS, GROUP_WEIGHTS)[0],
+                        units_required=self.rng.choices([1, 2, 3, 4], [40, 35, 15, 10])[0],
+                        hospital_name=hospital,
+                        location=f'{hospital}, {city}',
+                        latitude=latitude, longitude=longitude,
+                        emergency_level=_weighted(self.rng, EMERGENCY_WEIGHTS),
+                        status=status,
+                        requested_by_id=self.rng.choice(user_ids),
+                        assigned_to_id=self.rng.choice(user_ids) if status in ('In Progress', 'Completed') else None,
+                        created_at=created_at,
+                        updated_at=min(self.now, created_at + timedelta(hours=self.rng.random() * 48)),
+                    )
+                    fill_triage_fields(blood_request, self.now)
+                    blood_requests.append(blood_request)
+                with transaction.atomic():
+                    BloodRequest.objects.bulk_create(blood_requests)
+                created += len(blood_requests)
+        return created
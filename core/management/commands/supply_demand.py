@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.supply import rebuild_rollup, snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recompute the supply-vs-demand rollup from scratch and record it in the trend history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running, recomputing every this many seconds (default: once)')
+        parser.add_argument('--no-history', action='store_true', help='Recompute without recording a history bucket')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                start = time.perf_counter()
+                drifted = rebuild_rollup()
+                recorded = 0 if options['no_history'] else snapshot()
+                self.stdout.write(
+                    f'Rollup recomputed, {drifted} cells corrected, {recorded} cells recorded '
+                    f'in {time.perf_counter() - start:.2f}s'
+                )
+                if options['every'] is None:
+                    break
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
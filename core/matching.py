@@ -0,0 +1,393 @@
+"""
+Donor/request matching engine.
+
+Compatibility follows the usual red-cell ABO/Rh rules (O- gives to everyone,
+AB+ receives from everyone). Every blood group gets one bit; each group then
+has a "gives to" mask and a "receives from" mask built from those bits.
+
+``MatchIndex`` keeps available donors bucketed by (normalised city,
+compatibility mask). A lookup visits at most eight buckets
+in one city, so it costs about as much as the result set. The index is
+filled lazily from the database once per process, and kept current by the
+model signals in ``core.signals``. A cheap delta sync on ``users.updated_at``
+picks up rows written by other worker processes or by bulk operations that
+skip signals. ``updated_at`` is stamped when a row is
+saved, not when it commits, so each sync re-reads the
+``MATCH_INDEX_SYNC_OVERLAP_SECONDS`` (default 60) before the newest stamp it
+has seen. Only a transaction open longer than that, or an app server clock
+further behind, can slip past it. Rows read back for a lookup are re-checked
+(availability, blood group, city or distance), since the index may lag by
+up to one sync interval.
+
+Donors with coordinates are also kept in a ``GeoGrid`` (see ``core.geo``),
+which answers "compatible donors within R km of this hospital, nearest
+first" by looking only at the places around the hospital, and only at as
+many donors there as the caller asks for.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+from .geo import GeoGrid, haversine_km
+
+
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+
+# rough share of each group in India, in BLOOD_GROUPS order; for generated data
+GROUP_WEIGHTS = [21, 0.6, 32, 0.8, 7, 0.3, 37, 0.8]
+
+GROUP_BITS = {group: 1 << i for i, group in enumerate(BLOOD_GROUPS)}
+
+# donor group -> recipient groups it can give to
+_GIVES_TO = {
+    'O-': BLOOD_GROUPS,
+    'O+': ['O+', 'A+', 'B+', 'AB+'],
+    'A-': ['A-', 'A+', 'AB-', 'AB+'],
+    'A+': ['A+', 'AB+'],
+    'B-': ['B-', 'B+', 'AB-', 'AB+'],
+    'B+': ['B+', 'AB+'],
+    'AB-': ['AB-', 'AB+'],
+    'AB+': ['AB+'],
+}
+
+
+def _mask(groups):
+    mask = 0
+    for group in groups:
+        mask |= GROUP_BITS[group]
+    return mask
+
+
+GIVES_TO_MASK = {donor: _mask(recipients) for donor, recipients in _GIVES_TO.items()}
+
+RECEIVES_FROM_MASK = {
+    recipient: _mask(donor for donor, recipients in _GIVES_TO.items() if recipient in recipients)
+    for recipient in BLOOD_GROUPS
+}
+
+
+def can_donate(donor_group, recipient_group):
+    """True if a donor of ``donor_group`` can give to ``recipient_group``"""
+    return bool(GIVES_TO_MASK.get(donor_group, 0) & GROUP_BITS.get(recipient_group, 0))
+
+
+def donor_groups_for(recipient_group):
+    """Blood groups that can donate to ``recipient_group``"""
+    mask = RECEIVES_FROM_MASK.get(recipient_group, 0)
+    return [group for group in BLOOD_GROUPS if mask & GROUP_BITS[group]]
+
+
+def recipient_groups_for(donor_group):
+    """Blood groups that ``donor_group`` can donate to"""
+    mask = GIVES_TO_MASK.get(donor_group, 0)
+    return [group for group in BLOOD_GROUPS if mask & GROUP_BITS[group]]
+
+
+def normalize_city(value):
+    """
+    Reduce a city or free-text location to a comparable key.
+
+    ``BloodRequest.location`` is free text such as "Anna Nagar, Chennai", so
+    the last comma-separated part is taken as the city.
+    """
+    if not value:
+        return ''
+    parts = [part.strip() for part in value.split(',') if part.strip()]
+    return parts[-1].casefold() if parts else ''
+
+
+class MatchIndex:
+    """In-memory (city, compatibility mask) index of available donors"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # city -> mask -> {id: None}; dicts keep the id sets ordered and O(1)
+            self._donors = {}
+            self._donor_keys = {}
+            self._donor_grid = GeoGrid(getattr(settings, 'MATCH_GRID_CELL_KM', 5.0))
+
+    def __len__(self):
+        return len(self._donor_keys)
+
+    @property
+    def donor_count(self):
+        return len(self._donor_keys)
+
+    # -- maintenance ------------------------------------------------------
+
+    @staticmethod
+    def _put(buckets, keys, pk, key):
+        old = keys.get(pk)
+        if old == key:
+            return
+        if old is not None:
+            MatchIndex._drop(buckets, keys, pk)
+        city, mask = key
+        buckets.setdefault(city, {}).setdefault(mask, {})[pk] = None
+        keys[pk] = key
+
+    @staticmethod
+    def _drop(buckets, keys, pk):
+        key = keys.pop(pk, None)
+        if key is None:
+            return
+        city, mask = key
+        by_mask = buckets[city]
+        bucket = by_mask[mask]
+        del bucket[pk]
+        if not bucket:
+            del by_mask[mask]
+            if not by_mask:
+                del buckets[city]
+
+    def update_donor(self, pk, blood_group, city, is_available=True, latitude=None, longitude=None):
+        """Insert, move or drop a donor depending on its current fields"""
+        mask = GIVES_TO_MASK.get(blood_group)
+        with self._lock:
+            if mask is None or not is_available:
+                self._drop(self._donors, self._donor_keys, pk)
+                self._donor_grid.remove(pk)
+                return
+            self._put(self._donors, self._donor_keys, pk, (normalize_city(city), mask))
+            if latitude is None or longitude is None:
+                self._donor_grid.remove(pk)
+            else:
+                self._donor_grid.put(pk, latitude, longitude, mask)
+
+    def remove_donor(self, pk):
+        with self._lock:
+            self._drop(self._donors, self._donor_keys, pk)
+            self._donor_grid.remove(pk)
+
+    # -- lookups ----------------------------------------------------------
+
+    @staticmethod
+    def _collect(buckets, city, bit, limit):
+        with_city = buckets.get(normalize_city(city))
+        if not with_city:
+            return []
+        ids = []
+        for mask, bucket in list(with_city.items()):
+            if mask & bit:
+                ids.extend(bucket)
+        ids.sort(reverse=True)
+        return ids[:limit] if limit is not None else ids
+
+    def donors_for_request(self, blood_group, location, limit=None):
+        """Ids of available donors who can give to a request, newest first"""
+        bit = GROUP_BITS.get(blood_group)
+        if bit is None:
+            return []
+        with self._lock:
+            return self._collect(self._donors, location, bit, limit)
+
+    def donors_near(self, blood_group, latitude, longitude, radius_km, limit=None):
+        """(distance_km, id) of available donors who can give to a request, nearest first"""
+        bit = GROUP_BITS.get(blood_group)
+        if bit is None:
+            return []
+        with self._lock:
+            return self._donor_grid.within(latitude, longitude, radius_km, bit, limit)
+
+
+DEFAULT_SYNC_OVERLAP_SECONDS = 60
+
+USER_FIELDS = ('pk', 'blood_group', 'city', 'is_available', 'is_active', 'latitude', 'longitude', 'updated_at')
+
+
+class _IndexLoader:
+    """Lazily fills the shared index and keeps it in step with the database"""
+
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._synced_at = None
+        self._last_sync = 0.0
+
+    def reset(self):
+        with self._lock:
+            self.index.clear()
+            self.loaded = False
+            self._synced_at = None
+            self._last_sync = 0.0
+
+    def _apply_users(self, rows):
+        for pk, blood_group, city, is_available, is_active, latitude, longitude, updated_at in rows:
+            self.index.update_donor(pk, blood_group, city, is_available and is_active, latitude, longitude)
+            if self._synced_at is None or updated_at > self._synced_at:
+                self._synced_at = updated_at
+
+    def _load(self):
+        from .models import User
+
+        self.index.clear()
+        self._apply_users(
+            User.objects.filter(is_available=True, is_active=True)
+            .values_list(*USER_FIELDS).iterator(chunk_size=5000)
+        )
+        self.loaded = True
+
+    @staticmethod
+    def _since(synced_at):
+        # re-applying a row is harmless, missing one that committed late is not
+        overlap = getattr(settings, 'MATCH_INDEX_SYNC_OVERLAP_SECONDS', DEFAULT_SYNC_OVERLAP_SECONDS)
+        return synced_at - timedelta(seconds=overlap)
+
+    def _sync(self):
+        from .models import User
+
+        # edits to existing donors too, not just new ones
+        users = User.objects.order_by()
+        if self._synced_at is not None:
+            users = users.filter(updated_at__gte=self._since(self._synced_at))
+        else:
+            users = users.filter(is_available=True, is_active=True)
+        self._apply_users(users.values_list(*USER_FIELDS))
+
+    def get(self):
+        interval = getattr(settings, 'MATCH_INDEX_SYNC_SECONDS', 5)
+        now = time.monotonic()
+        with self._lock:
+            if not self.loaded:
+                self._load()
+                self._last_sync = now
+            elif interval is not None and now - self._last_sync >= interval:
+                self._sync()
+                self._last_sync = now
+        return self.index
+
+
+match_index = MatchIndex()
+_loader = _IndexLoader(match_index)
+
+
+def get_match_index():
+    """The process-wide index, loaded on first use"""
+    return _loader.get()
+
+
+def reset_match_index():
+    """Drop the in-memory index; the next lookup reloads it from the database"""
+    _loader.reset()
+
+
+def track_donor(user):
+    if _loader.loaded:
+        match_index.update_donor(
+            user.pk, user.blood_group, user.city, user.is_available and user.is_active,
+            user.latitude, user.longitude,
+        )
+
+
+def refresh_donors(pks):
+    """Re-read donors changed by a queryset update, which sends no signals"""
+    from .models import User
+
+    if _loader.loaded:
+        rows = User.objects.filter(pk__in=pks).values_list(*USER_FIELDS)
+        for pk, blood_group, city, is_available, is_active, latitude, longitude, _ in rows:
+            match_index.update_donor(pk, blood_group, city, is_available and is_active, latitude, longitude)
+
+
+def untrack_donor(pk):
+    match_index.remove_donor(pk)
+
+
+def _fetch(queryset, ids, limit, keep=None, chunk_size=500):
+    """Load rows for index ids in order, re-checking them against the database (and ``keep``)"""
+    rows = []
+    for start in range(0, len(ids), chunk_size):
+        batch = queryset.filter(pk__in=ids[start:start + chunk_size]).order_by('-pk')
+        if keep is None:
+            rows.extend(batch[:limit - len(rows)] if limit else batch)
+        else:
+            rows.extend(row for row in batch if keep(row))
+            del rows[limit or len(rows):]
+        if limit and len(rows) >= limit:
+            break
+    return rows
+
+
+def donor_distance_km(donor, blood_request):
+    """Distance between the stored positions of a donor and a request, or None"""
+    if None in (donor.latitude, donor.longitude, blood_request.latitude, blood_request.longitude):
+        return None
+    return haversine_km(donor.latitude, donor.longitude, blood_request.latitude, blood_request.longitude)
+
+
+def still_matches(donor, blood_request, radius_km=None):
+    """
+    Whether a donor row read from the database still matches a request: a
+    compatible blood group, and the same city or (given ``radius_km``) a
+    position within that distance. The index may hold a donor's old values
+    until the next sync.
+    """
+    if not can_donate(donor.blood_group, blood_request.blood_group):
+        return False
+    if normalize_city(donor.city) == normalize_city(blood_request.location):
+        return True
+    if radius_km is None:
+        return False
+    distance = donor_distance_km(donor, blood_request)
+    return distance is not None and distance <= radius_km
+
+
+def compatible_donors(blood_request, limit=None):
+    """Available donors in the request's city who can give to it, newest first"""
+    from .models import User
+
+    ids = get_match_index().donors_for_request(blood_request.blood_group, blood_request.location)
+    queryset = User.objects.filter(is_available=True, is_active=True).exclude(pk=blood_request.requested_by_id)
+    return _fetch(queryset, ids, limit, keep=lambda donor: still_matches(donor, blood_request))
+
+
+def nearby_donors(blood_request, radius_km=None, limit=None):
+    """
+    Available donors within ``radius_km`` of the request who can give to it,
+    nearest first. Each donor gets a ``distance_km`` attribute. Requests
+    without coordinates have no nearby donors.
+    """
+    from .models import User
+
+    if blood_request.latitude is None or blood_request.longitude is None:
+        return []
+    if radius_km is None:
+        radius_km = getattr(settings, 'MATCH_RADIUS_KM', 25)
+    index = get_match_index()
+    queryset = User.objects.filter(is_available=True, is_active=True).exclude(pk=blood_request.requested_by_id)
+
+    donors = []
+    seen = set()
+    # ask the index for ``limit`` donors, and for twice as many each time re-checks drop some
+    size = limit
+    while True:
+        hits = index.donors_near(
+            blood_request.blood_group, blood_request.latitude, blood_request.longitude, radius_km, size
+        )
+        fresh = [pk for _, pk in hits if pk not in seen]
+        seen.update(fresh)
+        for start in range(0, len(fresh), 500):
+            batch = fresh[start:start + 500]
+            # re-checked against the database, which the index may briefly lag
+            found = queryset.in_bulk(batch)
+            for pk in batch:
+                donor = found.get(pk)
+                if donor is None or not can_donate(donor.blood_group, blood_request.blood_group):
+                    continue
+                distance = donor_distance_km(donor, blood_request)
+                if distance is None or distance > radius_km:
+                    continue
+                donor.distance_km = round(distance, 2)
+                donors.append(donor)
+                if limit and len(donors) >= limit:
+                    return donors
+        if not size or len(hits) < size:
+            return donors
+        size *= 2
@@ -0,0 +1,311 @@
+"""
+Per-view performance metrics, exported in Prometheus text format.
+
+``MetricsMiddleware`` records, per URL name, request latency, the number and
+total time of SQL queries, template render time and response size. Each view
+gets fixed histogram arrays when it is first seen, so recording a request is
+a few list increments under one lock, with no logging and no allocation.
+
+Queries are counted by an execute wrapper added to every database connection
+as it opens. It reports to the request's probe through a context variable,
+so queries that async views run via ``sync_to_async`` are counted as well.
+Template time is measured around the outermost ``Template.render`` call.
+Work done while a streaming response is consumed falls outside the request.
+
+Numbers are per process; with several workers, each worker serves its own.
+``/metrics`` is open to staff sessions, or to a scraper that sends
+``Authorization: Bearer <METRICS_TOKEN>``.
+
+Setting ``METRICS_SLOW_QUERY_MS`` turns on the slow query log: queries slower
+than that are logged to ``core.metrics.slow`` with the SQL, and a share of
+them (``METRICS_SLOW_QUERY_SAMPLE_RATE``, default 1.0) also carry the
+project frames of the calling stack. The latest entries stay available
+through ``slow_queries()``.
+"""
+import logging
+import random
+import threading
+import traceback
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.base import Template
+from django.utils.crypto import constant_time_compare
+
+
+slow_logger = logging.getLogger('core.metrics.slow')
+
+PREFIX = 'blood_bridge'
+UNMATCHED = '<unmatched>'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+
+_current = ContextVar('core_metrics_probe', default=None)
+
+
+class Histogram:
+    """Cumulative-on-export histogram over fixed bucket bounds"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one slot per bound plus +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class ViewStats:
+    """Everything recorded for one URL name"""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statuses = [0] * len(STATUS_CLASSES)
+        self.slow_queries = 0
+
+
+class Probe:
+    """What one request has done so far"""
+    __slots__ = ('queries', 'db_seconds', 'template_seconds', 'template_depth', 'slow_queries')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.slow_queries = 0
+
+
+_views = {}
+_lock = threading.Lock()
+_slow_log = deque(maxlen=200)
+
+
+def record(view, status, seconds, probe, size=None):
+    with _lock:
+        stats = _views.get(view)
+        if stats is None:
+            stats = _views[view] = ViewStats()
+        stats.latency.observe(seconds)
+        stats.queries.observe(probe.queries)
+        if size is not None:
+            stats.size.observe(size)
+        stats.db_seconds += probe.db_seconds
+        stats.template_seconds += probe.template_seconds
+        stats.statuses[min(max(status // 100, 1), 5) - 1] += 1
+        stats.slow_queries += probe.slow_queries
+
+
+def reset_metrics():
+    with _lock:
+        _views.clear()
+        _slow_log.clear()
+
+
+def slow_queries():
+    """The most recent slow queries, oldest first"""
+    with _lock:
+        return list(_slow_log)
+
+
+# -- probes -----------------------------------------------------------------
+
+def _project_stack():
+    base = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(base) and frame.filename != __file__
+        and 'site-packages' not in frame.filename
+    ]
+    return [f'{frame.filename[len(base) + 1:]}:{frame.lineno} in {frame.name}' for frame in frames[-10:]]
+
+
+def _slow_query(sql, seconds, probe):
+    probe.slow_queries += 1
+    rate = getattr(settings, 'METRICS_SLOW_QUERY_SAMPLE_RATE', 1.0)
+    stack = _project_stack() if random.random() < rate else []
+    entry = {'ms': round(seconds * 1000, 2), 'sql': sql[:2000], 'stack': stack}
+    with _lock:
+        _slow_log.append(entry)
+    slow_logger.warning('Slow query (%.1f ms): %s%s', entry['ms'], entry['sql'],
+                        ''.join(f'\n    {line}' for line in stack))
+
+
+def _track_query(execute, sql, params, many, context):
+    probe = _current.get()
+    if probe is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = perf_counter() - start
+        probe.queries += 1
+        probe.db_seconds += elapsed
+        threshold = getattr(settings, 'METRICS_SLOW_QUERY_MS', None)
+        if threshold is not None and elapsed * 1000 >= threshold:
+            _slow_query(sql, elapsed, probe)
+
+
+def _connection_opened(sender, connection, **kwargs):
+    if _track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_query)
+
+
+_original_render = None
+
+
+def _timed_render(self, context):
+    probe = _current.get()
+    if probe is None or probe.template_depth:
+        return _original_render(self, context)
+    probe.template_depth += 1
+    start = perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        probe.template_seconds += perf_counter() - start
+        probe.template_depth -= 1
+
+
+def install():
+    """Hook query and template timing in; called once from ``CoreConfig.ready``"""
+    global _original_render
+    if _original_render is not None:
+        return
+    _original_render = Template.render
+    Template.render = _timed_render
+    connection_created.connect(_connection_opened, dispatch_uid='core.metrics')
+
+
+# -- middleware -------------------------------------------------------------
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match else None) or UNMATCHED
+
+
+def _size(response):
+    return None if response.streaming else len(response.content)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        probe = Probe()
+        token = _current.set(probe)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(_view_name(request), response.status_code, perf_counter() - start, probe, _size(response))
+        return response
+
+    async def __acall__(self, request):
+        probe = Probe()
+        token = _current.set(probe)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(_view_name(request), response.status_code, perf_counter() - start, probe, _size(response))
+        return response
+
+
+# -- export -----------------------------------------------------------------
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, view, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+    lines.append(f'{name}_count{{view="{view}"}} {cumulative}')
+    return lines
+
+
+def render_metrics():
+    """All views' metrics in the Prometheus text exposition format"""
+    families = {
+        'request_duration_seconds': ('histogram', 'Time to produce the response'),
+        'db_queries': ('histogram', 'SQL queries per request'),
+        'response_size_bytes': ('histogram', 'Response body size (non-streaming responses)'),
+        'db_seconds_total': ('counter', 'Time spent in SQL queries'),
+        'template_seconds_total': ('counter', 'Time spent rendering templates'),
+        'responses_total': ('counter', 'Responses by status class'),
+        'slow_queries_total': ('counter', 'Queries slower than METRICS_SLOW_QUERY_MS'),
+    }
+    body = {name: [] for name in families}
+    with _lock:
+        for view in sorted(_views):
+            stats = _views[view]
+            label = _label(view)
+            body['request_duration_seconds'] += _histogram_lines(
+                f'{PREFIX}_request_duration_seconds', label, stats.latency)
+            body['db_queries'] += _histogram_lines(f'{PREFIX}_db_queries', label, stats.queries)
+            body['response_size_bytes'] += _histogram_lines(f'{PREFIX}_response_size_bytes', label, stats.size)
+            body['db_seconds_total'].append(f'{PREFIX}_db_seconds_total{{view="{label}"}} {stats.db_seconds}')
+            body['template_seconds_total'].append(
+                f'{PREFIX}_template_seconds_total{{view="{label}"}} {stats.template_seconds}')
+            for status, count in zip(STATUS_CLASSES, stats.statuses):
+                if count:
+                    body['responses_total'].append(
+                        f'{PREFIX}_responses_total{{view="{label}",status="{status}"}} {count}')
+            body['slow_queries_total'].append(f'{PREFIX}_slow_queries_total{{view="{label}"}} {stats.slow_queries}')
+
+    lines = []
+    for name, (kind, help_text) in families.items():
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+        lines.extend(body[name])
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and constant_time_compare(header[7:], token):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    """Staff only (or bearer token): Prometheus scrape endpoint"""
+    if not _authorized(request):
+        return HttpResponseForbidden('Admin privileges required')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,53 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:40
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# frozen copies of core.matching.normalize_city and core.stats.counter_keys
+def normalize_city(value):
+    parts = [part.strip() for part in (value or '').split(',') if part.strip()]
+    return parts[-1].casefold() if parts else ''
+
+
+def counter_keys(status, blood_group, location):
+    return [('total', ''), ('status', status), ('blood_group', blood_group), ('city', normalize_city(location))]
+
+
+def fill_counters(apps, schema_editor):
+    BloodRequest = apps.get_model('core', 'BloodRequest')
+    RequestCounter = apps.get_model('core', 'RequestCounter')
+    counts = Counter()
+    rows = BloodRequest.objects.order_by().values('status', 'blood_group', 'location').annotate(n=Count('pk'))
+    for row in rows:
+        for key in counter_keys(row['status'], row['blood_group'], row['location']):
+            counts[key] += row['n']
+    RequestCounter.objects.bulk_create(
+        RequestCounter(scope=scope, key=key, count=count) for (scope, key), count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=20)),
+                ('key', models.CharField(blank=True, max_length=200)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'request_counters',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='request_counter_scope_key')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
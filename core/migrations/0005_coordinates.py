@@ -0,0 +1,101 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:53
+
+import csv
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+
+BATCH_SIZE = 2000
+
+
+def load_gazetteer():
+    # core.geo as of this migration, so later changes there cannot alter it
+    path = getattr(settings, 'GAZETTEER_PATH', None) or Path(__file__).resolve().parent.parent / 'data' / 'gazetteer.csv'
+    with open(path, newline='', encoding='utf-8') as source:
+        return {
+            row['name'].strip().casefold(): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(source)
+        }
+
+
+def geocode(places, text):
+    for part in (text or '').split(','):
+        point = places.get(part.strip().casefold())
+        if point:
+            return point
+    return None
+
+
+def bulk_update(Model, rows, fields, connection):
+    """
+    ``bulk_update`` with one WHEN per distinct value rather than per row:
+    everyone in a city gets the same centroid.
+    """
+    # the row ids appear up to three times per field, plus the values
+    batch_size = connection.ops.bulk_batch_size(['pk'] * 3 + fields, rows)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cases = {}
+        for field in fields:
+            by_value = defaultdict(list)
+            for row in batch:
+                by_value[getattr(row, field)].append(row.pk)
+            whens = [When(pk__in=pks, then=Value(value)) for value, pks in by_value.items()]
+            cases[field] = Case(*whens, default=F(field))
+        Model.objects.filter(pk__in=[row.pk for row in batch]).update(**cases)
+
+
+def fill_coordinates(apps, schema_editor):
+    places = load_gazetteer()
+    for model, field in (('User', 'city'), ('BloodRequest', 'location')):
+        Model = apps.get_model('core', model)
+        # walk the primary key in batches; the place columns have no index to filter on
+        rows = Model.objects.order_by('pk').only('pk', field)
+        last = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last)[:BATCH_SIZE])
+            if not batch:
+                break
+            located = []
+            for row in batch:
+                point = geocode(places, getattr(row, field))
+                if point:
+                    row.latitude, row.longitude = point
+                    located.append(row)
+            bulk_update(Model, located, ['latitude', 'longitude'], schema_editor.connection)
+            last = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_id_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodrequest',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bloodrequest',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_coordinates, migrations.RunPython.noop),
+    ]
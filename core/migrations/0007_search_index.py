@@ -0,0 +1,103 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:06
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import migrations, models
+
+
+# core.search as of this migration
+FIELDS = {
+    ('request', 'BloodRequest'): {'hospital_name': 3, 'location': 2},
+    ('donor', 'User'): {'full_name': 3, 'city': 2},
+}
+MAX_TOKEN_LENGTH = 40
+BATCH_SIZE = 5000
+
+_WORD = re.compile(r'[0-9a-z]+')
+
+
+def fold(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    words = {}
+    for word in _WORD.findall(fold(text)):
+        if len(word) > 1:
+            words.setdefault(word[:MAX_TOKEN_LENGTH], None)
+    return list(words)
+
+
+def document_tokens(weights, values):
+    tokens = {}
+    for weight, value in zip(weights, values):
+        for token in tokenize(value):
+            tokens[token] = max(weight, tokens.get(token, 0))
+    return tokens
+
+
+def fill_search_index(apps, schema_editor):
+    SearchToken = apps.get_model('core', 'SearchToken')
+    SearchWord = apps.get_model('core', 'SearchWord')
+    for (kind, model_name), fields in FIELDS.items():
+        source = apps.get_model('core', model_name)
+        counts = Counter()
+        last = 0
+        while True:
+            rows = list(
+                source.objects.filter(pk__gt=last).order_by('pk').values_list('pk', *fields)[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            batch = []
+            for pk, *values in rows:
+                for token, weight in document_tokens(fields.values(), values).items():
+                    batch.append(SearchToken(kind=kind, token=token, object_id=pk, weight=weight))
+                    counts[token] += 1
+            SearchToken.objects.bulk_create(batch)
+            last = rows[-1][0]
+        SearchWord.objects.bulk_create(
+            [SearchWord(kind=kind, token=token, documents=n) for token, n in counts.items()], batch_size=BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('token', models.CharField(max_length=40)),
+                ('object_id', models.BigIntegerField()),
+                ('weight', models.SmallIntegerField(default=1)),
+            ],
+            options={
+                'db_table': 'search_tokens',
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='search_tokens_object_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'token', 'object_id'), name='search_token_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('token', models.CharField(max_length=40)),
+                ('documents', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'search_words',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'token'), name='search_word_unique')],
+            },
+        ),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
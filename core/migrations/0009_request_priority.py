@@ -0,0 +1,95 @@
+# Generated by Django 6.0.2 on 2026-10-18 18:49
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+
+BATCH_SIZE = 2000
+
+# core.matching.normalize_city and core.priority.priority_score as of this
+# migration, so later changes there cannot alter it
+LEVEL_POINTS = {'Low': 0, 'Medium': 1000, 'High': 2000, 'Critical': 4000}
+UNIT_POINTS = 100
+MAX_UNITS = 10
+AGE_POINTS_PER_HOUR = 50
+AGE_CAP_HOURS = 48
+
+
+def normalize_city(value):
+    parts = [part.strip() for part in (value or '').split(',') if part.strip()]
+    return parts[-1].casefold() if parts else ''
+
+
+def priority_score(emergency_level, units_required, created_at, now):
+    units = min(max(int(units_required or 0), 0), MAX_UNITS)
+    hours = min(max(int((now - created_at).total_seconds() // 3600), 0), AGE_CAP_HOURS)
+    return LEVEL_POINTS.get(emergency_level, 0) + UNIT_POINTS * units + AGE_POINTS_PER_HOUR * hours
+
+
+def bulk_update(Model, rows, fields, connection):
+    """
+    ``bulk_update``, but with one WHEN per distinct value (``pk IN (...)``)
+    rather than one per row. Most rows share a city and a score, and
+    building a WHEN per row is most of what ``bulk_update`` spends.
+    """
+    # the row ids appear up to three times per field, plus the values
+    batch_size = connection.ops.bulk_batch_size(['pk'] * 3 + fields, rows)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cases = {}
+        for field in fields:
+            by_value = defaultdict(list)
+            for row in batch:
+                by_value[getattr(row, field)].append(row.pk)
+            whens = [When(pk__in=pks, then=Value(value)) for value, pks in by_value.items()]
+            cases[field] = Case(*whens, default=F(field))
+        Model.objects.filter(pk__in=[row.pk for row in batch]).update(**cases)
+
+
+def fill_triage_fields(apps, schema_editor):
+    BloodRequest = apps.get_model('core', 'BloodRequest')
+    now = timezone.now()
+    # walk the primary key in batches; location has no index to filter on
+    rows = BloodRequest.objects.order_by('pk').only('pk', 'location', 'emergency_level', 'units_required', 'created_at')
+    last = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last)[:BATCH_SIZE])
+        if not batch:
+            break
+        for row in batch:
+            row.city_key = normalize_city(row.location)
+            row.priority = priority_score(row.emergency_level, row.units_required, row.created_at, now)
+        bulk_update(BloodRequest, batch, ['city_key', 'priority'], schema_editor.connection)
+        last = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_request_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bloodrequest',
+            name='city_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='bloodrequest',
+            name='priority',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_triage_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bloodrequest',
+            index=models.Index(fields=['status', 'blood_group', 'city_key', '-priority', '-id'], name='requests_triage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bloodrequest',
+            index=models.Index(fields=['status', '-priority', '-id'], name='requests_priority_idx'),
+        ),
+    ]
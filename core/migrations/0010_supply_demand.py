@@ -0,0 +1,84 @@
+# Generated by Django 6.0.2 on 2026-10-18 19:09
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def normalize_city(value):
+    # core.matching.normalize_city as of this migration
+    parts = [part.strip() for part in (value or '').split(',') if part.strip()]
+    return parts[-1].casefold() if parts else ''
+
+
+def fill_supply_demand(apps, schema_editor):
+    BloodRequest = apps.get_model('core', 'BloodRequest')
+    User = apps.get_model('core', 'User')
+    SupplyDemand = apps.get_model('core', 'SupplyDemand')
+    cells = defaultdict(lambda: [0, 0, 0])
+    demand = (
+        BloodRequest.objects.filter(status='Pending').order_by()
+        .values_list('city_key', 'blood_group').annotate(n=Count('pk'), units=Sum('units_required'))
+    )
+    for city, blood_group, n, units in demand:
+        cells[city, blood_group][0] += n
+        cells[city, blood_group][1] += units
+    supply = (
+        User.objects.filter(is_available=True, is_active=True).order_by()
+        .values_list('city', 'blood_group').annotate(n=Count('pk'))
+    )
+    for city, blood_group, n in supply:
+        cells[normalize_city(city), blood_group][2] += n
+    SupplyDemand.objects.bulk_create(
+        (
+            SupplyDemand(city=city, blood_group=blood_group, open_requests=n, open_units=units, donors=donors)
+            for (city, blood_group), (n, units, donors) in cells.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_request_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplyDemand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=200)),
+                ('blood_group', models.CharField(max_length=3)),
+                ('open_requests', models.IntegerField(default=0)),
+                ('open_units', models.IntegerField(default=0)),
+                ('donors', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'supply_demand',
+                'constraints': [models.UniqueConstraint(fields=('city', 'blood_group'), name='supply_demand_city_group')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SupplyDemandHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('city', models.CharField(max_length=200)),
+                ('blood_group', models.CharField(max_length=3)),
+                ('open_requests', models.IntegerField(default=0)),
+                ('open_units', models.IntegerField(default=0)),
+                ('donors', models.IntegerField(default=0)),
+                ('compatible_donors', models.IntegerField(default=0)),
+                ('shortage', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'supply_demand_history',
+                'indexes': [models.Index(fields=['bucket'], name='supply_history_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('city', 'bucket', 'blood_group'), name='supply_history_city_bucket')],
+            },
+        ),
+        migrations.RunPython(fill_supply_demand, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
@@ -14,9 +14,54 @@ class User(AbstractUser):
     city = models.CharField(max_length=100)
     is_available = models.BooleanField(default=True)
     phone = models.CharField(max_length=15, blank=True)
+    # filled from the gazetteer (core.geo) when left empty
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # lets other processes' match indexes pick up profile changes (core.matching)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            # donor matching: compatible groups in a city, available only
+            models.Index(fields=['blood_group', 'city', 'is_available'], name='users_group_city_avail_idx'),
+            # match index delta sync
+            models.Index(fields=['updated_at'], name='users_updated_idx'),
+        ]
+
+    # Fields whose old values the supply rollup (core.supply) needs on save
+    SUPPLY_FIELDS = ('blood_group', 'city', 'is_available', 'is_active')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.SUPPLY_FIELDS):
+            instance._supply = instance._supply_values()
+        return instance
+
+    def _supply_values(self):
+        return tuple(getattr(self, name) for name in self.SUPPLY_FIELDS)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None:
+            self._supply = self._supply_values()
+
+    def save(self, *args, **kwargs):
+        from .supply import record_donor_changes
+
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        adding = self._state.adding
+        old = None if adding else getattr(self, '_supply', None)
+        with transaction.atomic():
+            if not adding and old is None:
+                old = type(self).objects.filter(pk=self.pk).values_list(*self.SUPPLY_FIELDS).first()
+            super().save(*args, **kwargs)
+            new = self._supply_values()
+            if old != new:
+                record_donor_changes([(old, new)])
+        self._supply = new
 
 class BloodRequest(models.Model):
     STATUS_CHOICES = [
@@ -44,9 +89,250 @@ class BloodRequest(models.Model):
     assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='assignments')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # hospital position, filled from the gazetteer (core.geo) when left empty
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # triage ordering (core.priority): normalised city of location, urgency score
+    city_key = models.CharField(max_length=200, blank=True, default='', editable=False)
+    priority = models.IntegerField(default=0, editable=False)
     
     
     class Meta:
         db_table = 'blood_requests'
         ordering = ['-created_at']
-      
\ No newline at end of file
+        indexes = [
+            # listings: newest first, keyset-paginated on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='requests_created_idx'),
+            # status-filtered listings and the pending feed
+            models.Index(fields=['status', 'created_at', 'id'], name='requests_status_created_idx'),
+            # match index delta sync
+            models.Index(fields=['updated_at'], name='requests_updated_idx'),
+            # triage queue and donor dashboard: most urgent pending requests per group and city
+            models.Index(fields=['status', 'blood_group', 'city_key', '-priority', '-id'], name='requests_triage_idx'),
+            models.Index(fields=['status', '-priority', '-id'], name='requests_priority_idx'),
+        ]
+
+    # Fields whose old values the statistics counters (the first three) and
+    # the supply rollup need on save
+    TRACKED_FIELDS = ('status', 'blood_group', 'location', 'units_required')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.TRACKED_FIELDS):
+            instance._tracked = instance._tracked_values()
+        return instance
+
+    def _tracked_values(self):
+        return tuple(getattr(self, name) for name in self.TRACKED_FIELDS)
+
+    def _stored_values(self):
+        return type(self).objects.filter(pk=self.pk).values_list(*self.TRACKED_FIELDS).first()
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None:
+            self._tracked = self._tracked_values()
+
+    def save(self, *args, **kwargs):
+        from .priority import fill_triage_fields
+        from .stats import record_change
+        from .supply import record_request_changes
+
+        fill_triage_fields(self)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'city_key', 'priority'}
+        adding = self._state.adding
+        old = None if adding else getattr(self, '_tracked', None)
+        with transaction.atomic():
+            if not adding and old is None:
+                # loaded without the tracked fields, so read the stored values
+                old = self._stored_values()
+            super().save(*args, **kwargs)
+            new = self._tracked_values()
+            if old != new:
+                record_change(old and old[:3], new[:3])
+                record_request_changes([(old, new)])
+        self._tracked = new
+
+
+class ArchivedRequest(models.Model):
+    """A closed request moved out of ``blood_requests`` by ``archive_requests``; same id and fields"""
+    id = models.BigIntegerField(primary_key=True)
+    request_id = models.CharField(max_length=20, unique=True)
+    blood_group = models.CharField(max_length=3)
+    units_required = models.IntegerField()
+    hospital_name = models.CharField(max_length=200)
+    location = models.CharField(max_length=200)
+    emergency_level = models.CharField(max_length=20, choices=BloodRequest.EMERGENCY_LEVELS)
+    status = models.CharField(max_length=20, choices=BloodRequest.STATUS_CHOICES)
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_requests')
+    assigned_to = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_assignments'
+    )
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'blood_requests_archive'
+        ordering = ['-created_at']
+        indexes = [
+            # history listings, keyset-paginated like the live table
+            models.Index(fields=['created_at', 'id'], name='archive_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='archive_status_created_idx'),
+        ]
+
+
+class RequestCounter(models.Model):
+    """Running count of requests per status, blood group and city"""
+    scope = models.CharField(max_length=20)
+    key = models.CharField(max_length=200, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'request_counters'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='request_counter_scope_key'),
+        ]
+      
+
+class SupplyDemand(models.Model):
+    """Pending demand for one blood group in one city, and available donors of that group (see core.supply)"""
+    city = models.CharField(max_length=200)
+    blood_group = models.CharField(max_length=3)
+    open_requests = models.IntegerField(default=0)
+    open_units = models.IntegerField(default=0)
+    donors = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'supply_demand'
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'blood_group'], name='supply_demand_city_group'),
+        ]
+
+
+class SupplyDemandHistory(models.Model):
+    """One supply-demand cell as it stood in one time bucket, for trend charts"""
+    bucket = models.DateTimeField()
+    city = models.CharField(max_length=200)
+    blood_group = models.CharField(max_length=3)
+    open_requests = models.IntegerField(default=0)
+    open_units = models.IntegerField(default=0)
+    donors = models.IntegerField(default=0)
+    compatible_donors = models.IntegerField(default=0)
+    shortage = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'supply_demand_history'
+        constraints = [
+            # a city's trend is one range read
+            models.UniqueConstraint(fields=['city', 'bucket', 'blood_group'], name='supply_history_city_bucket'),
+        ]
+        indexes = [
+            # replacing and expiring whole buckets
+            models.Index(fields=['bucket'], name='supply_history_bucket_idx'),
+        ]
+
+
+class IdSequence(models.Model):
+    """Named counter that request ids are reserved from in blocks"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'id_sequences'
+
+
+class NotificationJob(models.Model):
+    """Queued fan-out of notifications about one blood request"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    blood_request = models.OneToOneField(BloodRequest, on_delete=models.CASCADE, related_name='notification_job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    sent = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'notification_jobs'
+        indexes = [
+            # workers claim due jobs in order
+            models.Index(fields=['status', 'run_after'], name='notif_jobs_status_due_idx'),
+        ]
+
+
+class Notification(models.Model):
+    """One donor told about one request; the unique pair is the deduplication key"""
+    blood_request = models.ForeignKey(BloodRequest, on_delete=models.CASCADE, related_name='notifications')
+    donor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    status = models.CharField(max_length=10, default='sent')
+    attempts = models.IntegerField(default=1)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'notifications'
+        constraints = [
+            models.UniqueConstraint(fields=['blood_request', 'donor'], name='notification_request_donor'),
+        ]
+
+
+class SearchToken(models.Model):
+    """Inverted index posting: ``token`` occurs in object ``object_id`` of ``kind`` (see core.search)"""
+    kind = models.CharField(max_length=10)
+    token = models.CharField(max_length=40)
+    object_id = models.BigIntegerField()
+    weight = models.SmallIntegerField(default=1)
+
+    class Meta:
+        db_table = 'search_tokens'
+        constraints = [
+            # also serves "newest objects containing this word" as one range read
+            models.UniqueConstraint(fields=['kind', 'token', 'object_id'], name='search_token_unique'),
+        ]
+        indexes = [
+            # re-indexing and deleting objects; covering, so SQLite prefers it
+            # to the unique index for object_id IN (...) lookups
+            models.Index(fields=['kind', 'object_id', 'token'], name='search_tokens_object_tok_idx'),
+        ]
+
+
+class SearchWord(models.Model):
+    """One distinct indexed word and the number of objects containing it"""
+    kind = models.CharField(max_length=10)
+    token = models.CharField(max_length=40)
+    documents = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'search_words'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'token'], name='search_word_unique'),
+        ]
+
+
+class FeedEvent(models.Model):
+    """A live feed message, read by the other processes' hubs (see core.feed.DatabaseBroker)"""
+    channel = models.CharField(max_length=50)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'feed_events'
+        indexes = [
+            # pruning
+            models.Index(fields=['created_at'], name='feed_events_created_idx'),
+        ]
@@ -0,0 +1,283 @@
+"""
+Donor notifications for urgent requests.
+
+Creating a request whose emergency level is in ``NOTIFY_EMERGENCY_LEVELS``
+(Critical by default) queues a ``NotificationJob`` in the same transaction,
+so the HTTP response never waits on the fan-out and no committed request is
+left without its job. The ``notification_worker`` command drains the queue:
+
+* jobs are claimed with a conditional UPDATE and held on a lease
+  (``NOTIFICATION_LEASE_SECONDS``); a crashed worker's job is claimed again
+  once its lease runs out;
+* recipients are the available compatible donors in the request's city or
+  within ``MATCH_RADIUS_KM`` of it, taken from the match index and
+  re-checked against the database ``NOTIFICATION_BATCH_SIZE`` at a time;
+* each batch is sent on a thread pool, and a ``Notification`` row, unique
+  per (request, donor), records every donor told, so a retried job skips
+  them;
+* a job with failed sends is retried with exponential backoff, up to
+  ``NOTIFICATION_MAX_ATTEMPTS`` attempts.
+
+Senders are pluggable: ``NOTIFICATION_SENDER`` is the dotted path of a class
+with a ``send(message)`` method that raises on failure. ``ConsoleSender``
+logs each message and ``FileSender`` appends them as JSON lines to
+``NOTIFICATION_OUTBOX``; both stand in for an SMS or email gateway.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .matching import get_match_index, still_matches
+from .models import Notification, NotificationJob, User
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_ATTEMPTS = 5
+
+_metrics = {'jobs_done': 0, 'jobs_retried': 0, 'jobs_failed': 0, 'sent': 0, 'failed': 0, 'skipped': 0}
+_metrics_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _metrics_lock:
+        for name, delta in deltas.items():
+            _metrics[name] += delta
+
+
+def notification_stats():
+    """Job and send counters for this process"""
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def reset_notification_stats():
+    with _metrics_lock:
+        for name in _metrics:
+            _metrics[name] = 0
+
+
+def queue_depth():
+    """Number of jobs per status"""
+    rows = NotificationJob.objects.order_by().values_list('status').annotate(n=Count('pk'))
+    return {status: n for status, n in rows}
+
+
+# -- senders ----------------------------------------------------------------
+
+class ConsoleSender:
+    """Logs each notification instead of sending it"""
+
+    def send(self, message):
+        logger.info('Notify %s: %s', message['to'], message['text'])
+
+
+class FileSender:
+    """Appends each notification to a JSON lines file"""
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'NOTIFICATION_OUTBOX', 'notifications.jsonl')
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        line = json.dumps(message, separators=(',', ':')) + '\n'
+        with self._lock, open(self.path, 'a', encoding='utf-8') as outbox:
+            outbox.write(line)
+
+
+def get_sender():
+    path = getattr(settings, 'NOTIFICATION_SENDER', 'core.notifications.ConsoleSender')
+    return import_string(path)()
+
+
+# -- queueing ---------------------------------------------------------------
+
+def should_notify(blood_request):
+    levels = getattr(settings, 'NOTIFY_EMERGENCY_LEVELS', ('Critical',))
+    return blood_request.emergency_level in levels and blood_request.status == 'Pending'
+
+
+def enqueue(blood_request):
+    """Queue the fan-out for a request; a request has at most one job"""
+    job, _ = NotificationJob.objects.get_or_create(
+        blood_request=blood_request, defaults={'run_after': timezone.now()}
+    )
+    return job
+
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt ``attempts + 1``: doubling, capped, with jitter"""
+    base = getattr(settings, 'NOTIFICATION_RETRY_SECONDS', 30)
+    cap = getattr(settings, 'NOTIFICATION_RETRY_MAX_SECONDS', 3600)
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_jobs(worker_id, limit=1):
+    """Lease up to ``limit`` due jobs to ``worker_id``"""
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'NOTIFICATION_LEASE_SECONDS', 300))
+    due = Q(status='queued', run_after__lte=now) | Q(status='running', locked_at__lt=now - lease)
+    ids = list(NotificationJob.objects.filter(due).order_by('run_after').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    # only jobs still due are taken, so concurrent workers never share one
+    NotificationJob.objects.filter(due, pk__in=ids).update(
+        status='running', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1
+    )
+    claimed = NotificationJob.objects.filter(pk__in=ids, locked_by=worker_id, locked_at=now)
+    return list(claimed.select_related('blood_request'))
+
+
+# -- fan-out ----------------------------------------------------------------
+
+def candidate_donor_ids(blood_request):
+    """Ids of donors the index says can give to the request, ascending"""
+    index = get_match_index()
+    ids = set(index.donors_for_request(blood_request.blood_group, blood_request.location))
+    if blood_request.latitude is not None and blood_request.longitude is not None:
+        radius_km = getattr(settings, 'MATCH_RADIUS_KM', 25)
+        near = index.donors_near(
+            blood_request.blood_group, blood_request.latitude, blood_request.longitude, radius_km
+        )
+        ids.update(pk for _, pk in near)
+    ids.discard(blood_request.requested_by_id)
+    return sorted(ids)
+
+
+def build_message(blood_request, donor):
+    return {
+        'request_id': blood_request.request_id,
+        'donor_id': donor.pk,
+        'to': donor.phone or donor.email,
+        'text': (
+            f'{blood_request.emergency_level}: {blood_request.units_required} unit(s) of '
+            f'{blood_request.blood_group} needed at {blood_request.hospital_name}, '
+            f'{blood_request.location}. Request {blood_request.request_id}.'
+        ),
+    }
+
+
+def _deliver(sender, message):
+    """None when sent, else the error text"""
+    try:
+        sender.send(message)
+        return None
+    except Exception as exc:
+        return f'{type(exc).__name__}: {exc}'
+
+
+class NotificationWorker:
+    """Runs claimed jobs, sending each batch of messages on a thread pool"""
+
+    def __init__(self, worker_id, pool, sender=None, batch_size=None):
+        self.worker_id = worker_id
+        self.pool = pool
+        self.sender = sender or get_sender()
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    def run_once(self, limit=1):
+        """Claim and run up to ``limit`` due jobs; returns how many ran"""
+        jobs = claim_jobs(self.worker_id, limit)
+        for job in jobs:
+            self.run(job)
+        return len(jobs)
+
+    def run(self, job):
+        start = time.perf_counter()
+        try:
+            sent, failed, skipped, error = self.fan_out(job.blood_request)
+        except Exception as exc:
+            logger.exception('Notification job %s failed', job.pk)
+            sent, failed, skipped, error = 0, 0, 0, f'{type(exc).__name__}: {exc}'
+        self.finish(job, sent, error)
+
+        elapsed = time.perf_counter() - start
+        _count(sent=sent, failed=failed, skipped=skipped)
+        logger.info(
+            'Job %s (%s): %d sent, %d failed, %d already told in %.2fs (%.0f/s)',
+            job.pk, job.blood_request.request_id, sent, failed, skipped, elapsed,
+            sent / elapsed if elapsed else sent,
+        )
+        return sent, failed, skipped
+
+    def fan_out(self, blood_request):
+        """Send to every candidate not yet told; returns (sent, failed, skipped, first error)"""
+        if blood_request.status != 'Pending':
+            return 0, 0, 0, ''
+        ids = candidate_donor_ids(blood_request)
+        radius_km = getattr(settings, 'MATCH_RADIUS_KM', 25)
+        sent = failed = skipped = 0
+        first_error = ''
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            earlier = dict(
+                Notification.objects.filter(blood_request=blood_request, donor_id__in=batch)
+                .values_list('donor_id', 'status')
+            )
+            todo = [pk for pk in batch if earlier.get(pk) != 'sent']
+            skipped += len(batch) - len(todo)
+            # the index may lag other workers, so availability, blood group and place are re-checked here
+            donors = [
+                donor for donor in
+                User.objects.filter(pk__in=todo, is_available=True, is_active=True)
+                .only('pk', 'email', 'phone', 'blood_group', 'city', 'latitude', 'longitude')
+                if still_matches(donor, blood_request, radius_km)
+            ]
+            messages = [build_message(blood_request, donor) for donor in donors]
+            errors = list(self.pool.map(lambda message: _deliver(self.sender, message), messages))
+            self.record(blood_request, donors, errors, earlier)
+
+            batch_failed = [error for error in errors if error]
+            failed += len(batch_failed)
+            sent += len(errors) - len(batch_failed)
+            first_error = first_error or (batch_failed[0] if batch_failed else '')
+        return sent, failed, skipped, first_error
+
+    def record(self, blood_request, donors, errors, earlier):
+        """Write the outcome of one batch: new rows, then retried rows per outcome"""
+        new, retried_ok, retried_failed = [], [], []
+        for donor, error in zip(donors, errors):
+            if donor.pk not in earlier:
+                new.append(Notification(
+                    blood_request=blood_request, donor=donor,
+                    status='failed' if error else 'sent', last_error=error or '',
+                ))
+            elif error:
+                retried_failed.append(donor.pk)
+            else:
+                retried_ok.append(donor.pk)
+        Notification.objects.bulk_create(new, ignore_conflicts=True)
+        existing = Notification.objects.filter(blood_request=blood_request)
+        if retried_ok:
+            existing.filter(donor_id__in=retried_ok).update(status='sent', attempts=F('attempts') + 1, last_error='')
+        if retried_failed:
+            existing.filter(donor_id__in=retried_failed).update(attempts=F('attempts') + 1)
+
+    def finish(self, job, sent, error):
+        """Release the lease: done, queued again with backoff, or failed for good"""
+        max_attempts = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        changes = {'sent': F('sent') + sent, 'locked_by': '', 'locked_at': None, 'last_error': error}
+        if not error:
+            changes['status'] = 'done'
+            _count(jobs_done=1)
+        elif job.attempts >= max_attempts:
+            changes['status'] = 'failed'
+            _count(jobs_failed=1)
+        else:
+            changes['status'] = 'queued'
+            changes['run_after'] = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            _count(jobs_retried=1)
+        # a worker whose lease was taken over leaves the job to its new owner
+        NotificationJob.objects.filter(pk=job.pk, locked_by=self.worker_id).update(
+            updated_at=timezone.now(), **changes
+        )
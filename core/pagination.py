@@ -0,0 +1,138 @@
+"""
+Keyset (cursor) pagination for request listings.
+
+Pages are ordered by (``created_at``, ``id``) descending. A cursor holds the
+key of the row at the edge of the page, so fetching any page is one range
+scan of ``page_size + 1`` rows no matter how deep the page is. Cursors are
+opaque url-safe strings; a cursor that fails to decode falls back to the
+first page.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import BloodRequest
+
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# query parameter -> allowed values
+REQUEST_FILTERS = {
+    'status': [value for value, _ in BloodRequest.STATUS_CHOICES],
+    'blood_group': ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'],
+    'emergency_level': [value for value, _ in BloodRequest.EMERGENCY_LEVELS],
+}
+
+
+def encode_cursor(direction, created_at, pk):
+    raw = f'{direction}|{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (direction, created_at, pk), or None for a missing or bad cursor"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direction, created_at, pk = raw.split('|')
+        if direction not in ('next', 'prev'):
+            return None
+        return direction, datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def get_page_size(value):
+    """Clamp a requested page size to the server-side limits"""
+    default = getattr(settings, 'REQUEST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = getattr(settings, 'REQUEST_PAGE_SIZE_MAX', MAX_PAGE_SIZE)
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def get_request_filters(params):
+    """Pick the recognised, valid listing filters out of a QueryDict"""
+    filters = {}
+    for name, allowed in REQUEST_FILTERS.items():
+        value = params.get(name)
+        if value in allowed:
+            filters[name] = value
+    return filters
+
+
+class KeysetPage:
+    """One page of rows plus the cursors for its neighbours"""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def _row_key(row):
+    if isinstance(row, dict):
+        return row['created_at'], row['id']
+    return row.created_at, row.pk
+
+
+def paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of ``queryset`` ordered by (-created_at, -id).
+
+    ``queryset`` may be a ``values()`` queryset, as long as it includes
+    ``created_at`` and ``id``.
+    """
+    key = decode_cursor(cursor)
+    if key is None:
+        direction = None
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    else:
+        direction, created_at, pk = key
+        if direction == 'next':
+            after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            rows = list(queryset.filter(after).order_by('-created_at', '-id')[:page_size + 1])
+        else:
+            before = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            rows = list(queryset.filter(before).order_by('created_at', 'id')[:page_size + 1])
+
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows)
+
+    first, last = _row_key(rows[0]), _row_key(rows[-1])
+    # walking backwards, "more" means there are newer rows still before this page
+    has_next = more if direction != 'prev' else True
+    has_prev = direction == 'next' or (direction == 'prev' and more)
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor('next', *last) if has_next else None,
+        prev_cursor=encode_cursor('prev', *first) if has_prev else None,
+    )
@@ -0,0 +1,125 @@
+"""
+Triage ordering of open requests.
+
+Each request stores a ``priority`` score built from its emergency level, the
+units it needs and how long it has waited. Age points are capped, so a
+request that has waited long enough outranks newer ones of the next level
+up, but a fresh Critical request always beats any Low one. ``city_key``
+stores the normalised city of the request's location (see
+``core.matching.normalize_city``).
+
+``BloodRequest.save`` fills both fields. Writes that bypass ``save``
+(``bulk_create``) must call ``fill_triage_fields`` themselves. Age moves
+scores without a save, so ``manage.py rescore_requests`` re-scores the
+pending requests periodically and writes only the scores that changed.
+
+The ``requests_triage_idx`` index is on (status, blood_group, city_key,
+priority, id). "Top K pending requests of one blood group in one city" is
+then one range scan of K rows. A donor can give to several groups, so the
+dashboard runs one such scan per group and merges the results. The
+citywide triage queue does the same over all eight groups, and the
+nationwide queue walks ``requests_priority_idx`` on (status, priority, id).
+"""
+import heapq
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import invalidate_on_commit
+from .matching import BLOOD_GROUPS, normalize_city
+from .models import BloodRequest
+
+
+LEVEL_POINTS = {'Low': 0, 'Medium': 1000, 'High': 2000, 'Critical': 4000}
+UNIT_POINTS = 100
+MAX_UNITS = 10
+AGE_POINTS_PER_HOUR = 50
+AGE_CAP_HOURS = 48
+
+DEFAULT_TRIAGE_LIMIT = 25
+MAX_TRIAGE_LIMIT = 200
+
+
+def priority_score(emergency_level, units_required, created_at=None, now=None):
+    """Higher is more urgent; a request without ``created_at`` is brand new"""
+    units = min(max(int(units_required or 0), 0), MAX_UNITS)
+    hours = 0
+    if created_at is not None:
+        waited = (now or timezone.now()) - created_at
+        hours = min(max(int(waited.total_seconds() // 3600), 0), AGE_CAP_HOURS)
+    return LEVEL_POINTS.get(emergency_level, 0) + UNIT_POINTS * units + AGE_POINTS_PER_HOUR * hours
+
+
+def fill_triage_fields(blood_request, now=None):
+    """Set ``city_key`` and ``priority`` from the request's other fields"""
+    blood_request.city_key = normalize_city(blood_request.location)
+    blood_request.priority = priority_score(
+        blood_request.emergency_level, blood_request.units_required, blood_request.created_at, now,
+    )
+
+
+def _ordered(queryset):
+    return queryset.filter(status='Pending').order_by('-priority', '-id')
+
+
+def top_requests(blood_groups, city, limit=10):
+    """
+    The ``limit`` most urgent pending requests of ``blood_groups`` in
+    ``city``, most urgent first. Each group is one index range scan.
+    """
+    base = _ordered(BloodRequest.objects.filter(city_key=normalize_city(city)))
+    runs = [base.filter(blood_group=group)[:limit] for group in blood_groups]
+    if len(runs) == 1:
+        return list(runs[0])
+    return list(islice(heapq.merge(*runs, key=lambda r: (-r.priority, -r.pk)), limit))
+
+
+def triage_queue(blood_group=None, city=None, limit=DEFAULT_TRIAGE_LIMIT):
+    """The most urgent pending requests, optionally of one blood group and/or in one city"""
+    if city:
+        return top_requests([blood_group] if blood_group else BLOOD_GROUPS, city, limit)
+    # across cities the queue walks requests_priority_idx
+    queue = _ordered(BloodRequest.objects.all())
+    if blood_group:
+        queue = queue.filter(blood_group=blood_group)
+    return list(queue[:limit])
+
+
+def get_triage_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_TRIAGE_LIMIT
+    return max(1, min(limit, MAX_TRIAGE_LIMIT))
+
+
+def rescore(now=None, batch_size=1000):
+    """
+    Re-score every pending request against ``now``; returns (checked, changed).
+
+    Only scores that changed are written, and ``updated_at`` is left alone:
+    ageing is not an edit, and the match index syncs on it.
+    """
+    now = now or timezone.now()
+    fields = ('pk', 'emergency_level', 'units_required', 'created_at', 'priority', 'blood_group', 'city_key')
+    pending = BloodRequest.objects.filter(status='Pending').order_by().values_list(*fields)
+    checked = 0
+    changed = []
+    for pk, level, units, created_at, stored, blood_group, city in pending.iterator(chunk_size=batch_size):
+        checked += 1
+        score = priority_score(level, units, created_at, now)
+        if score != stored:
+            changed.append((pk, score, blood_group, city))
+
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
+        with transaction.atomic():
+            BloodRequest.objects.bulk_update(
+                [BloodRequest(pk=pk, priority=score) for pk, score, _, _ in batch], ['priority'],
+            )
+            # the dashboards list requests in priority order
+            for blood_group, city in {(group, city) for _, _, group, city in batch}:
+                invalidate_on_commit(city, blood_group, ())
+    return checked, len(changed)
+
@@ -0,0 +1,422 @@
+"""
+Server-side search over blood requests and donors.
+
+Requests are found by hospital name, location and ``request_id``; donors by
+full name and city. Text is folded (accents and case dropped) and split into
+words. ``search_tokens`` is the inverted index: one row per (kind, word,
+object), weighted by the field the word came from. Its unique index on
+(kind, token, object_id) makes "the newest objects containing this word" a
+single index range read. The model signals in ``core.signals`` keep it
+current, rewriting only the rows whose words changed. Bulk writers call
+``index_rows`` themselves, and ``rebuild_search_index`` refills it from scratch.
+
+Prefix and typo tolerance work on the vocabulary, not on the documents.
+``search_words`` holds every distinct word with the number of objects that
+contain it. Each process mirrors it in memory as a sorted list (for
+prefixes) plus a trigram index (for misspellings). Words added by other
+processes arrive through a delta sync on id, and the whole vocabulary is
+reloaded now and then to refresh the counts. A query word of four letters or
+more also matches words whose start is one edit away, or two from eight
+letters on.
+
+A query is answered in two steps:
+
+* the query word with the fewest documents picks the candidates: the newest
+  ``SEARCH_CANDIDATES`` objects holding any of its expansions, read straight
+  off the index one expansion at a time;
+* every other query word is looked up among those candidates only, and an
+  object must match all of them.
+
+A match scores its field weight times how close the word is (exact 1, prefix
+0.8, one edit 0.5, two edits 0.3). Results are ordered by total score, newest
+first on ties. Request id prefixes (``REQ10004``, or just the digits) rank
+above any text match. A filtered ``queryset`` (status, blood group...) is
+applied inside the candidate query, so the window holds matching objects
+only rather than the newest ones of any status. Hits are re-read from their
+own table, which drops stale postings.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from .ids import REQUEST_ID_PREFIX
+from .models import SearchToken, SearchWord
+
+
+KINDS = ('request', 'donor')
+MODELS = {'request': 'BloodRequest', 'donor': 'User'}
+
+# kind -> indexed field -> weight
+FIELDS = {
+    'request': {'hospital_name': 3, 'location': 2},
+    'donor': {'full_name': 3, 'city': 2},
+}
+
+MAX_TOKEN_LENGTH = 40
+MAX_TERMS = 6
+CHUNK_SIZE = 500
+DEFAULT_CANDIDATES = 1000
+DEFAULT_EXPANSIONS = 10
+DEFAULT_SYNC_SECONDS = 10
+DEFAULT_RELOAD_SECONDS = 600
+DEFAULT_BATCH_SIZE = 5000
+
+EXACT = 1.0
+PREFIX = 0.8
+FUZZY = {1: 0.5, 2: 0.3}
+ID_EXACT = 100.0
+ID_PREFIX = 50.0
+
+_WORD = re.compile(r'[0-9a-z]+')
+_REQUEST_ID = re.compile(rf'(?:{REQUEST_ID_PREFIX})?(\d{{3,}})', re.IGNORECASE)
+
+
+def fold(text):
+    """Lower-case ``text`` and strip its accents"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    """Distinct words of ``text`` in order of appearance, single characters left out"""
+    words = {}
+    for word in _WORD.findall(fold(text)):
+        if len(word) > 1:
+            words.setdefault(word[:MAX_TOKEN_LENGTH], None)
+    return list(words)
+
+
+def document_tokens(kind, values):
+    """word -> weight for one object; ``values`` in ``FIELDS[kind]`` order"""
+    tokens = {}
+    for weight, value in zip(FIELDS[kind].values(), values):
+        for token in tokenize(value):
+            tokens[token] = max(weight, tokens.get(token, 0))
+    return tokens
+
+
+def trigrams(word):
+    """Trigrams of ``word``, padded so that the first letters weigh most"""
+    padded = f'$${word}'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def allowed_edits(term):
+    if term.isdigit() or len(term) < 4:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def prefix_distance(term, word, limit):
+    """Fewest edits turning ``term`` into some prefix of ``word``, or None above ``limit``"""
+    previous = list(range(len(word) + 1))
+    for i, char in enumerate(term, 1):
+        current = [i]
+        for j, other in enumerate(word, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return None
+        previous = current
+    distance = min(previous)
+    return distance if distance <= limit else None
+
+
+# -- vocabulary -------------------------------------------------------------
+
+class Vocabulary:
+    """Distinct indexed words of one kind, with their document counts"""
+
+    def __init__(self):
+        self.documents = {}
+        self.words = []
+        self.grams = defaultdict(set)
+        self.last_id = 0
+        self.synced_at = None
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, word, documents):
+        if word not in self.documents:
+            insort(self.words, word)
+            for gram in trigrams(word):
+                self.grams[gram].add(word)
+        self.documents[word] = documents
+
+    def note(self, counts):
+        """Apply document count changes made by this process"""
+        with self.lock:
+            for word, delta in counts.items():
+                self.add(word, max(0, self.documents.get(word, 0) + delta))
+
+    def sync(self, kind):
+        interval = getattr(settings, 'SEARCH_SYNC_SECONDS', DEFAULT_SYNC_SECONDS)
+        now = time.monotonic()
+        with self.lock:
+            if self.synced_at is not None and now - self.synced_at < interval:
+                return
+            rows = (
+                SearchWord.objects.filter(kind=kind, pk__gt=self.last_id)
+                .order_by('pk').values_list('pk', 'token', 'documents')
+            )
+            for pk, token, documents in rows.iterator(chunk_size=10000):
+                self.add(token, documents)
+                self.last_id = pk
+            self.synced_at = now
+
+    def expand(self, term, limit=None):
+        """word -> match quality for the vocabulary words ``term`` may stand for"""
+        limit = limit or getattr(settings, 'SEARCH_EXPANSIONS', DEFAULT_EXPANSIONS)
+        matches = {}
+        with self.lock:
+            for i in range(bisect_left(self.words, term), len(self.words)):
+                word = self.words[i]
+                if not word.startswith(term):
+                    break
+                if self.documents[word]:
+                    matches[word] = EXACT if word == term else PREFIX
+
+            edits = allowed_edits(term)
+            if edits:
+                grams = trigrams(term)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self.grams.get(gram, ()))
+                # every edit spoils at most three trigrams
+                needed = max(1, len(grams) - 3 * edits)
+                for word, count in shared.items():
+                    if count >= needed and word not in matches and self.documents[word]:
+                        distance = prefix_distance(term, word[:len(term) + edits], edits)
+                        if distance:
+                            matches[word] = FUZZY[distance]
+
+            best = sorted(matches, key=lambda word: (-matches[word], -self.documents.get(word, 0)))[:limit]
+            return {word: matches[word] for word in best}
+
+    def frequency(self, words):
+        return sum(self.documents.get(word, 0) for word in words)
+
+
+_vocabularies = {}
+_vocabularies_lock = threading.Lock()
+
+
+def get_vocabulary(kind):
+    """This process's vocabulary for ``kind``, synced if due"""
+    reload_after = getattr(settings, 'SEARCH_RELOAD_SECONDS', DEFAULT_RELOAD_SECONDS)
+    with _vocabularies_lock:
+        vocabulary = _vocabularies.get(kind)
+        if vocabulary is None or time.monotonic() - vocabulary.loaded_at > reload_after:
+            vocabulary = _vocabularies[kind] = Vocabulary()
+    vocabulary.sync(kind)
+    return vocabulary
+
+
+def reset_vocabularies():
+    with _vocabularies_lock:
+        _vocabularies.clear()
+
+
+# -- indexing ---------------------------------------------------------------
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), CHUNK_SIZE):
+        yield values[start:start + CHUNK_SIZE]
+
+
+def _count_words(kind, counts):
+    """Apply {word: document count change} to ``search_words``"""
+    counts = {word: delta for word, delta in counts.items() if delta}
+    if not counts:
+        return
+    new = [SearchWord(kind=kind, token=word, documents=0) for word, delta in counts.items() if delta > 0]
+    SearchWord.objects.bulk_create(new, ignore_conflicts=True)
+    by_delta = defaultdict(list)
+    for word, delta in counts.items():
+        by_delta[delta].append(word)
+    for delta, words in by_delta.items():
+        for chunk in _chunks(words):
+            SearchWord.objects.filter(kind=kind, token__in=chunk).update(documents=F('documents') + delta)
+    vocabulary = _vocabularies.get(kind)
+    if vocabulary is not None:
+        vocabulary.note(counts)
+
+
+def index_object(kind, pk, values, created=False):
+    """Bring one object's postings in line with its current ``values``"""
+    wanted = document_tokens(kind, values)
+    postings = SearchToken.objects.filter(kind=kind, object_id=pk)
+    stored = {} if created else dict(postings.values_list('token', 'weight'))
+    if stored == wanted:
+        return
+    removed = [token for token in stored if token not in wanted]
+    if removed:
+        postings.filter(token__in=removed).delete()
+    for token, weight in wanted.items():
+        if token in stored and stored[token] != weight:
+            postings.filter(token=token).update(weight=weight)
+    added = {token: weight for token, weight in wanted.items() if token not in stored}
+    SearchToken.objects.bulk_create(
+        [SearchToken(kind=kind, token=token, object_id=pk, weight=weight) for token, weight in added.items()]
+    )
+    _count_words(kind, {**{token: -1 for token in removed}, **{token: 1 for token in added}})
+
+
+def index_instance(kind, instance, created=False, update_fields=None):
+    """``index_object`` for a saved model instance; skipped when no indexed field was saved"""
+    fields = FIELDS[kind]
+    if update_fields is not None and not set(update_fields) & set(fields):
+        return
+    index_object(kind, instance.pk, [getattr(instance, field) for field in fields], created)
+
+
+def unindex_object(kind, pk):
+    unindex_objects(kind, [pk])
+
+
+def unindex_objects(kind, pks):
+    """Drop every posting of the objects ``pks``"""
+    counts = Counter()
+    for chunk in _chunks(pks):
+        postings = SearchToken.objects.filter(kind=kind, object_id__in=chunk)
+        stored = list(postings.values_list('token', flat=True))
+        if stored:
+            postings.delete()
+            counts.update(stored)
+    _count_words(kind, {token: -n for token, n in counts.items()})
+
+
+def index_rows(kind, rows):
+    """Index objects that have no postings yet: ``rows`` of (pk, *values in ``FIELDS[kind]`` order)"""
+    postings, counts = [], Counter()
+    for pk, *values in rows:
+        for token, weight in document_tokens(kind, values).items():
+            postings.append(SearchToken(kind=kind, token=token, object_id=pk, weight=weight))
+            counts[token] += 1
+    SearchToken.objects.bulk_create(postings, ignore_conflicts=True)
+    _count_words(kind, counts)
+    return len(postings)
+
+
+def rebuild(kind, batch_size=DEFAULT_BATCH_SIZE):
+    """Refill the whole index for ``kind`` from its table; returns (objects, postings)"""
+    source = global_apps.get_model('core', MODELS[kind])
+    fields = list(FIELDS[kind])
+    counts = Counter()
+    objects = postings = last = 0
+    with transaction.atomic():
+        SearchToken.objects.filter(kind=kind).delete()
+        SearchWord.objects.filter(kind=kind).delete()
+        while True:
+            rows = list(
+                source.objects.filter(pk__gt=last).order_by('pk').values_list('pk', *fields)[:batch_size]
+            )
+            if not rows:
+                break
+            batch = []
+            for pk, *values in rows:
+                for token, weight in document_tokens(kind, values).items():
+                    batch.append(SearchToken(kind=kind, token=token, object_id=pk, weight=weight))
+                    counts[token] += 1
+            SearchToken.objects.bulk_create(batch)
+            objects += len(rows)
+            postings += len(batch)
+            last = rows[-1][0]
+        SearchWord.objects.bulk_create([SearchWord(kind=kind, token=token, documents=n) for token, n in counts.items()])
+    reset_vocabularies()
+    return objects, postings
+
+
+# -- queries ----------------------------------------------------------------
+
+def _request_id_scores(terms, limit, queryset):
+    """pk -> score for requests in ``queryset`` whose id starts with one of ``terms``"""
+    scores = {}
+    for term in terms:
+        prefix = f'{REQUEST_ID_PREFIX}{_REQUEST_ID.fullmatch(term).group(1)}'
+        # a range rather than LIKE, so every backend can use the unique index
+        rows = (
+            queryset.filter(request_id__gte=prefix, request_id__lt=prefix + ':')
+            .order_by('request_id').values_list('pk', 'request_id')[:limit]
+        )
+        for pk, request_id in rows:
+            scores[pk] = max(scores.get(pk, 0), ID_EXACT if request_id == prefix else ID_PREFIX)
+    return scores
+
+
+def _text_scores(kind, terms, queryset):
+    """pk -> score for objects in ``queryset`` matching every one of ``terms``"""
+    vocabulary = get_vocabulary(kind)
+    expansions = [vocabulary.expand(term) for term in terms]
+    if not expansions or not all(expansions):
+        return {}
+    expansions.sort(key=vocabulary.frequency)
+    window = getattr(settings, 'SEARCH_CANDIDATES', DEFAULT_CANDIDATES)
+    postings = SearchToken.objects.filter(kind=kind)
+    candidates = postings
+    if queryset.query.has_filters():
+        # filtered before the window is cut, or a narrow filter could leave it empty
+        candidates = postings.filter(Exists(queryset.order_by().filter(pk=OuterRef('object_id'))))
+
+    scores = {}
+    for word, quality in expansions[0].items():
+        rows = candidates.filter(token=word).order_by('-object_id').values_list('object_id', 'weight')[:window]
+        for pk, weight in rows:
+            scores[pk] = max(scores.get(pk, 0), quality * weight)
+    if len(scores) > window:
+        scores = {pk: scores[pk] for pk in heapq.nlargest(window, scores)}
+
+    for expansion in expansions[1:]:
+        best = {}
+        for chunk in _chunks(scores):
+            rows = postings.filter(token__in=list(expansion), object_id__in=chunk)
+            for pk, word, weight in rows.values_list('object_id', 'token', 'weight'):
+                best[pk] = max(best.get(pk, 0), expansion[word] * weight)
+        scores = {pk: score + best[pk] for pk, score in scores.items() if pk in best}
+        if not scores:
+            break
+    return scores
+
+
+def search(kind, query, limit=20, queryset=None):
+    """Objects of ``kind`` that best match ``query``, each with a ``search_score``"""
+    if queryset is None:
+        queryset = global_apps.get_model('core', MODELS[kind]).objects.all()
+    terms = tokenize(query)[:MAX_TERMS]
+
+    scores = {}
+    if kind == 'request':
+        ids = [term for term in terms if _REQUEST_ID.fullmatch(term)]
+        scores = _request_id_scores(ids, limit, queryset)
+        # an id is not in the word index; bare digits may be, so they stay when known
+        vocabulary = get_vocabulary(kind)
+        terms = [
+            term for term in terms
+            if not _REQUEST_ID.fullmatch(term) or (term.isdigit() and vocabulary.expand(term))
+        ]
+    if terms:
+        for pk, score in _text_scores(kind, terms, queryset).items():
+            scores[pk] = max(scores.get(pk, 0), score)
+
+    ranked = sorted(scores, key=lambda pk: (-scores[pk], -pk))
+    results = []
+    step = max(limit * 2, 1)
+    for start in range(0, len(ranked), step):
+        chunk = ranked[start:start + step]
+        found = queryset.in_bulk(chunk)
+        for pk in chunk:
+            if pk in found:
+                found[pk].search_score = round(scores[pk], 2)
+                results.append(found[pk])
+                if len(results) >= limit:
+                    return results
+    return results
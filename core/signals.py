@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caching import invalidate_on_commit
+from .feed import publish_request
+from .geo import geocode
+from .matching import track_donor, untrack_donor
+from .models import ArchivedRequest, BloodRequest, User
+from .notifications import enqueue, should_notify
+from .search import index_instance, unindex_object
+from .stats import record_change
+from .supply import record_donor_changes, record_request_changes
+
+
+@receiver(pre_save, sender=User)
+def user_located(sender, instance, **kwargs):
+    """Place donors without coordinates at their city"""
+    if instance.latitude is None or instance.longitude is None:
+        instance.latitude, instance.longitude = geocode(instance.city) or (None, None)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the match and search indexes in step with donor profile changes"""
+    track_donor(instance)
+    index_instance('donor', instance, created, update_fields)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    old = getattr(instance, '_supply', None) or instance._supply_values()
+    record_donor_changes([(old, None)])
+    untrack_donor(instance.pk)
+    unindex_object('donor', instance.pk)
+
+
+@receiver(pre_save, sender=BloodRequest)
+def blood_request_located(sender, instance, **kwargs):
+    """Place requests without coordinates, or whose location changed, at the gazetteer point"""
+    old = getattr(instance, '_tracked', None)
+    moved = old is not None and old[2] != instance.location
+    if moved or instance.latitude is None or instance.longitude is None:
+        instance.latitude, instance.longitude = geocode(instance.location) or (None, None)
+
+
+@receiver(post_save, sender=BloodRequest)
+def blood_request_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the search index, list cache and live feed in step with request changes"""
+    index_instance('request', instance, created, update_fields)
+    # BloodRequest.save refreshes its snapshot after this signal, so it still
+    # holds the values from before the save
+    old = getattr(instance, '_tracked', None)
+    invalidate_on_commit(instance.location, instance.blood_group, {instance.status, old[0] if old else None})
+    if old and old[1:3] != (instance.blood_group, instance.location):
+        invalidate_on_commit(old[2], old[1], {old[0]})
+    if created and should_notify(instance):
+        # queued in the request's own transaction; the worker does the sending
+        enqueue(instance)
+    kind = 'created' if created else 'updated'
+    transaction.on_commit(lambda: publish_request(instance, kind))
+
+
+@receiver(post_delete, sender=BloodRequest)
+def blood_request_deleted(sender, instance, **kwargs):
+    # post_delete runs inside the deletion transaction, cascades included
+    old = getattr(instance, '_tracked', None) or instance._tracked_values()
+    record_change(old[:3], None)
+    record_request_changes([(old, None)])
+    invalidate_on_commit(old[2], old[1], {old[0]})
+    unindex_object('request', instance.pk)
+
+
+@receiver(post_delete, sender=ArchivedRequest)
+def archived_request_deleted(sender, instance, **kwargs):
+    # archived requests are still counted, e.g. until their requester is deleted
+    record_change((instance.status, instance.blood_group, instance.location), None)
@@ -0,0 +1,39 @@
+"""
+WhiteNoise static file serving that also runs natively under ASGI.
+
+WhiteNoise's middleware is sync only. In an ASGI deployment Django then
+hands every request, static or not, to a thread for that one middleware
+and back to the event loop for the rest of the stack, which costs about
+half the throughput of a small page. ``StaticFilesMiddleware`` keeps
+WhiteNoise's behaviour but awaits the rest of the stack directly. Only
+the static files themselves are served from a thread.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # looks on disk
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,153 @@
+"""
+Incrementally maintained request statistics.
+
+``RequestCounter`` holds one row per (scope, key): the grand total, and a
+count per status, blood group and city. ``BloodRequest.save`` and the
+``post_delete`` signal adjust the affected rows in the same transaction as
+the write, so the dashboards read their numbers from a handful of rows
+instead of running COUNT queries over ``blood_requests``. Writes that bypass ``save`` (queryset
+``update``/``bulk_create``) must call ``record_change`` themselves, and
+``manage.py request_stats --verify/--rebuild`` can always recompute the
+table from scratch. Requests moved to the archive table (``core.archive``)
+stay counted, so the counters cover the whole history.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .matching import normalize_city
+
+
+TOTAL = 'total'
+STATUS = 'status'
+BLOOD_GROUP = 'blood_group'
+CITY = 'city'
+
+
+def counter_keys(status, blood_group, location):
+    """The (scope, key) counters a request with these values belongs to"""
+    return [
+        (TOTAL, ''),
+        (STATUS, status),
+        (BLOOD_GROUP, blood_group),
+        (CITY, normalize_city(location)),
+    ]
+
+
+def _apply(deltas):
+    from .models import RequestCounter
+
+    for (scope, key), delta in deltas.items():
+        if not delta:
+            continue
+        updated = RequestCounter.objects.filter(scope=scope, key=key).update(count=F('count') + delta)
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                RequestCounter.objects.create(scope=scope, key=key, count=delta)
+        except IntegrityError:
+            # another writer created the row first
+            RequestCounter.objects.filter(scope=scope, key=key).update(count=F('count') + delta)
+
+
+def record_change(old=None, new=None):
+    """
+    Move a request between counters.
+
+    ``old`` and ``new`` are (status, blood_group, location) tuples; pass
+    ``old=None`` for a new request and ``new=None`` for a deleted one.
+    Call inside the transaction that writes the request.
+    """
+    record_changes([(old, new)])
+
+
+def record_changes(changes):
+    """``record_change`` for many (old, new) pairs, one UPDATE per counter"""
+    deltas = Counter()
+    for old, new in changes:
+        if old is not None:
+            for key in counter_keys(*old):
+                deltas[key] -= 1
+        if new is not None:
+            for key in counter_keys(*new):
+                deltas[key] += 1
+    _apply(deltas)
+
+
+def compute_counts(queryset):
+    """Recount a BloodRequest queryset into {(scope, key): count}"""
+    counts = Counter()
+    rows = queryset.order_by().values('status', 'blood_group', 'location').annotate(n=Count('pk'))
+    for row in rows.iterator(chunk_size=2000):
+        for key in counter_keys(row['status'], row['blood_group'], row['location']):
+            counts[key] += row['n']
+    return counts
+
+
+def recount():
+    """Recount live and archived requests, as the counters should hold them"""
+    from .models import ArchivedRequest, BloodRequest
+
+    return compute_counts(BloodRequest.objects.all()) + compute_counts(ArchivedRequest.objects.all())
+
+
+def stored_counts():
+    from .models import RequestCounter
+
+    return {
+        (scope, key): count
+        for scope, key, count in RequestCounter.objects.values_list('scope', 'key', 'count')
+    }
+
+
+def diff_counts(expected, stored):
+    """{(scope, key): (expected, stored)} for every counter that is off"""
+    keys = set(expected) | set(stored)
+    return {
+        key: (expected.get(key, 0), stored.get(key, 0))
+        for key in keys
+        if expected.get(key, 0) != stored.get(key, 0)
+    }
+
+
+def rebuild_counts():
+    """Replace the counter table with a fresh recount; returns the new counts"""
+    from .models import RequestCounter
+
+    with transaction.atomic():
+        counts = recount()
+        RequestCounter.objects.all().delete()
+        RequestCounter.objects.bulk_create(
+            RequestCounter(scope=scope, key=key, count=count)
+            for (scope, key), count in counts.items()
+        )
+    return counts
+
+
+def dashboard_counts():
+    """Total and per-status request counts, read in one indexed query"""
+    from .models import RequestCounter
+
+    rows = dict(
+        RequestCounter.objects.filter(scope__in=(TOTAL, STATUS))
+        .values_list('key', 'count')
+    )
+    return {
+        'total': rows.get('', 0),
+        'pending': rows.get('Pending', 0),
+        'in_progress': rows.get('In Progress', 0),
+        'completed': rows.get('Completed', 0),
+        'cancelled': rows.get('Cancelled', 0),
+    }
+
+
+def breakdown(scope):
+    """Counts for one scope (blood_group or city), largest first"""
+    from .models import RequestCounter
+
+    return list(
+        RequestCounter.objects.filter(scope=scope, count__gt=0)
+        .order_by('-count', 'key').values_list('key', 'count')
+    )
@@ -0,0 +1,276 @@
+"""
+Supply-vs-demand rollup per city and blood group.
+
+``SupplyDemand`` holds one row per (city, blood group). Each row has the
+pending requests and units asked for that group, and the available donors
+*of* that group. Donors are stored under their own group, so a donor change
+touches one row. The compatible supply of a recipient group is summed from
+the city's (at most eight) rows when the matrix is read, using the rules in
+``core.matching``. Cities are ``normalize_city`` keys, as in the match
+index.
+
+``BloodRequest.save``, ``User.save`` and the delete signals adjust the rows
+in the same transaction as the write. Writes that bypass ``save`` (queryset
+``update``/``bulk_create``) must call ``record_request_changes`` or
+``record_donor_changes`` themselves. ``manage.py supply_demand`` recomputes
+the table from scratch, which also repairs any drift.
+
+Each run of that command also copies the matrix into ``SupplyDemandHistory``
+under the current time bucket (``SUPPLY_HISTORY_BUCKET_MINUTES``, default
+60), for trend charts. It drops buckets older than ``SUPPLY_HISTORY_DAYS``
+(default 90). Reading the matrix or its history never touches ``users`` or
+``blood_requests``.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .matching import BLOOD_GROUPS, donor_groups_for, normalize_city
+
+
+OPEN_STATUS = 'Pending'
+FIELDS = ('open_requests', 'open_units', 'donors')
+HISTORY_FIELDS = ('open_requests', 'open_units', 'donors', 'shortage')
+
+DEFAULT_BUCKET_MINUTES = 60
+DEFAULT_HISTORY_DAYS = 90
+DEFAULT_TREND_DAYS = 30
+
+_DONOR_GROUPS = {group: donor_groups_for(group) for group in BLOOD_GROUPS}
+
+
+def _deltas():
+    return defaultdict(lambda: [0, 0, 0])
+
+
+def record_request_changes(changes):
+    """
+    Move requests between cells.
+
+    ``changes`` are (old, new) pairs of (status, blood_group, location,
+    units_required) tuples; ``old=None`` for a new request and ``new=None``
+    for a deleted one. Only pending requests count. Call inside the
+    transaction that writes the requests.
+    """
+    deltas = _deltas()
+    for old, new in changes:
+        for values, sign in ((old, -1), (new, 1)):
+            if values is None or values[0] != OPEN_STATUS:
+                continue
+            _, blood_group, location, units = values
+            cell = deltas[normalize_city(location), blood_group]
+            cell[0] += sign
+            # form posts hand ``save`` the raw string
+            cell[1] += sign * int(units or 0)
+    _apply(deltas)
+
+
+def record_donor_changes(changes):
+    """
+    Move donors between cells.
+
+    ``changes`` are (old, new) pairs of (blood_group, city, is_available,
+    is_active) tuples, with ``None`` as in ``record_request_changes``.
+    Only available, active donors count.
+    """
+    deltas = _deltas()
+    for old, new in changes:
+        for values, sign in ((old, -1), (new, 1)):
+            if values is None:
+                continue
+            blood_group, city, is_available, is_active = values
+            if is_available and is_active:
+                deltas[normalize_city(city), blood_group][2] += sign
+    _apply(deltas)
+
+
+def _apply(deltas):
+    from .models import SupplyDemand
+
+    for (city, blood_group), values in deltas.items():
+        changes = {field: delta for field, delta in zip(FIELDS, values) if delta}
+        if not changes:
+            continue
+        cell = SupplyDemand.objects.filter(city=city, blood_group=blood_group)
+        increments = {field: F(field) + delta for field, delta in changes.items()}
+        if cell.update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                SupplyDemand.objects.create(city=city, blood_group=blood_group, **changes)
+        except IntegrityError:
+            # another writer created the row first
+            cell.update(**increments)
+
+
+def compute_rollup():
+    """Recount {(city, blood_group): [open_requests, open_units, donors]} from the source tables"""
+    from .models import BloodRequest, User
+
+    cells = _deltas()
+    demand = (
+        BloodRequest.objects.filter(status=OPEN_STATUS).order_by()
+        .values_list('city_key', 'blood_group').annotate(n=Count('pk'), units=Sum('units_required'))
+    )
+    for city, blood_group, n, units in demand.iterator(chunk_size=2000):
+        cells[city, blood_group][0] += n
+        cells[city, blood_group][1] += units
+    supply = (
+        User.objects.filter(is_available=True, is_active=True).order_by()
+        .values_list('city', 'blood_group').annotate(n=Count('pk'))
+    )
+    for city, blood_group, n in supply.iterator(chunk_size=2000):
+        # several spellings of a city share one key
+        cells[normalize_city(city), blood_group][2] += n
+    return {key: values for key, values in cells.items() if any(values)}
+
+
+def stored_rollup():
+    from .models import SupplyDemand
+
+    return {
+        (city, blood_group): list(values)
+        for city, blood_group, *values in SupplyDemand.objects.values_list('city', 'blood_group', *FIELDS)
+        if any(values)
+    }
+
+
+def rebuild_rollup():
+    """Bring the rollup in line with a fresh recount; returns the number of cells that were off"""
+    from .models import SupplyDemand
+
+    with transaction.atomic():
+        # Lock the rows before counting: a writer holding one commits first
+        # and is counted, later ones wait and add their deltas on top. Counted
+        # first, a writer committing in between is overwritten (on MySQL the
+        # REPEATABLE READ snapshot starts at the first plain read).
+        rows = {(row.city, row.blood_group): row for row in SupplyDemand.objects.select_for_update().order_by()}
+        cells = compute_rollup()
+        zero = [0] * len(FIELDS)
+        stale = []
+        for key, row in rows.items():
+            values = cells.get(key, zero)
+            if [getattr(row, field) for field in FIELDS] != values:
+                for field, value in zip(FIELDS, values):
+                    setattr(row, field, value)
+                stale.append(row)
+        missing = [key for key in cells if key not in rows]
+        # updated in place rather than replaced, so the writers waiting on a row still find it
+        SupplyDemand.objects.bulk_update(stale, FIELDS, batch_size=1000)
+        SupplyDemand.objects.bulk_create(
+            (SupplyDemand(city=city, blood_group=blood_group, **dict(zip(FIELDS, cells[city, blood_group])))
+             for city, blood_group in missing),
+            batch_size=1000,
+        )
+    return len(stale) + len(missing)
+
+
+# -- reads -----------------------------------------------------------------
+
+def _cell(city, blood_group, groups):
+    open_requests, open_units, donors = groups.get(blood_group, (0, 0, 0))
+    compatible = sum(groups[group][2] for group in _DONOR_GROUPS[blood_group] if group in groups)
+    return {
+        'city': city,
+        'blood_group': blood_group,
+        'open_requests': open_requests,
+        'open_units': open_units,
+        'donors': donors,
+        'compatible_donors': compatible,
+        # one unit per donor
+        'shortage': max(0, open_units - compatible),
+    }
+
+
+def matrix(city=None, limit=None):
+    """
+    The heatmap: one row per city with a cell per blood group, largest total
+    shortage first. Read from the rollup table only.
+    """
+    from .models import SupplyDemand
+
+    rows = SupplyDemand.objects.order_by()
+    if city:
+        rows = rows.filter(city=normalize_city(city))
+    by_city = defaultdict(dict)
+    for city_key, blood_group, *values in rows.values_list('city', 'blood_group', *FIELDS):
+        by_city[city_key][blood_group] = values
+
+    cities = []
+    for city_key, groups in by_city.items():
+        cells = [_cell(city_key, blood_group, groups) for blood_group in BLOOD_GROUPS]
+        if not any(cell['open_units'] or cell['donors'] for cell in cells):
+            continue
+        cities.append({
+            'city': city_key,
+            'open_units': sum(cell['open_units'] for cell in cells),
+            'shortage': sum(cell['shortage'] for cell in cells),
+            'cells': cells,
+        })
+    cities.sort(key=lambda row: (-row['shortage'], -row['open_units'], row['city']))
+    return cities[:limit] if limit else cities
+
+
+def history_days():
+    return getattr(settings, 'SUPPLY_HISTORY_DAYS', DEFAULT_HISTORY_DAYS)
+
+
+def get_trend_days(value):
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        return min(DEFAULT_TREND_DAYS, history_days())
+    return max(1, min(days, history_days()))
+
+
+def bucket_start(now=None):
+    """Start of the history bucket ``now`` falls in"""
+    seconds = getattr(settings, 'SUPPLY_HISTORY_BUCKET_MINUTES', DEFAULT_BUCKET_MINUTES) * 60
+    now = now or timezone.now()
+    return datetime.fromtimestamp(now.timestamp() // seconds * seconds, tz=dt_timezone.utc)
+
+
+def snapshot(now=None):
+    """
+    Copy the matrix into the history under the current bucket, replacing
+    an earlier copy in the same bucket, and drop expired buckets. Returns
+    the number of cells written.
+    """
+    from .models import SupplyDemandHistory
+
+    now = now or timezone.now()
+    bucket = bucket_start(now)
+    rows = [
+        SupplyDemandHistory(bucket=bucket, **cell)
+        for row in matrix()
+        for cell in row['cells']
+        if cell['open_units'] or cell['donors']
+    ]
+    with transaction.atomic():
+        SupplyDemandHistory.objects.filter(bucket=bucket).delete()
+        SupplyDemandHistory.objects.bulk_create(rows, batch_size=1000)
+        SupplyDemandHistory.objects.filter(bucket__lt=now - timedelta(days=history_days())).delete()
+    return len(rows)
+
+
+def trend(city, blood_group=None, days=DEFAULT_TREND_DAYS):
+    """
+    History points for one city, oldest first: one blood group, or all of
+    them summed. Compatible donors overlap between groups, so they are only
+    given for a single group; ``donors`` sums without double counting.
+    """
+    from .models import SupplyDemandHistory
+
+    rows = SupplyDemandHistory.objects.filter(
+        city=normalize_city(city), bucket__gte=timezone.now() - timedelta(days=days),
+    )
+    fields = HISTORY_FIELDS
+    if blood_group:
+        rows = rows.filter(blood_group=blood_group)
+        fields += ('compatible_donors',)
+    points = rows.order_by('bucket').values('bucket').annotate(**{field: Sum(field) for field in fields})
+    return list(points)
@@ -1,3 +1,1614 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished
+from django.db import connection
+from django.http import HttpResponse
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from Blood_Bridge import asgi
+
+from . import actions, checks, compression, ids, supply
+from .caching import cache_stats, reset_cache_stats
+from .feed import CHANNEL, DatabaseBroker, FeedHub, InProcessBroker, get_hub, publish_request, reset_hub
+from .geo import GeoGrid, geocode, haversine_km
+from .management.commands.bench_accept import race_accept
+from .matching import (
+    MatchIndex, can_donate, compatible_donors, donor_groups_for,
+    get_match_index, nearby_donors, normalize_city, reset_match_index,
+)
+from .metrics import render_metrics, reset_metrics, slow_queries
+from .models import (
+    ArchivedRequest, BloodRequest, FeedEvent, Notification, NotificationJob, RequestCounter, SearchToken, SearchWord,
+    SupplyDemandHistory, User,
+)
+from .notifications import NotificationWorker
+from .pagination import decode_cursor, encode_cursor, get_page_size, paginate
+from .priority import AGE_POINTS_PER_HOUR, priority_score, rescore
+from .search import rebuild, reset_vocabularies, search
+from .static import StaticFilesMiddleware
+from .stats import breakdown, dashboard_counts
+from .supply import compute_rollup, matrix, rebuild_rollup, snapshot, stored_rollup, trend
+
+# Templates use {% static %}; the manifest storage needs collectstatic first.
+PLAIN_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def make_user(email, blood_group='O+', city='Chennai', **extra):
+    return User.objects.create_user(
+        username=email, email=email, password=None,
+        full_name=email.split('@')[0], blood_group=blood_group, city=city, **extra
+    )
+
+
+def make_request(requested_by, request_id, blood_group='A+', location='Chennai', **extra):
+    extra.setdefault('emergency_level', 'High')
+    extra.setdefault('hospital_name', 'Apollo Hospital')
+    extra.setdefault('units_required', 2)
+    return BloodRequest.objects.create(
+        request_id=request_id, blood_group=blood_group,
+        location=location, requested_by=requested_by, **extra
+    )
+
+
+class CompatibilityTests(TestCase):
+
+    def test_universal_donor_and_recipient(self):
+        for group in ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']:
+            self.assertTrue(can_donate('O-', group))
+            self.assertTrue(can_donate(group, 'AB+'))
+
+    def test_rh_negative_cannot_receive_positive(self):
+        self.assertFalse(can_donate('O+', 'O-'))
+        self.assertFalse(can_donate('A+', 'A-'))
+        self.assertEqual(donor_groups_for('O-'), ['O-'])
+        self.assertEqual(sorted(donor_groups_for('A-')), ['A-', 'O-'])
+
+    def test_normalize_city_uses_last_location_part(self):
+        self.assertEqual(normalize_city(' Anna Nagar, Chennai '), 'chennai')
+        self.assertEqual(normalize_city('CHENNAI'), 'chennai')
+        self.assertEqual(normalize_city(''), '')
+
+
+class MatchIndexTests(TestCase):
+
+    def test_updates_move_and_drop_entries(self):
+        index = MatchIndex()
+        index.update_donor(1, 'O-', 'Chennai')
+        index.update_donor(2, 'A+', 'Chennai')
+        self.assertEqual(index.donors_for_request('A+', 'chennai'), [2, 1])
+        self.assertEqual(index.donors_for_request('O-', 'Chennai'), [1])
+
+        index.update_donor(2, 'A+', 'Mumbai')
+        self.assertEqual(index.donors_for_request('A+', 'Chennai'), [1])
+        index.update_donor(1, 'O-', 'Chennai', is_available=False)
+        self.assertEqual(index.donors_for_request('A+', 'Chennai'), [])
+        self.assertEqual(len(index), 1)
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class MatchingQueryTests(TestCase):
+
+    def setUp(self):
+        reset_match_index()
+        self.addCleanup(reset_match_index)
+        self.requester = make_user('req@example.com', 'AB+', 'Chennai')
+
+    def test_donors_for_request(self):
+        o_neg = make_user('oneg@example.com', 'O-', 'Chennai')
+        make_user('bpos@example.com', 'B+', 'Chennai')
+        make_user('away@example.com', 'O-', 'Delhi')
+        blood_request = make_request(self.requester, 'REQ000010', 'A-')
+        self.assertEqual(list(compatible_donors(blood_request)), [o_neg])
+
+        o_neg.is_available = False
+        o_neg.save()
+        self.assertEqual(list(compatible_donors(blood_request)), [])
+
+    @override_settings(MATCH_INDEX_SYNC_SECONDS=0)
+    def test_sync_picks_up_donor_edits_from_other_processes(self):
+        donor = make_user('elsewhere@example.com', 'O-', 'Chennai', is_available=False)
+        blood_request = make_request(self.requester, 'REQ000030', 'A+')
+        self.assertEqual(list(compatible_donors(blood_request)), [])
+
+        # saved by another process, so no signal reaches this one's index
+        later = timezone.now() + timedelta(seconds=1)
+        User.objects.filter(pk=donor.pk).update(is_available=True, updated_at=later)
+        self.assertEqual(list(compatible_donors(blood_request)), [donor])
+        User.objects.filter(pk=donor.pk).update(city='Mumbai', updated_at=later + timedelta(seconds=1))
+        self.assertEqual(get_match_index().donors_for_request('A+', 'Chennai'), [])
+        self.assertEqual(get_match_index().donors_for_request('A+', 'Mumbai'), [donor.pk])
+
+    @override_settings(MATCH_INDEX_SYNC_SECONDS=0, MATCH_INDEX_SYNC_OVERLAP_SECONDS=60)
+    def test_sync_picks_up_rows_that_commit_late(self):
+        blood_request = make_request(self.requester, 'REQ000032', 'A+')
+        early = make_user('early@example.com', 'O-', 'Chennai', is_available=False)
+        late = make_user('late@example.com', 'O+', 'Chennai', is_available=False)
+        self.assertEqual(list(compatible_donors(blood_request)), [])
+
+        # saved 30 s ago by a transaction that committed after a newer save was synced
+        now = timezone.now()
+        User.objects.filter(pk=early.pk).update(is_available=True, updated_at=now)
+        self.assertEqual(list(compatible_donors(blood_request)), [early])
+        User.objects.filter(pk=late.pk).update(is_available=True, updated_at=now - timedelta(seconds=30))
+        self.assertEqual(list(compatible_donors(blood_request)), [late, early])
+
+    @override_settings(MATCH_INDEX_SYNC_SECONDS=None)
+    def test_lagging_index_entries_are_rechecked(self):
+        donor = make_user('moved@example.com', 'O-', 'Chennai')
+        blood_request = make_request(self.requester, 'REQ000031', 'A-')
+        self.assertEqual(list(compatible_donors(blood_request)), [donor])
+        self.assertEqual([d.pk for d in nearby_donors(blood_request)], [donor.pk])
+
+        # the index still has the donor as O- in Chennai
+        User.objects.filter(pk=donor.pk).update(blood_group='A+')
+        self.assertEqual(list(compatible_donors(blood_request)), [])
+        self.assertEqual(nearby_donors(blood_request), [])
+        User.objects.filter(pk=donor.pk).update(blood_group='O-', city='Delhi', latitude=28.61, longitude=77.21)
+        self.assertEqual(list(compatible_donors(blood_request)), [])
+        self.assertEqual(nearby_donors(blood_request), [])
+
+    def test_dashboard_lists_only_compatible_requests(self):
+        donor = make_user('dash@example.com', 'B-', 'Chennai')
+        make_request(self.requester, 'REQ000020', 'B+')
+        make_request(self.requester, 'REQ000021', 'A+')
+        self.client.force_login(donor)
+        response = self.client.get(reverse('donor_dashboard'))
+        self.assertEqual(
+            [r.request_id for r in response.context['blood_requests']], ['REQ000020']
+        )
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('pager@example.com')
+        base = timezone.now()
+        for i in range(7):
+            blood_request = make_request(
+                cls.user, f'REQ10000{i}', 'O+' if i % 2 else 'A+',
+                status='Pending' if i < 5 else 'Completed',
+            )
+            # pairs of rows share a timestamp so the id tie-breaker is exercised
+            BloodRequest.objects.filter(pk=blood_request.pk).update(created_at=base + timedelta(seconds=i // 2))
+
+    def ids(self, page):
+        return [r.request_id for r in page]
+
+    def test_walk_forward_and_back(self):
+        queryset = BloodRequest.objects.all()
+        first = paginate(queryset, page_size=3)
+        self.assertEqual(self.ids(first), ['REQ100006', 'REQ100005', 'REQ100004'])
+        self.assertFalse(first.has_previous)
+
+        second = paginate(queryset, first.next_cursor, page_size=3)
+        self.assertEqual(self.ids(second), ['REQ100003', 'REQ100002', 'REQ100001'])
+        third = paginate(queryset, second.next_cursor, page_size=3)
+        self.assertEqual(self.ids(third), ['REQ100000'])
+        self.assertFalse(third.has_next)
+
+        back = paginate(queryset, third.prev_cursor, page_size=3)
+        self.assertEqual(self.ids(back), self.ids(second))
+        back = paginate(queryset, back.prev_cursor, page_size=3)
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertFalse(back.has_previous)
+
+    def test_cursor_round_trip_and_bad_cursor(self):
+        now = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor('next', now, 12)), ('next', now, 12))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        page = paginate(BloodRequest.objects.all(), 'not-a-cursor', page_size=2)
+        self.assertEqual(self.ids(page), ['REQ100006', 'REQ100005'])
+
+    def test_page_size_limits(self):
+        self.assertEqual(get_page_size(None), 25)
+        self.assertEqual(get_page_size('0'), 1)
+        self.assertEqual(get_page_size('100000'), 100)
+
+    def test_view_filters(self):
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('blood_requests'), {'status': 'Pending', 'blood_group': 'O+', 'page_size': 1}
+        )
+        self.assertEqual(self.ids(response.context['blood_requests']), ['REQ100003'])
+        response = self.client.get(
+            reverse('blood_requests'),
+            {'status': 'Pending', 'blood_group': 'O+', 'page_size': 1,
+             'cursor': response.context['page'].next_cursor},
+        )
+        self.assertEqual(self.ids(response.context['blood_requests']), ['REQ100001'])
+        self.assertContains(response, 'Newer')
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class RequestStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user('stats@example.com')
+
+    def test_counters_follow_creates_status_changes_and_deletes(self):
+        first = make_request(self.user, 'REQ200001', 'A+', location='Chennai')
+        make_request(self.user, 'REQ200002', 'O-', location='Adyar, Chennai')
+        third = make_request(self.user, 'REQ200003', 'O-', location='Mumbai')
+
+        first.status = 'Completed'
+        first.save()
+        # a deferred load has no snapshot, so save looks the old values up
+        partial = BloodRequest.objects.only('pk').get(pk=third.pk)
+        partial.status = 'In Progress'
+        partial.save()
+
+        self.assertEqual(
+            dashboard_counts(),
+            {'total': 3, 'pending': 1, 'in_progress': 1, 'completed': 1, 'cancelled': 0},
+        )
+        self.assertEqual(breakdown('blood_group'), [('O-', 2), ('A+', 1)])
+        self.assertEqual(breakdown('city'), [('chennai', 2), ('mumbai', 1)])
+
+        first.delete()
+        self.assertEqual(dashboard_counts()['completed'], 0)
+        self.user.delete()
+        self.assertEqual(dashboard_counts()['total'], 0)
+
+    def test_city_counter_holds_a_full_length_location(self):
+        # no comma, so the whole location is the city key
+        location = ('Kanchipuram Government Hospital Road ' * 6)[:200]
+        make_request(self.user, 'REQ200004', location=location)
+        counter = RequestCounter.objects.get(scope='city', key=location.strip().casefold())
+        # max_length is enforced by strict MySQL, not SQLite
+        counter.full_clean()
+        self.assertEqual(counter.count, 1)
+
+    def test_admin_dashboard_reads_counters_in_one_query(self):
+        make_request(self.user, 'REQ200010')
+        admin = make_user('admin@example.com', is_staff=True)
+        self.client.force_login(admin)
+        # session, user, counters, page of requests
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['pending_requests'], 1)
+
+    def test_verify_and_rebuild_command(self):
+        make_request(self.user, 'REQ200020')
+        call_command('request_stats', '--verify', stdout=StringIO())
+
+        BloodRequest.objects.update(status='Cancelled')
+        with self.assertRaises(CommandError):
+            call_command('request_stats', '--verify', stdout=StringIO())
+        call_command('request_stats', '--rebuild', stdout=StringIO())
+        self.assertEqual(dashboard_counts()['cancelled'], 1)
+        self.assertFalse(RequestCounter.objects.filter(scope='status', key='Pending', count__gt=0).exists())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+@override_settings(STORAGES=PLAIN_STORAGES, MATCH_INDEX_SYNC_SECONDS=0)
+class QueryPlanTests(TestCase):
+    """Every query the hot views issue must be served by an index"""
+
+    # "SCAN t" reads the whole table; "SCAN t USING INDEX i" walks an index
+    # in order, which is only bounded when the query has a LIMIT
+    SCAN = re.compile(r'^SCAN (\w+)( USING (?:COVERING )?INDEX \w+)?$')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = make_user('plan@example.com', 'O-', 'Chennai')
+        cls.admin = make_user('plan-admin@example.com', is_staff=True)
+        for i in range(30):
+            make_request(cls.donor, f'REQ3000{i:02}', 'A+', status='Pending' if i % 3 else 'Completed')
+
+    def setUp(self):
+        reset_match_index()
+        self.addCleanup(reset_match_index)
+        # the one-off index load is a per-process bulk read, not a hot path
+        get_match_index()
+        # and the list cache would hide the queries under test
+        cache.clear()
+
+    def full_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    match = self.SCAN.match(row[3])
+                    if match and (not match.group(2) or ' LIMIT ' not in sql):
+                        scans.append((match.group(1), sql))
+        return scans
+
+    def assert_indexed(self, *urls):
+        for url in urls:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(self.full_scans(ctx.captured_queries), [], url)
+
+    def test_donor_views(self):
+        self.client.force_login(self.donor)
+        first = self.client.get(reverse('blood_requests'), {'page_size': 5})
+        cursor = first.context['page'].next_cursor
+        self.assert_indexed(
+            reverse('donor_dashboard'),
+            reverse('blood_requests'),
+            reverse('blood_requests') + '?status=Pending',
+            reverse('blood_requests') + f'?cursor={cursor}&page_size=5',
+            reverse('blood_requests') + f'?status=Pending&cursor={cursor}&page_size=5',
+        )
+
+    def test_admin_dashboard(self):
+        self.client.force_login(self.admin)
+        self.assert_indexed(reverse('admin_dashboard'), reverse('admin_dashboard') + '?status=Completed')
+
+    def test_triage_queue(self):
+        self.client.force_login(self.admin)
+        queries = ('', '?blood_group=A%2B', '?city=Chennai', '?city=Chennai&blood_group=A%2B')
+        urls = [reverse('triage') + query for query in queries]
+        self.assert_indexed(*urls)
+        # each query is one ordered range scan, not a sort of every pending request
+        for url in urls:
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url)
+            with connection.cursor() as cursor:
+                for query in ctx.captured_queries:
+                    if 'blood_requests' in query['sql'] and 'priority' in query['sql']:
+                        cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                        self.assertNotIn('TEMP B-TREE', str(cursor.fetchall()), url)
+
+    def test_donor_matching(self):
+        blood_request = BloodRequest.objects.filter(status='Pending').first()
+        with CaptureQueriesContext(connection) as ctx:
+            list(compatible_donors(blood_request))
+        self.assertEqual(self.full_scans(ctx.captured_queries), [])
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class AcceptRequestTests(TestCase):
+
+    def setUp(self):
+        self.requester = make_user('owner@example.com')
+        self.donor = make_user('taker@example.com', 'O-')
+        self.blood_request = make_request(self.requester, 'REQ400001')
+
+    def test_accept_only_from_pending(self):
+        self.assertEqual(actions.accept('REQ400001', self.donor)[0], actions.ACCEPTED)
+        other = make_user('late@example.com', 'O-')
+        self.assertEqual(actions.accept('REQ400001', other)[0], actions.ALREADY_TAKEN)
+
+        self.blood_request.refresh_from_db()
+        self.assertEqual(self.blood_request.assigned_to, self.donor)
+        self.assertEqual(self.blood_request.status, 'In Progress')
+        self.assertEqual(dashboard_counts()['in_progress'], 1)
+        self.assertEqual(dashboard_counts()['pending'], 0)
+
+        # a finished request is never reopened
+        BloodRequest.objects.filter(pk=self.blood_request.pk).update(status='Completed')
+        self.assertEqual(actions.accept('REQ400001', other)[0], actions.ALREADY_TAKEN)
+        self.assertEqual(BloodRequest.objects.get(pk=self.blood_request.pk).status, 'Completed')
+
+    def test_missing_requests(self):
+        self.assertEqual(actions.accept('REQ999999', self.donor)[0], actions.NOT_FOUND)
+
+    def test_view_reports_loser(self):
+        actions.accept('REQ400001', self.donor)
+        self.client.force_login(make_user('slow@example.com', 'O-'))
+        response = self.client.get(reverse('accept_request', args=['REQ400001']), follow=True)
+        self.assertIn('already been taken', str(list(response.context['messages'])[0]))
+
+
+class ConcurrentAcceptTests(TransactionTestCase):
+
+    def test_exactly_one_winner(self):
+        requester = make_user('race-owner@example.com')
+        donors = [make_user(f'racer{i}@example.com', 'O-') for i in range(8)]
+        make_request(requester, 'REQ500001')
+
+        results, _ = race_accept('REQ500001', donors)
+
+        outcomes = sorted(results.values())
+        self.assertEqual(outcomes, [actions.ACCEPTED] + [actions.ALREADY_TAKEN] * 7)
+        winner = next(pk for pk, result in results.items() if result == actions.ACCEPTED)
+        self.assertEqual(BloodRequest.objects.get(request_id='REQ500001').assigned_to_id, winner)
+        self.assertEqual(dashboard_counts()['in_progress'], 1)
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class RequestIdTests(TestCase):
+
+    def setUp(self):
+        # the in-memory block would outlive the rolled back test transaction
+        ids._request_numbers.reset()
+        self.addCleanup(ids._request_numbers.reset)
+
+    def test_ids_start_above_legacy_range_and_reserve_in_blocks(self):
+        first = ids.next_request_id()
+        self.assertEqual(first, 'REQ1000000')
+        with self.assertNumQueries(0):
+            rest = [ids.next_request_id() for _ in range(ids.DEFAULT_BLOCK_SIZE - 1)]
+        self.assertEqual(rest[-1], f'REQ{1000000 + ids.DEFAULT_BLOCK_SIZE - 1}')
+
+    def test_allocators_in_different_processes_never_overlap(self):
+        workers = [ids.BlockAllocator('request_id', block_size=7) for _ in range(3)]
+        issued = [worker() for _ in range(50) for worker in workers]
+        self.assertEqual(len(issued), len(set(issued)))
+
+    def test_one_million_ids_are_unique(self):
+        allocator = ids.BlockAllocator('million', block_size=50_000)
+        values = [f'{ids.REQUEST_ID_PREFIX}{allocator()}' for _ in range(1_000_000)]
+        self.assertEqual(len(set(values)), 1_000_000)
+        if connection.vendor == 'sqlite':
+            # and the database's own unique index agrees
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE TEMP TABLE generated_ids (request_id varchar(20) UNIQUE)')
+                cursor.executemany('INSERT INTO generated_ids VALUES (%s)', [(v,) for v in values])
+                cursor.execute('SELECT COUNT(*) FROM generated_ids')
+                self.assertEqual(cursor.fetchone()[0], 1_000_000)
+                cursor.execute('DROP TABLE generated_ids')
+
+    def test_request_blood_uses_sequence(self):
+        user = make_user('seq@example.com')
+        self.client.force_login(user)
+        for _ in range(2):
+            self.client.post(reverse('request_blood'), {
+                'blood_group': 'A+', 'units_required': 1, 'hospital_name': 'GH',
+                'location': 'Chennai', 'emergency_level': 'Low',
+            })
+        self.assertEqual(
+            sorted(BloodRequest.objects.values_list('request_id', flat=True)), ['REQ1000000', 'REQ1000001']
+        )
+
+
+class FeedHubTests(TestCase):
+
+    async def test_events_reach_only_compatible_donors_in_the_city(self):
+        hub = FeedHub(InProcessBroker())
+        o_neg = hub.subscribe('O-', 'Chennai')
+        a_pos = hub.subscribe('A+', 'Chennai')
+        elsewhere = hub.subscribe('O-', 'Delhi')
+
+        hub.publish({'type': 'created', 'id': 1, 'blood_group': 'B-', 'location': 'Guindy, Chennai'})
+        await asyncio.sleep(0)
+
+        self.assertEqual((await o_neg.get())['id'], 1)
+        self.assertTrue(a_pos.queue.empty())
+        self.assertTrue(elsewhere.queue.empty())
+
+        hub.unsubscribe(o_neg)
+        hub.unsubscribe(a_pos)
+        hub.unsubscribe(elsewhere)
+        self.assertEqual(len(hub), 0)
+
+    async def test_slow_consumer_keeps_newest_events(self):
+        hub = FeedHub(InProcessBroker(), queue_size=2)
+        sub = hub.subscribe('O-', 'Chennai')
+        for i in range(5):
+            hub.publish({'type': 'created', 'id': i, 'blood_group': 'A+', 'location': 'Chennai'})
+        await asyncio.sleep(0)
+        self.assertEqual([(await sub.get())['id'] for _ in range(2)], [3, 4])
+        self.assertEqual(sub.dropped, 3)
+
+
+class DatabaseBrokerTests(TestCase):
+
+    def test_ids_committed_out_of_order_are_not_skipped(self):
+        broker = DatabaseBroker()
+        received = []
+        # registered without the polling thread; the test polls by hand
+        InProcessBroker.subscribe(broker, CHANNEL, received.append)
+        broker.last_id = 0
+        FeedEvent.objects.create(id=2, channel=CHANNEL, message='second')
+        broker.poll()
+        self.assertEqual(list(broker.gaps), [1])
+        FeedEvent.objects.create(id=1, channel=CHANNEL, message='first')
+        broker.poll()
+        broker.poll()
+        self.assertEqual(received, ['second', 'first'])
+        self.assertEqual(broker.gaps, {})
+
+    def test_delivers_events_published_by_another_process(self):
+        # a subscriber and a publisher process, sharing nothing but a database
+        subscriber_script = (
+            'import asyncio, json, django; django.setup()\n'
+            'from core.feed import get_hub\n'
+            'async def main():\n'
+            '    sub = get_hub().subscribe("O-", "Chennai")\n'
+            '    while get_hub().broker.last_id is None:\n'
+            '        await asyncio.sleep(0.01)\n'
+            '    print("ready", flush=True)\n'
+            '    print(json.dumps(await asyncio.wait_for(sub.get(), 30)), flush=True)\n'
+            'asyncio.run(main())\n'
+        )
+        publisher_script = (
+            'import json, sys, django; django.setup()\n'
+            'from core.feed import get_hub\n'
+            'get_hub().publish(json.loads(sys.argv[1]))\n'
+        )
+        event = {'type': 'created', 'id': 7, 'blood_group': 'AB-', 'location': 'Chennai'}
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': 'Blood_Bridge.settings',
+                'DATABASE_URL': f'sqlite:///{tmp}/feed.sqlite3',
+            }
+            env.pop('MYSQLHOST', None)
+            options = {'cwd': settings.BASE_DIR, 'env': env, 'text': True}
+            subprocess.run(
+                [sys.executable, 'manage.py', 'migrate', '-v0'], check=True, timeout=120, **options,
+            )
+            with subprocess.Popen([sys.executable, '-c', subscriber_script], stdout=subprocess.PIPE, **options) as sub:
+                try:
+                    self.assertEqual(sub.stdout.readline().strip(), 'ready')
+                    subprocess.run(
+                        [sys.executable, '-c', publisher_script, json.dumps(event)],
+                        check=True, timeout=60, **options,
+                    )
+                    self.assertEqual(json.loads(sub.stdout.readline()), event)
+                finally:
+                    sub.kill()
+
+
+@override_settings(STORAGES=PLAIN_STORAGES, REQUEST_FEED_BROKER='core.feed.InProcessBroker')
+class RequestFeedViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = make_user('feed@example.com', 'O-', 'Chennai')
+        cls.blood_request = make_request(cls.donor, 'REQ600001', 'AB-')
+
+    def setUp(self):
+        reset_hub()
+        self.addCleanup(reset_hub)
+
+    def test_wsgi_requests_are_told_not_to_reconnect(self):
+        self.client.force_login(self.donor)
+        self.assertEqual(self.client.get(reverse('request_feed')).status_code, 204)
+
+    async def test_stream_delivers_published_requests(self):
+        await self.async_client.aforce_login(self.donor)
+        response = await self.async_client.get(reverse('request_feed'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+
+        self.assertEqual(len(get_hub()), 1)
+        publish_request(self.blood_request, 'created')
+        chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+        self.assertTrue(chunk.startswith('event: created\n'))
+        data = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual(data['request_id'], 'REQ600001')
+        await stream.aclose()
+
+
+class JsonApiTests(TestCase):
+
+    def setUp(self):
+        self.owner = make_user('api-owner@example.com')
+        self.donor = make_user('api-donor@example.com', 'O-')
+        self.client.force_login(self.donor)
+
+    def post(self, name, data, *args):
+        return self.client.post(reverse(name, args=args), json.dumps(data), content_type='application/json')
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_requests')).status_code, 401)
+
+    def test_create_and_list(self):
+        response = self.post('api_requests', {
+            'blood_group': 'B+', 'units_required': 3, 'hospital_name': 'KMC',
+            'location': 'Chennai', 'emergency_level': 'Critical',
+        })
+        self.assertEqual(response.status_code, 201)
+        request_id = response.json()['request_id']
+
+        response = self.post('api_requests', {'blood_group': 'C', 'units_required': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            set(response.json()['errors']),
+            {'blood_group', 'units_required', 'hospital_name', 'location', 'emergency_level'},
+        )
+
+        make_request(self.owner, 'REQ700001', 'A+')
+        with self.assertNumQueries(3):  # session, user, one page of values()
+            response = self.client.get(reverse('api_requests'), {'page_size': 1})
+        body = response.json()
+        self.assertEqual([r['request_id'] for r in body['results']], ['REQ700001'])
+        response = self.client.get(reverse('api_requests'), {'page_size': 1, 'cursor': body['next']})
+        self.assertEqual([r['request_id'] for r in response.json()['results']], [request_id])
+
+    def test_accept_single_and_batch(self):
+        for i in range(3):
+            make_request(self.owner, f'REQ70001{i}')
+
+        response = self.post('api_accept_request', {}, 'REQ700010')
+        self.assertEqual(response.json(), {'request_id': 'REQ700010', 'result': 'accepted'})
+        self.assertEqual(self.post('api_accept_request', {}, 'REQ700010').status_code, 409)
+
+        response = self.post('api_accept_requests', {
+            'request_ids': ['REQ700010', 'REQ700011', 'REQ700012', 'NOPE'],
+        })
+        self.assertEqual(response.json()['results'], {
+            'REQ700011': 'accepted', 'REQ700012': 'accepted', 'REQ700010': 'already_taken', 'NOPE': 'not_found',
+        })
+        self.assertEqual(dashboard_counts()['in_progress'], 3)
+
+    def test_cancel_batch(self):
+        make_request(self.donor, 'REQ700030')
+        make_request(self.owner, 'REQ700031')
+        response = self.post('api_cancel_requests', {'request_ids': ['REQ700030', 'REQ700031']})
+        self.assertEqual(response.json()['results'], {'REQ700030': 'cancelled', 'REQ700031': 'not_allowed'})
+        self.assertEqual(dashboard_counts()['cancelled'], 1)
+
+    def test_batch_limits(self):
+        with self.settings(API_BATCH_LIMIT=2):
+            response = self.post('api_accept_requests', {'request_ids': ['a', 'b', 'c']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post('api_accept_requests', {'request_ids': 'REQ1'}).status_code, 400)
+
+    def test_availability(self):
+        response = self.post('api_update_availability', {'available': False})
+        self.assertEqual(response.json(), {'available': False})
+        self.donor.refresh_from_db()
+        self.assertFalse(self.donor.is_available)
+
+        self.assertEqual(self.post('api_bulk_availability', {'updates': []}).status_code, 403)
+        self.client.force_login(make_user('api-admin@example.com', is_staff=True))
+        response = self.post('api_bulk_availability', {'updates': [
+            {'id': self.donor.pk, 'available': True}, {'id': self.owner.pk, 'available': False},
+        ]})
+        self.assertEqual(response.json(), {'updated': 2})
+        self.assertEqual(
+            dict(User.objects.filter(pk__in=[self.donor.pk, self.owner.pk]).values_list('pk', 'is_available')),
+            {self.donor.pk: True, self.owner.pk: False},
+        )
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class RequestCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        reset_match_index()
+        self.addCleanup(reset_match_index)
+        self.owner = make_user('cache-owner@example.com', 'AB+', 'Chennai')
+        self.donor = make_user('cache-donor@example.com', 'O-', 'Chennai')
+        self.client.force_login(self.donor)
+
+    def dashboard_ids(self):
+        response = self.client.get(reverse('donor_dashboard'))
+        return [r.request_id for r in response.context['blood_requests']]
+
+    def test_dashboard_hits_until_a_relevant_request_changes(self):
+        make_request(self.owner, 'REQ800001', 'B+')
+        self.assertEqual(self.dashboard_ids(), ['REQ800001'])
+        self.assertEqual(self.dashboard_ids(), ['REQ800001'])
+        self.assertEqual((cache_stats()['hits'], cache_stats()['misses']), (1, 1))
+
+        # another city: this donor's entry stays valid
+        make_request(self.owner, 'REQ800002', 'B+', location='Mumbai')
+        self.dashboard_ids()
+        self.assertEqual(cache_stats()['hits'], 2)
+
+        make_request(self.owner, 'REQ800003', 'A-', location='Velachery, Chennai')
+        self.assertEqual(self.dashboard_ids(), ['REQ800003', 'REQ800001'])
+        actions.accept('REQ800001', self.donor)
+        self.assertEqual(self.dashboard_ids(), ['REQ800003'])
+        self.assertEqual(cache_stats()['misses'], 3)
+
+    def test_listing_pages_are_cached_per_filter_and_status(self):
+        make_request(self.owner, 'REQ800010', 'B+')
+        completed = make_request(self.owner, 'REQ800011', 'B+', status='Completed')
+        url = reverse('blood_requests')
+        self.client.get(url, {'status': 'Pending'})
+        with self.assertNumQueries(2):  # session and user only
+            self.client.get(url, {'status': 'Pending'})
+
+        # a change confined to Completed rows leaves the Pending listing cached
+        completed.units_required = 5
+        completed.save()
+        with self.assertNumQueries(2):
+            self.client.get(url, {'status': 'Pending'})
+
+        completed.status = 'Pending'
+        completed.save()
+        response = self.client.get(url, {'status': 'Pending'})
+        self.assertEqual(
+            [r.request_id for r in response.context['blood_requests']], ['REQ800011', 'REQ800010']
+        )
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('api_cache_stats')).status_code, 403)
+        self.client.force_login(make_user('cache-admin@example.com', is_staff=True))
+        self.assertIn('hit_ratio', self.client.get(reverse('api_cache_stats')).json())
+
+    def test_check_warns_about_a_per_worker_cache(self):
+        self.addCleanup(os.environ.__setitem__, 'WEB_CONCURRENCY', os.environ.get('WEB_CONCURRENCY', ''))
+        os.environ['WEB_CONCURRENCY'] = '1'
+        self.assertEqual(checks.request_cache_is_shared(None), [])
+        os.environ['WEB_CONCURRENCY'] = '4'
+        self.assertEqual([w.id for w in checks.request_cache_is_shared(None)], ['core.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.request_cache_is_shared(None), [])
+
+
+class CsvImportTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        make_user('taken@example.com')
+
+    def write(self, name, text):
+        path = Path(self.tmp.name) / name
+        path.write_text(text)
+        return str(path)
+
+    def run_import(self, kind, text, *args):
+        out = StringIO()
+        call_command('import_csv', kind, self.write(f'{kind}.csv', text), *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_donors_are_validated_and_deduplicated(self):
+        rejects = str(Path(self.tmp.name) / 'rejects.csv')
+        out = self.run_import('donors', (
+            'full_name,email,blood_group,city,is_available\n'
+            'Asha,asha@example.com,O-,Chennai,yes\n'
+            'Ravi,ravi@example.com,B+,Mumbai,no\n'
+            'Dup,ASHA@example.com,O-,Chennai,\n'
+            'Old,taken@example.com,A+,Chennai,\n'
+            'Bad,bad@example.com,Z+,Chennai,\n'
+            'Nomail,,A+,Chennai,\n'
+        ), '--batch-size', '2', '--rejects', rejects)
+
+        self.assertIn('Imported 2 donors, rejected 4', out)
+        self.assertFalse(User.objects.get(username='ravi@example.com').is_available)
+        self.assertFalse(User.objects.get(username='asha@example.com').has_usable_password())
+        lines = Path(rejects).read_text().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['4', '5', '6', '7'])
+        self.assertIn('already registered', lines[1])
+
+    def test_requests_get_sequence_ids_and_counters(self):
+        out = self.run_import('requests', (
+            'blood_group,units_required,hospital_name,location,emergency_level,requested_by\n'
+            'A+,2,Apollo,Chennai,High,taken@example.com\n'
+            'O-,1,Fortis,Mumbai,Critical,TAKEN@example.com\n'
+            'O-,0,Fortis,Mumbai,Critical,taken@example.com\n'
+            'O-,1,Fortis,Mumbai,Critical,nobody@example.com\n'
+        ))
+
+        self.assertIn('Imported 2 requests, rejected 2', out)
+        self.assertTrue(all(
+            request_id.startswith('REQ') and int(request_id[3:]) >= ids.SEQUENCE_START
+            for request_id in BloodRequest.objects.values_list('request_id', flat=True)
+        ))
+        self.assertEqual(dashboard_counts()['pending'], 2)
+        call_command('request_stats', '--verify', stdout=StringIO())
+
+    def test_missing_columns(self):
+        with self.assertRaisesMessage(CommandError, 'Missing columns: city'):
+            self.run_import('donors', 'full_name,email,blood_group\n')
+
+
+@override_settings(STORAGES=PLAIN_STORAGES, EXPORT_CHUNK_SIZE=2)
+class RequestExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_user('admin@example.com', is_staff=True)
+        donor = make_user('donor@example.com')
+        for n in range(5):
+            make_request(cls.admin, f'REQ40000{n}', status='Completed' if n % 2 else 'Pending',
+                         assigned_to=donor if n % 2 else None)
+        old = make_request(cls.admin, 'REQ400009')
+        BloodRequest.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def download(self, fmt, **params):
+        response = self.client.get(reverse('export_requests', args=[fmt]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_joins_names_in_bounded_batches(self):
+        # session and user, one query for the two matching rows, one that finds no more
+        with self.assertNumQueries(4):
+            lines = self.download('csv', status='Completed').splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['request_id', 'blood_group'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['REQ400001', 'REQ400003'])
+        self.assertIn('donor,donor@example.com', lines[1])
+
+    def test_ndjson_and_date_filter(self):
+        today = timezone.localdate().isoformat()
+        rows = [json.loads(line) for line in self.download('ndjson', **{'from': today}).splitlines()]
+        self.assertEqual([row['request_id'] for row in rows], [f'REQ40000{n}' for n in range(5)])
+        self.assertEqual(rows[0]['requested_by'], 'admin')
+        self.assertIsNone(rows[0]['assigned_to'])
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    async def test_asgi_streams_batches_without_buffering(self):
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(reverse('export_requests', args=['csv']))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        # header and six rows, two lines a chunk
+        self.assertEqual(len(chunks), 4)
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'request_id')
+        self.assertEqual([line.split(',')[0] for line in lines[1:]],
+                         [f'REQ40000{n}' for n in range(5)] + ['REQ400009'])
+
+    def test_bad_input_and_access(self):
+        url = reverse('export_requests', args=['csv'])
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_requests', args=['xml'])).status_code, 400)
+        self.client.force_login(make_user('someone@example.com'))
+        self.assertRedirects(self.client.get(url), reverse('donor_dashboard'), fetch_redirect_response=False)
+
+
+class GeoTests(TestCase):
+
+    def test_gazetteer_and_distance(self):
+        self.assertEqual(geocode('Adyar, Chennai'), geocode('adyar'))
+        self.assertEqual(geocode('Some Hospital Road, Madras'), geocode('Chennai'))
+        self.assertIsNone(geocode('Atlantis'))
+        # Chennai to Bengaluru is about 290 km as the crow flies
+        self.assertAlmostEqual(haversine_km(*geocode('Chennai'), *geocode('Bengaluru')), 290, delta=10)
+
+    def test_grid_matches_a_scan(self):
+        grid = GeoGrid(cell_km=2)
+        lat0, lon0 = geocode('Chennai')
+        points = {pk: (lat0 + (pk % 13 - 6) * 0.02, lon0 + (pk // 13 - 6) * 0.02) for pk in range(169)}
+        for pk, (lat, lon) in points.items():
+            grid.put(pk, lat, lon, mask=1 if pk % 2 else 2)
+        grid.remove(0)
+        del points[0]
+        grid.put(1, lat0, lon0, mask=1)
+        points[1] = (lat0, lon0)
+
+        distances = ((haversine_km(lat0, lon0, *point), pk) for pk, point in points.items() if pk % 2)
+        expected = sorted(pair for pair in distances if pair[0] <= 5)
+        self.assertEqual(grid.within(lat0, lon0, 5, bit=1), expected)
+        self.assertEqual(grid.within(lat0, lon0, 5, bit=1, limit=3), expected[:3])
+        self.assertEqual(grid.within(lat0, lon0, 5, bit=1)[0], (0.0, 1))
+
+    def test_donors_at_one_place_come_newest_first(self):
+        grid = GeoGrid()
+        adyar, tambaram = geocode('Adyar'), geocode('Tambaram')
+        for pk in range(1, 7):
+            grid.put(pk, *(adyar if pk <= 4 else tambaram), mask=1 if pk % 2 else 2)
+        # unchanged, so it keeps its turn; a new mask counts as added again
+        grid.put(1, *adyar, mask=1)
+        grid.put(3, *adyar, mask=2)
+        self.assertEqual(grid.place_count, 2)
+        self.assertEqual([pk for _, pk in grid.within(*adyar, 30)], [3, 4, 2, 1, 6, 5])
+        apart = haversine_km(*adyar, *tambaram)
+        self.assertEqual(grid.within(*adyar, 30, bit=1, limit=2), [(0.0, 1), (apart, 5)])
+
+        grid.remove(5)
+        grid.remove(6)
+        self.assertEqual(grid.place_count, 1)
+        self.assertEqual(grid.within(*tambaram, 1), [])
+
+
+@override_settings(MATCH_INDEX_SYNC_SECONDS=None)
+class NearbyDonorTests(TestCase):
+
+    def setUp(self):
+        reset_match_index()
+        self.requester = make_user('hospital@example.com', blood_group='A+', city='Chennai')
+        self.near = make_user('tambaram@example.com', blood_group='O-', city='Tambaram')
+        self.nearest = make_user('adyar@example.com', blood_group='A-', city='Adyar, Chennai')
+        self.far = make_user('mysuru@example.com', blood_group='O-', city='Mysuru')
+        make_user('incompatible@example.com', blood_group='B+', city='Chennai')
+        self.blood_request = make_request(self.requester, 'REQ500001', 'A+', location='Apollo, Anna Nagar, Chennai')
+
+    def test_coordinates_are_filled_and_follow_changes(self):
+        self.assertEqual((self.near.latitude, self.near.longitude), geocode('Tambaram'))
+        self.assertEqual(
+            (self.blood_request.latitude, self.blood_request.longitude), geocode('Anna Nagar')
+        )
+        self.blood_request.location = 'Mumbai'
+        self.blood_request.save()
+        self.assertEqual(self.blood_request.latitude, geocode('Mumbai')[0])
+
+    def test_nearest_first_within_radius(self):
+        donors = nearby_donors(self.blood_request, radius_km=30)
+        self.assertEqual(donors, [self.nearest, self.near])
+        self.assertLess(donors[0].distance_km, donors[1].distance_km)
+        self.assertEqual(nearby_donors(self.blood_request, radius_km=30, limit=1), [self.nearest])
+
+        self.near.is_available = False
+        self.near.save()
+        self.assertEqual(nearby_donors(self.blood_request, radius_km=30), [self.nearest])
+
+    def test_limit_is_asked_of_the_index_and_refilled(self):
+        extra = [make_user(f'adyar{n}@example.com', blood_group='O-', city='Adyar') for n in range(3)]
+        self.assertEqual(len(nearby_donors(self.blood_request, radius_km=30)), 5)
+        # the newest two leave without the index hearing of it
+        User.objects.filter(pk__in=[donor.pk for donor in extra[1:]]).update(is_available=False)
+        # the requester (at the Chennai centroid) and the two leavers come first,
+        # so the index is asked for two donors, then four, then eight
+        with self.assertNumQueries(3):
+            donors = nearby_donors(self.blood_request, radius_km=30, limit=2)
+        self.assertEqual(donors, [extra[0], self.nearest])
+
+    def test_api(self):
+        url = reverse('api_request_donors', args=['REQ500001'])
+        self.client.force_login(self.near)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.requester)
+        data = self.client.get(url, {'radius_km': 30}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.nearest.pk, self.near.pk])
+        self.assertEqual(self.client.get(url, {'radius_km': 'far'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'radius_km': 5000}).status_code, 400)
+
+
+class RecordingSender:
+
+    def __init__(self, fail_for=()):
+        self.fail_for = set(fail_for)
+        self.sent = []
+
+    def send(self, message):
+        if message['donor_id'] in self.fail_for:
+            self.fail_for.discard(message['donor_id'])
+            raise ConnectionError('gateway timeout')
+        self.sent.append(message['donor_id'])
+
+
+@override_settings(MATCH_INDEX_SYNC_SECONDS=None, NOTIFICATION_BATCH_SIZE=2)
+class NotificationTests(TestCase):
+
+    def setUp(self):
+        reset_match_index()
+        self.requester = make_user('ward@example.com', blood_group='B+')
+        self.donors = [
+            make_user('one@example.com', blood_group='O-'),
+            # a neighbouring municipality, found by distance rather than by city
+            make_user('two@example.com', blood_group='O+', city='Avadi'),
+            make_user('three@example.com', blood_group='B-', city='Anna Nagar, Chennai'),
+        ]
+        make_user('away@example.com', blood_group='O-', city='Mumbai')
+        make_user('resting@example.com', blood_group='O-', is_available=False)
+        make_user('wrong@example.com', blood_group='A+')
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+
+    def worker(self, sender):
+        return NotificationWorker('test-worker', self.pool, sender=sender)
+
+    def test_only_critical_requests_are_queued(self):
+        make_request(self.requester, 'REQ600001', 'B+', emergency_level='High')
+        critical = make_request(self.requester, 'REQ600002', 'B+', emergency_level='Critical')
+        self.assertEqual(list(NotificationJob.objects.values_list('blood_request', flat=True)), [critical.pk])
+
+    def test_fan_out_sends_once_per_donor(self):
+        make_request(self.requester, 'REQ600010', 'B+', emergency_level='Critical')
+        sender = RecordingSender()
+        self.assertEqual(self.worker(sender).run_once(), 1)
+        self.assertEqual(sorted(sender.sent), [donor.pk for donor in self.donors])
+        job = NotificationJob.objects.get()
+        self.assertEqual((job.status, job.sent, job.attempts), ('done', 3, 1))
+
+        # running the job again tells nobody twice
+        NotificationJob.objects.update(status='queued')
+        sender.sent.clear()
+        self.worker(sender).run_once()
+        self.assertEqual(sender.sent, [])
+
+    def test_failed_sends_are_retried_with_backoff(self):
+        make_request(self.requester, 'REQ600020', 'B+', emergency_level='Critical')
+        flaky = self.donors[1]
+        sender = RecordingSender(fail_for=[flaky.pk])
+        self.worker(sender).run_once()
+
+        job = NotificationJob.objects.get()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('gateway timeout', job.last_error)
+        self.assertEqual(self.worker(sender).run_once(), 0)
+
+        NotificationJob.objects.update(run_after=timezone.now())
+        sender.sent.clear()
+        self.worker(sender).run_once()
+        self.assertEqual(sender.sent, [flaky.pk])
+        self.assertEqual(NotificationJob.objects.get().status, 'done')
+        self.assertEqual(Notification.objects.get(donor=flaky).attempts, 2)
+        self.assertFalse(Notification.objects.exclude(status='sent').exists())
+
+    def test_worker_command_writes_outbox(self):
+        make_request(self.requester, 'REQ600030', 'B+', emergency_level='Critical')
+        with tempfile.TemporaryDirectory() as tmp:
+            outbox = Path(tmp) / 'outbox.jsonl'
+            with self.settings(NOTIFICATION_SENDER='core.notifications.FileSender', NOTIFICATION_OUTBOX=str(outbox)):
+                out = StringIO()
+                call_command('notification_worker', '--once', '--threads', '2', stdout=out)
+            messages = [json.loads(line) for line in outbox.read_text().splitlines()]
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(all(message['request_id'] == 'REQ600030' for message in messages))
+        self.assertIn('1 jobs done', out.getvalue())
+
+
+class BenchmarkToolTests(TestCase):
+
+    def seed(self):
+        call_command('seed_data', '--users', '40', '--requests', '300', '--batch-size', '64', stdout=StringIO())
+        return list(BloodRequest.objects.order_by('pk').values_list(
+            'blood_group', 'location', 'status', 'emergency_level', 'created_at',
+        ))
+
+    def test_seed_is_reproducible_and_counted(self):
+        first = self.seed()
+        self.assertEqual(len(first), 300)
+        self.assertEqual(User.objects.count(), 40)
+        call_command('request_stats', '--verify', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'already seeded'):
+            self.seed()
+
+        User.objects.all().delete()
+        self.assertEqual(self.seed(), first)
+        # realistic, not uniform: old requests are mostly closed
+        statuses = [status for _, _, status, _, _ in first]
+        self.assertGreater(statuses.count('Completed'), statuses.count('Pending'))
+
+    def test_bench_views_writes_json(self):
+        self.seed()
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / 'bench.json'
+            call_command(
+                'bench_views', '--iterations', '3', '--warmup', '1', '--memory-iterations', '1',
+                '--only', 'donor_dashboard', 'request_blood', '--output', str(output), stdout=StringIO(),
+            )
+            report = json.loads(output.read_text())
+        self.assertEqual(report['meta']['requests'], 300)
+        dashboard = report['scenarios']['donor_dashboard']
+        self.assertEqual(dashboard['status_codes'], [200])
+        self.assertLessEqual(dashboard['p50_ms'], dashboard['p99_ms'])
+        self.assertGreater(dashboard['peak_memory_kib'], 0)
+        # the benchmarked POST is rolled back
+        self.assertEqual(report['scenarios']['request_blood']['status_codes'], [302])
+        self.assertEqual(BloodRequest.objects.count(), 300)
+
+    def test_bench_refresh_compares_encodings_and_revalidation(self):
+        self.seed()
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / 'refresh.json'
+            call_command('bench_refresh', '--iterations', '2', '--warmup', '1', '--output', str(output),
+                         stdout=StringIO())
+            report = json.loads(output.read_text())
+        listing = report['blood_requests']
+        self.assertEqual(listing['revalidate']['status_codes'], [304])
+        self.assertEqual(listing['revalidate']['bytes'], 0)
+        self.assertLess(listing['gzip']['bytes'], listing['identity']['bytes'])
+
+
+@override_settings(STORAGES=PLAIN_STORAGES, METRICS_TOKEN='scrape-secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        reset_metrics()
+        self.donor = make_user('metrics@example.com')
+        self.client.force_login(self.donor)
+
+    def test_views_are_recorded_by_url_name(self):
+        self.client.get(reverse('donor_dashboard'))
+        self.client.get(reverse('donor_dashboard'))
+        self.client.get('/no-such-page/')
+        text = render_metrics()
+
+        self.assertIn('blood_bridge_request_duration_seconds_bucket{view="donor_dashboard",le="+Inf"} 2', text)
+        self.assertIn('blood_bridge_responses_total{view="donor_dashboard",status="2xx"} 2', text)
+        self.assertIn('blood_bridge_responses_total{view="<unmatched>",status="4xx"} 1', text)
+        self.assertIn('# TYPE blood_bridge_db_queries histogram', text)
+        queries = re.search(r'blood_bridge_db_queries_sum\{view="donor_dashboard"\} (\d+)', text)
+        self.assertGreater(int(queries.group(1)), 0)
+        template = re.search(r'blood_bridge_template_seconds_total\{view="donor_dashboard"\} ([\d.e-]+)', text)
+        self.assertGreater(float(template.group(1)), 0)
+
+    def test_endpoint_is_staff_or_token_only(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        self.client.force_login(make_user('ops@example.com', is_staff=True))
+        self.assertIn(b'blood_bridge_request_duration_seconds', self.client.get(url).content)
+
+    def test_slow_query_log_samples_stacks(self):
+        with self.settings(METRICS_SLOW_QUERY_MS=0), self.assertLogs('core.metrics.slow', 'WARNING'):
+            self.client.get(reverse('blood_requests'))
+        entries = slow_queries()
+        self.assertTrue(entries)
+        self.assertTrue(any('core/views.py' in line for entry in entries for line in entry['stack']))
+        self.assertIn('blood_bridge_slow_queries_total{view="blood_requests"} ' + str(len(entries)), render_metrics())
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.requester = make_user('etag-req@example.com', 'AB+')
+        self.donor = make_user('etag@example.com', 'O-')
+        make_request(self.requester, 'REQ800001')
+        self.client.force_login(self.donor)
+
+    def test_unchanged_pages_answer_304_without_rendering(self):
+        url = reverse('donor_dashboard')
+        first = self.client.get(url)
+        etag = first['ETag']
+        self.assertIn('private', first['Cache-Control'])
+        self.assertIn('no-cache', first['Cache-Control'])
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.templates, [])
+        self.assertEqual(again['ETag'], etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        # a new request, a removed one and the viewer's own profile all change the page
+        newer = make_request(self.requester, 'REQ800002')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        newer.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        self.donor.is_available = False
+        self.donor.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_listing_and_admin_pages(self):
+        listing = reverse('blood_requests')
+        etag = self.client.get(listing)['ETag']
+        self.assertEqual(self.client.get(listing, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # other filters are other pages
+        self.assertEqual(self.client.get(listing, {'status': 'Pending'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # a pending flash message is always rendered, and the page gets no validators
+        self.client.get(reverse('accept_request', args=['REQ800001']))
+        response = self.client.get(listing, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'You have accepted request REQ800001')
+        self.assertNotIn('ETag', response)
+
+        self.client.force_login(make_user('etag-admin@example.com', is_staff=True))
+        admin = reverse('admin_dashboard')
+        etag = self.client.get(admin)['ETag']
+        self.assertEqual(self.client.get(admin, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_dynamic_responses_are_compressed(self):
+        url = reverse('blood_requests')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        # the weakened ETag still validates
+        revalidated = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertNotIn('Content-Encoding', self.client.get(url))
+
+        if compression.brotli is not None:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertIn(b'Blood Requests', compression.brotli.decompress(response.content))
+
+    @skipUnless(compression.brotli is not None, 'brotli is not installed')
+    def test_brotli_length_is_padded(self):
+        page = self.client.get(reverse('blood_requests')).content
+        bodies = [compression.compress_brotli(page, 5, max_random_bytes=100) for _ in range(10)]
+        self.assertGreater(len({len(body) for body in bodies}), 1)
+        self.assertEqual({compression.brotli.decompress(body) for body in bodies}, {page})
+
+    def test_templates_use_the_cached_loader(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIsInstance(loader, CachedLoader)
+
+
+class AsgiRouterTests(TestCase):
+
+    def route_to_recorders(self):
+        served = []
+
+        def recorder(name):
+            async def app(scope, receive, send):
+                served.append((name, scope.get('path')))
+            return app
+
+        for name in ('wsgi', 'django_asgi'):
+            self.addCleanup(setattr, asgi, name, getattr(asgi, name))
+            setattr(asgi, name, recorder(name))
+        return served
+
+    async def test_only_the_feed_runs_on_the_event_loop(self):
+        served = self.route_to_recorders()
+        await asgi.application({'type': 'http', 'path': reverse('request_feed')}, None, None)
+        await asgi.application({'type': 'http', 'path': reverse('donor_dashboard')}, None, None)
+        await asgi.application({'type': 'lifespan'}, None, None)
+        self.assertEqual(served, [
+            ('django_asgi', reverse('request_feed')), ('wsgi', reverse('donor_dashboard')), ('django_asgi', None),
+        ])
+
+    def test_wsgi_responses_are_closed(self):
+        finished = []
+        receiver = lambda **kwargs: finished.append(True)
+        request_finished.connect(receiver)
+        self.addCleanup(request_finished.disconnect, receiver)
+
+        environ = RequestFactory().get('/no-such-page/').environ
+        body = b''.join(asgi._closing(environ, lambda status, headers: None))
+        self.assertTrue(body)
+        self.assertEqual(finished, [True])
+
+    async def test_static_middleware_stays_on_the_event_loop(self):
+        async def get_response(request):
+            return HttpResponse('page')
+
+        middleware = StaticFilesMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get(reverse('home')))
+        self.assertEqual(response.content, b'page')
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class SearchTests(TestCase):
+
+    def setUp(self):
+        reset_vocabularies()
+        self.donor = make_user('priya.raman@example.com', city='Chennai')
+        self.apollo = make_request(self.donor, 'REQ500001', location='Greams Road, Chennai')
+        self.fortis = make_request(self.donor, 'REQ500002', location='Mulund, Mumbai', hospital_name='Fortis Hospital')
+        self.apollo_mumbai = make_request(self.donor, 'REQ500003', location='Navi Mumbai')
+        self.client.force_login(self.donor)
+
+    def postings(self, blood_request):
+        return set(SearchToken.objects.filter(kind='request', object_id=blood_request.pk).values_list('token', flat=True))
+
+    def test_prefixes_typos_and_ranking(self):
+        self.assertEqual(search('request', 'apollo'), [self.apollo_mumbai, self.apollo])
+        self.assertEqual(search('request', 'APOL'), [self.apollo_mumbai, self.apollo])
+        self.assertEqual(search('request', 'apolo chenai'), [self.apollo])
+        self.assertEqual(search('request', 'fortis mumbai'), [self.fortis])
+        self.assertEqual(search('request', 'hospital mumbai', limit=1), [self.apollo_mumbai])
+        self.assertEqual(search('request', 'xyzzy'), [])
+        # an exact word beats a prefix, which beats a typo
+        scores = [r.search_score for r in search('request', 'mumbai')]
+        self.assertEqual(scores, [2.0, 2.0])
+        self.assertGreater(search('request', 'mumba')[0].search_score, search('request', 'mumbia')[0].search_score)
+        self.assertEqual(search('donor', 'priya chen'), [self.donor])
+
+    @override_settings(SEARCH_CANDIDATES=2)
+    def test_filters_apply_before_the_candidate_window(self):
+        self.apollo.status = 'Completed'
+        self.apollo.save()
+        make_request(self.donor, 'REQ500004', location='Chennai')
+        make_request(self.donor, 'REQ500005', location='Chennai')
+        # the two newest Chennai requests are pending, the completed one is older
+        completed = BloodRequest.objects.filter(status='Completed')
+        self.assertEqual(search('request', 'chennai', queryset=completed), [self.apollo])
+        self.assertEqual(search('request', 'apollo chennai', queryset=completed), [self.apollo])
+        self.assertEqual(search('request', '500001', queryset=completed), [self.apollo])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(self.postings(self.apollo), {'apollo', 'hospital', 'greams', 'road', 'chennai'})
+        self.apollo.hospital_name = 'Kauvery Hospital'
+        self.apollo.save()
+        self.assertNotIn('apollo', self.postings(self.apollo))
+        self.assertEqual(search('request', 'kauvery'), [self.apollo])
+        self.assertEqual(SearchWord.objects.get(kind='request', token='apollo').documents, 1)
+
+        self.apollo_mumbai.delete()
+        self.assertEqual(search('request', 'apollo'), [])
+        self.assertEqual(SearchWord.objects.get(kind='request', token='apollo').documents, 0)
+
+        # a save that leaves the indexed fields alone does not touch the index
+        with CaptureQueriesContext(connection) as captured:
+            self.donor.save(update_fields=['is_available'])
+        self.assertFalse([q for q in captured if 'search_' in q['sql']])
+
+        indexed = set(SearchToken.objects.values_list('kind', 'token', 'object_id', 'weight'))
+        words = set(SearchWord.objects.filter(documents__gt=0).values_list('kind', 'token', 'documents'))
+        for kind in ('request', 'donor'):
+            rebuild(kind)
+        self.assertEqual(set(SearchToken.objects.values_list('kind', 'token', 'object_id', 'weight')), indexed)
+        self.assertEqual(set(SearchWord.objects.values_list('kind', 'token', 'documents')), words)
+
+    def test_request_ids_views_and_api(self):
+        self.assertEqual(search('request', 'REQ500002')[0], self.fortis)
+        self.assertEqual(search('request', 'req50000'), [self.apollo_mumbai, self.fortis, self.apollo])
+        self.assertEqual(search('request', '500001 apollo')[0], self.apollo)
+
+        response = self.client.get(reverse('blood_requests'), {'q': 'fortis'})
+        self.assertEqual(list(response.context['blood_requests']), [self.fortis])
+        response = self.client.get(reverse('blood_requests'), {'q': 'apollo', 'status': 'Completed'})
+        self.assertContains(response, 'No blood requests match')
+
+        data = self.client.get(reverse('api_search'), {'q': 'apolo mumbai'}).json()
+        self.assertEqual([row['request_id'] for row in data['results']], ['REQ500003'])
+        self.assertEqual(self.client.get(reverse('api_search')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_search'), {'q': 'priya', 'kind': 'donors'}).status_code, 403)
+        self.client.force_login(make_user('staff@example.com', is_staff=True))
+        data = self.client.get(reverse('api_search'), {'q': 'priya', 'kind': 'donors'}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.donor.pk])
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        reset_vocabularies()
+        self.donor = make_user('archive@example.com')
+        old = timezone.now() - timedelta(days=200)
+        self.requests = {}
+        for request_id, status, updated_at in (
+            ('REQ600001', 'Completed', old),
+            ('REQ600002', 'Pending', old),
+            ('REQ600003', 'Cancelled', old),
+            ('REQ600004', 'Completed', timezone.now()),
+            ('REQ600005', 'Cancelled', old),
+        ):
+            blood_request = make_request(self.donor, request_id, status=status)
+            BloodRequest.objects.filter(pk=blood_request.pk).update(updated_at=updated_at)
+            self.requests[request_id] = blood_request
+        Notification.objects.create(blood_request=self.requests['REQ600001'], donor=self.donor)
+        self.client.force_login(self.donor)
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_requests', '--older-than-days', '180', *args, stdout=out)
+        return out.getvalue()
+
+    def test_closed_old_requests_move_in_resumable_batches(self):
+        self.assertIn('3 requests', self.archive('--dry-run'))
+        # one id per batch: the first two batches cover REQ600001 and the pending REQ600002
+        out = self.archive('--batch-size', '1', '--max-batches', '2')
+        self.assertIn('Archived 1 requests in 2 batches', out)
+        self.assertIn('blood_requests: 5 rows', out)
+        self.assertIn('-> 4 rows', out)
+        self.assertIn('Archived 2 requests', self.archive())
+        self.assertIn('Archived 0 requests', self.archive())
+
+        self.assertEqual(
+            set(ArchivedRequest.objects.values_list('request_id', flat=True)), {'REQ600001', 'REQ600003', 'REQ600005'}
+        )
+        archived = ArchivedRequest.objects.get(request_id='REQ600001')
+        self.assertEqual(archived.pk, self.requests['REQ600001'].pk)
+        self.assertEqual(archived.requested_by, self.donor)
+        self.assertEqual(set(BloodRequest.objects.values_list('request_id', flat=True)), {'REQ600002', 'REQ600004'})
+        self.assertFalse(Notification.objects.exists())
+        # counters still cover the whole history, and search only the live table
+        self.assertEqual(dashboard_counts()['total'], 5)
+        call_command('request_stats', '--verify', stdout=StringIO())
+        self.assertEqual(len(search('request', 'apollo')), 2)
+
+    def test_history_views_and_export_opt_in(self):
+        self.archive()
+        listing = reverse('blood_requests')
+        self.assertEqual(len(self.client.get(listing).context['blood_requests']), 2)
+        history = self.client.get(listing, {'archived': '1', 'status': 'Cancelled'})
+        self.assertEqual([r.request_id for r in history.context['blood_requests']], ['REQ600005', 'REQ600003'])
+        self.assertContains(history, 'Archived Blood Requests')
+
+        self.client.force_login(make_user('admin@example.com', is_staff=True))
+        url = reverse('export_requests', args=['csv'])
+
+        def exported(**params):
+            response = self.client.get(url, params)
+            return [line.split(',')[0] for line in b''.join(response.streaming_content).decode().splitlines()[1:]]
+
+        self.assertEqual(exported(), ['REQ600002', 'REQ600004'])
+        self.assertEqual(exported(archived='1'), [f'REQ60000{n}' for n in range(1, 6)])
+
+        # deleting the requester takes the archived requests out of the counters too
+        self.donor.delete()
+        self.assertEqual(dashboard_counts()['total'], 0)
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class PriorityTests(TestCase):
+
+    def setUp(self):
+        self.requester = make_user('triage@example.com', 'AB+', 'Chennai')
+
+    def test_score_weighs_level_units_and_capped_age(self):
+        now = timezone.now()
+        self.assertGreater(priority_score('Critical', 1, now - timedelta(hours=1), now),
+                           priority_score('Low', 4, now, now))
+        self.assertGreater(priority_score('Low', 1, now - timedelta(hours=30), now),
+                           priority_score('Medium', 1, now, now))
+        self.assertGreater(priority_score('High', 3), priority_score('High', 1))
+        self.assertEqual(priority_score('Low', 1, now - timedelta(days=3), now),
+                         priority_score('Low', 1, now - timedelta(days=30), now))
+        self.assertGreater(priority_score('Critical', 1), priority_score('Low', 10, now - timedelta(days=30), now))
+
+    def test_dashboard_and_triage_order_by_priority(self):
+        critical = make_request(self.requester, 'REQ700001', 'O+', emergency_level='Critical')
+        low = [make_request(self.requester, f'REQ70001{n}', 'A+', emergency_level='Low') for n in range(3)]
+        make_request(self.requester, 'REQ700020', 'O+', location='Mumbai', emergency_level='Critical')
+        make_request(self.requester, 'REQ700021', 'O+', emergency_level='Critical', status='Completed')
+        # the critical request is the oldest, yet still comes first
+        BloodRequest.objects.filter(pk=critical.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        self.client.force_login(make_user('dash@example.com', 'O-', 'T Nagar, Chennai'))
+        dashboard = self.client.get(reverse('donor_dashboard'))
+        self.assertEqual([r.request_id for r in dashboard.context['blood_requests']],
+                         ['REQ700001', 'REQ700012', 'REQ700011', 'REQ700010'])
+
+        self.client.force_login(make_user('staff@example.com', is_staff=True))
+        queue = self.client.get(reverse('triage'), {'city': 'chennai', 'limit': '2'})
+        self.assertEqual([r.request_id for r in queue.context['blood_requests']], ['REQ700001', 'REQ700012'])
+        queue = self.client.get(reverse('triage'), {'blood_group': 'A+'})
+        self.assertEqual(list(queue.context['blood_requests']), low[::-1])
+
+    def test_rescore_ages_waiting_requests(self):
+        fresh = make_request(self.requester, 'REQ700030', emergency_level='Low')
+        waiting = make_request(self.requester, 'REQ700031', emergency_level='Low')
+        make_request(self.requester, 'REQ700032', emergency_level='Low', status='Cancelled')
+        BloodRequest.objects.filter(pk=waiting.pk).update(created_at=timezone.now() - timedelta(hours=10))
+        self.assertEqual(rescore(), (2, 1))
+        self.assertEqual(rescore(), (2, 0))
+        waiting.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual(waiting.priority - fresh.priority, 10 * AGE_POINTS_PER_HOUR)
+
+        out = StringIO()
+        call_command('rescore_requests', stdout=out)
+        self.assertIn('2 pending requests checked, 0 re-scored', out.getvalue())
+
+
+@override_settings(STORAGES=PLAIN_STORAGES)
+class SupplyDemandTests(TestCase):
+
+    def setUp(self):
+        self.requester = make_user('supply-req@example.com', 'AB+', 'Mumbai')
+        self.o_neg = make_user('supply-o@example.com', 'O-', 'T Nagar, Chennai')
+        self.a_pos = make_user('supply-a@example.com', 'A+', 'chennai')
+
+    def assertRollupCurrent(self):
+        self.assertEqual(stored_rollup(), compute_rollup())
+
+    def test_writes_keep_the_rollup_current(self):
+        first = make_request(self.requester, 'REQ800001', 'A+', 'Apollo, Chennai')
+        second = make_request(self.requester, 'REQ800002', 'O-', 'Chennai')
+        make_request(self.requester, 'REQ800003', 'A+', 'Chennai', status='Completed')
+        self.assertRollupCurrent()
+
+        first.units_required = 4
+        first.save()
+        actions.accept_many(['REQ800002'], self.a_pos)
+        self.a_pos.is_available = False
+        self.a_pos.save(update_fields=['is_available'])
+        make_user('supply-b@example.com', 'B-', 'Chennai')
+        self.assertRollupCurrent()
+
+        self.client.force_login(make_user('supply-staff@example.com', is_staff=True, is_available=False))
+        response = self.client.post(reverse('api_bulk_availability'), json.dumps({'updates': [
+            {'id': self.a_pos.pk, 'available': True}, {'id': self.o_neg.pk, 'available': False},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRollupCurrent()
+
+        second.refresh_from_db()
+        second.delete()
+        self.a_pos.refresh_from_db()
+        self.a_pos.delete()
+        self.assertRollupCurrent()
+
+    def test_matrix_counts_compatible_donors(self):
+        make_request(self.requester, 'REQ800010', 'A+', 'Chennai')
+        make_request(self.requester, 'REQ800011', 'O-', 'Chennai', units_required=3)
+        make_request(self.requester, 'REQ800012', 'B+', 'Mumbai')
+
+        rows = matrix()
+        self.assertEqual([row['city'] for row in rows], ['chennai', 'mumbai'])
+        cells = {cell['blood_group']: cell for cell in rows[0]['cells']}
+        self.assertEqual((cells['A+']['open_units'], cells['A+']['compatible_donors'], cells['A+']['shortage']),
+                         (2, 2, 0))
+        self.assertEqual((cells['O-']['open_units'], cells['O-']['compatible_donors'], cells['O-']['shortage']),
+                         (3, 1, 2))
+        self.assertEqual(rows[0]['shortage'], 2)
+        # reads never touch users or blood_requests
+        with CaptureQueriesContext(connection) as queries:
+            matrix('Chennai')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('supply_demand', queries[0]['sql'])
+
+    def test_recompute_command_repairs_and_records_history(self):
+        make_request(self.requester, 'REQ800020', 'O-', 'Chennai', units_required=3)
+        BloodRequest.objects.filter(request_id='REQ800020').update(units_required=5)
+        out = StringIO()
+        call_command('supply_demand', stdout=out)
+        self.assertIn('1 cells corrected', out.getvalue())
+        self.assertRollupCurrent()
+
+        earlier = timezone.now() - timedelta(hours=3)
+        snapshot(earlier)
+        self.assertEqual(SupplyDemandHistory.objects.filter(city='chennai').values('bucket').distinct().count(), 2)
+        points = trend('Chennai', 'O-')
+        self.assertEqual([(p['open_units'], p['compatible_donors'], p['shortage']) for p in points],
+                         [(5, 1, 4), (5, 1, 4)])
+        self.assertEqual(trend('Chennai')[-1]['donors'], 2)
+        snapshot(timezone.now() - timedelta(days=365))
+        snapshot()
+        self.assertFalse(SupplyDemandHistory.objects.filter(bucket__lt=earlier - timedelta(days=1)).exists())
+
+    def test_admin_page_and_api_are_staff_only(self):
+        make_request(self.requester, 'REQ800030', 'O-', 'Chennai')
+        snapshot()
+        self.client.force_login(self.o_neg)
+        self.assertRedirects(self.client.get(reverse('supply_demand')), reverse('donor_dashboard'),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('api_supply_demand')).status_code, 403)
+
+        self.client.force_login(make_user('supply-admin@example.com', is_staff=True))
+        page = self.client.get(reverse('supply_demand'), {'city': 'Chennai'})
+        self.assertContains(page, '2 / 1')
+        self.assertEqual(len(page.context['history']), 1)
+        data = self.client.get(reverse('api_supply_demand'), {'city': 'Chennai', 'blood_group': 'O-'}).json()
+        self.assertEqual(data['results'][0]['shortage'], 1)
+        self.assertEqual(data['history'][0]['compatible_donors'], 1)
+
+
+@skipUnless(connection.vendor in ('postgresql', 'mysql'), 'SQLite locks the whole database, not rows')
+class RollupRebuildRaceTests(TransactionTestCase):
+
+    def test_a_write_during_the_recount_is_kept(self):
+        requester = make_user('rollup-race@example.com', 'AB+', 'Chennai')
+        make_request(requester, 'REQ810001', 'O-', 'Chennai')
+        counted, written = threading.Event(), threading.Event()
+        recount = supply.compute_rollup
+
+        def recount_then_pause():
+            cells = recount()
+            counted.set()
+            # the writer commits here unless the rebuild holds its row
+            written.wait(1)
+            return cells
+
+        def write():
+            try:
+                counted.wait(5)
+                make_request(requester, 'REQ810002', 'O-', 'Chennai')
+                written.set()
+            finally:
+                connection.close()
+
+        self.addCleanup(setattr, supply, 'compute_rollup', recount)
+        supply.compute_rollup = recount_then_pause
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            writer = pool.submit(write)
+            rebuild_rollup()
+            writer.result()
+
+        self.assertEqual(stored_rollup(), compute_rollup())
+        self.assertEqual(stored_rollup()['chennai', 'O-'][:2], [2, 4])
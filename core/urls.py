@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, exports, metrics, views
 
 urlpatterns = [
     # Public pages
@@ -14,8 +14,25 @@ urlpatterns = [
     path('blood-requests/', views.blood_requests, name='blood_requests'),
     path('request-blood/', views.request_blood, name='request_blood'),
     path('accept-request/<str:request_id>/', views.accept_request, name='accept_request'),
+    path('feed/', views.request_feed, name='request_feed'),
+    
+    # JSON API
+    path('api/requests/', api.requests_collection, name='api_requests'),
+    path('api/requests/accept/', api.accept_requests, name='api_accept_requests'),
+    path('api/requests/cancel/', api.cancel_requests, name='api_cancel_requests'),
+    path('api/accept-request/<str:request_id>/', api.accept_request, name='api_accept_request'),
+    path('api/requests/<str:request_id>/donors/', api.request_donors, name='api_request_donors'),
+    path('api/search/', api.search_collection, name='api_search'),
+    path('api/update-availability/', api.update_availability, name='api_update_availability'),
+    path('api/availability/', api.bulk_availability, name='api_bulk_availability'),
+    path('api/cache-stats/', api.cache_statistics, name='api_cache_stats'),
+    path('api/supply-demand/', api.supply_demand, name='api_supply_demand'),
     
     # Admin pages
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/export/<str:fmt>/', exports.export_requests, name='export_requests'),
+    path('triage/', views.triage, name='triage'),
+    path('supply-demand/', views.supply_demand, name='supply_demand'),
+    path('metrics', metrics.metrics_view, name='metrics'),
     
 ]
\ No newline at end of file
@@ -1,11 +1,28 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import connection
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import ensure_csrf_cookie
 from .models import BloodRequest
-import random
-import string
+from . import actions
+from .archive import request_model
+from .caching import dashboard_requests, listing_page
+from .conditional import render_conditional
+from .feed import format_sse, get_hub
+from .ids import next_request_id
+from .matching import recipient_groups_for
+from .pagination import REQUEST_FILTERS, get_page_size, get_request_filters, paginate
+from .priority import get_triage_limit, top_requests, triage_queue
+from .search import search
+from .stats import dashboard_counts
+from .supply import get_trend_days, matrix, trend
+import asyncio
 
 User = get_user_model()
 
@@ -67,16 +84,20 @@ def user_register(request):
 
 
 @login_required
+@ensure_csrf_cookie
 def donor_dashboard(request):
     """Donor dashboard view"""
     
-    blood_requests = BloodRequest.objects.filter(status='Pending')[:10]
+    # The most urgent pending requests this donor can actually give to, in their city
+    blood_requests = dashboard_requests(request.user, lambda: top_requests(
+        recipient_groups_for(request.user.blood_group), request.user.city, limit=10,
+    ))
     
     context = {
         'blood_requests': blood_requests,
         'user': request.user
     }
-    return render(request, 'donor_dashboard.html', context)
+    return render_conditional(request, 'donor_dashboard.html', context, blood_requests)
 
 
 @login_required
@@ -86,7 +107,11 @@ def donor_profile(request):
         # Update profile
         request.user.full_name = request.POST.get('full_name', request.user.full_name)
         request.user.phone = request.POST.get('phone', request.user.phone)
-        request.user.city = request.POST.get('city', request.user.city)
+        city = request.POST.get('city', request.user.city)
+        if city != request.user.city:
+            # re-placed from the gazetteer on save
+            request.user.latitude = request.user.longitude = None
+        request.user.city = city
         request.user.blood_group = request.POST.get('blood_group', request.user.blood_group)
         request.user.save()
         messages.success(request, 'Profile updated successfully!')
@@ -98,13 +123,36 @@ def donor_profile(request):
 @login_required
 def blood_requests(request):
     """View all blood requests"""
-    all_requests = BloodRequest.objects.all().order_by('-created_at')
+    filters = get_request_filters(request.GET)
+    archived = request.GET.get('archived') == '1'
+    query = '' if archived else request.GET.get('q', '').strip()
+    cursor = request.GET.get('cursor')
+    page_size = get_page_size(request.GET.get('page_size'))
+    queryset = request_model(archived).objects.filter(**filters).select_related('requested_by', 'assigned_to')
+    if query:
+        # the best ranked matches take the place of the paginated listing
+        page = None
+        object_list = search('request', query, limit=page_size, queryset=queryset)
+    elif archived:
+        # history changes only when a batch is archived, so it is read uncached
+        page = paginate(queryset, cursor=cursor, page_size=page_size)
+        object_list = page.object_list
+    else:
+        page = listing_page(filters, cursor, page_size, lambda: paginate(
+            queryset, cursor=cursor, page_size=page_size,
+        ))
+        object_list = page.object_list
     
     context = {
-        'blood_requests': all_requests,
+        'blood_requests': object_list,
+        'page': page,
+        'query': query,
+        'archived': archived,
+        'filters': filters,
+        'filter_choices': REQUEST_FILTERS,
         'user': request.user
     }
-    return render(request, 'blood_requests.html', context)
+    return render_conditional(request, 'blood_requests.html', context, object_list)
 
 
 @login_required
@@ -118,7 +166,7 @@ def request_blood(request):
         emergency_level = request.POST.get('emergency_level')
         
         
-        request_id = 'REQ' + ''.join(random.choices(string.digits, k=6))
+        request_id = next_request_id()
         
         
         BloodRequest.objects.create(
@@ -140,13 +188,13 @@ def request_blood(request):
 @login_required
 def accept_request(request, request_id):
     """Accept a blood request"""
-    try:
-        blood_request = BloodRequest.objects.get(request_id=request_id)
-        blood_request.assigned_to = request.user
-        blood_request.status = 'In Progress'
-        blood_request.save()
+    result, _ = actions.accept(request_id, request.user)
+    
+    if result == actions.ACCEPTED:
         messages.success(request, f'You have accepted request {request_id}')
-    except BloodRequest.DoesNotExist:
+    elif result == actions.ALREADY_TAKEN:
+        messages.error(request, f'Request {request_id} has already been taken by another donor')
+    else:
         messages.error(request, 'Request not found')
     
     return redirect('donor_dashboard')
@@ -160,22 +208,122 @@ def admin_dashboard(request):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('donor_dashboard')
     
-    all_requests = BloodRequest.objects.all().order_by('-created_at')
+    filters = get_request_filters(request.GET)
+    query = request.GET.get('q', '').strip()
+    queryset = BloodRequest.objects.filter(**filters).select_related('assigned_to')
+    page_size = get_page_size(request.GET.get('page_size'))
+    if query:
+        page = None
+        object_list = search('request', query, limit=page_size, queryset=queryset)
+    else:
+        page = paginate(queryset, cursor=request.GET.get('cursor'), page_size=page_size)
+        object_list = page.object_list
+    
+    # Statistics, read from the incrementally maintained counters
+    counts = dashboard_counts()
+    
+    context = {
+        'blood_requests': object_list,
+        'page': page,
+        'query': query,
+        'filters': filters,
+        'filter_choices': REQUEST_FILTERS,
+        'total_requests': counts['total'],
+        'pending_requests': counts['pending'],
+        'completed_requests': counts['completed'],
+        'in_progress_requests': counts['in_progress'],
+    }
+    return render_conditional(request, 'admin_dashboard.html', context, object_list, sorted(counts.items()))
+
+
+@login_required
+def triage(request):
+    """Admin triage queue: pending requests, most urgent first"""
+    
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied. Admin privileges required.')
+        return redirect('donor_dashboard')
     
-    # Statistics
-    total_requests = all_requests.count()
-    pending_requests = all_requests.filter(status='Pending').count()
-    completed_requests = all_requests.filter(status='Completed').count()
-    in_progress_requests = all_requests.filter(status='In Progress').count()
+    blood_group = request.GET.get('blood_group')
+    if blood_group not in REQUEST_FILTERS['blood_group']:
+        blood_group = None
+    city = request.GET.get('city', '').strip()
+    limit = get_triage_limit(request.GET.get('limit'))
     
     context = {
-        'blood_requests': all_requests,
-        'total_requests': total_requests,
-        'pending_requests': pending_requests,
-        'completed_requests': completed_requests,
-        'in_progress_requests': in_progress_requests,
+        'blood_requests': triage_queue(blood_group, city, limit),
+        'blood_group': blood_group,
+        'city': city,
+        'limit': limit,
+        'blood_groups': REQUEST_FILTERS['blood_group'],
     }
-    return render(request, 'admin_dashboard.html', context)
+    return render(request, 'triage.html', context)
+
+
+@login_required
+def supply_demand(request):
+    """Admin heatmap of open units against compatible donors, per city and blood group"""
+    
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied. Admin privileges required.')
+        return redirect('donor_dashboard')
+    
+    city = request.GET.get('city', '').strip()
+    blood_group = request.GET.get('blood_group')
+    if blood_group not in REQUEST_FILTERS['blood_group']:
+        blood_group = None
+    days = get_trend_days(request.GET.get('days'))
+    history = trend(city, blood_group, days) if city else []
+    
+    context = {
+        'rows': matrix(city or None, limit=get_page_size(request.GET.get('limit'))),
+        'city': city,
+        'blood_group': blood_group,
+        'days': days,
+        'history': history,
+        'peak': max((point['open_units'] for point in history), default=0),
+        'blood_groups': REQUEST_FILTERS['blood_group'],
+    }
+    return render(request, 'supply_demand.html', context)
+
+
+def _release_connection():
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+@login_required
+async def request_feed(request):
+    """Server-Sent Events stream of requests compatible with the donor"""
+    if not isinstance(request, ASGIRequest):
+        # a stream would pin a whole WSGI worker; 204 tells EventSource to stop retrying
+        return HttpResponse(status=204)
+    
+    user = await request.auser()
+    # the stream outlives the request thread that opened this connection
+    await sync_to_async(_release_connection)()
+    hub = get_hub()
+    subscription = hub.subscribe(user.blood_group, user.city)
+    keepalive = getattr(settings, 'REQUEST_FEED_KEEPALIVE_SECONDS', 25)
+    
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    # comment line keeps proxies from closing an idle stream
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            hub.unsubscribe(subscription)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def user_logout(request):
@@ -35,6 +35,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize tooltips and popovers if using Bootstrap
     initializeTooltips();
 
+    // Live request feed (donor dashboard)
+    initializeRequestFeed();
+
     // Add smooth scrolling
     addSmoothScrolling();
 });
@@ -108,23 +111,45 @@ function isValidEmail(email) {
     return emailRegex.test(email);
 }
 
+// Read the CSRF token Django sets in the csrftoken cookie
+function getCsrfToken() {
+    const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : '';
+}
+
+// POST a JSON body to the API and parse the JSON reply
+function postJSON(url, body) {
+    return fetch(url, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCsrfToken()
+        },
+        body: JSON.stringify(body || {})
+    }).then(response => response.json().then(data => ({ ok: response.ok, data: data })));
+}
+
 // Update Availability Status
 function updateAvailability(isAvailable) {
-    // This would typically make an AJAX call to update the server
-    const status = isAvailable ? 'available' : 'unavailable';
-    
-    // Show notification
-    showNotification(
-        isAvailable ? 'You are now available for blood donation' : 'You are now unavailable for blood donation',
-        'success'
-    );
-    
-    // In a real application, this would be an AJAX call:
-    // fetch('/api/update-availability', {
-    //     method: 'POST',
-    //     headers: { 'Content-Type': 'application/json' },
-    //     body: JSON.stringify({ available: isAvailable })
-    // });
+    postJSON('/api/update-availability/', { available: isAvailable })
+        .then(({ ok }) => {
+            if (!ok) {
+                throw new Error('update failed');
+            }
+            showNotification(
+                isAvailable ? 'You are now available for blood donation' : 'You are now unavailable for blood donation',
+                'success'
+            );
+        })
+        .catch(() => {
+            // put the toggle back the way the server still has it
+            const toggle = document.querySelector('.toggle-switch');
+            if (toggle) {
+                toggle.classList.toggle('off', isAvailable);
+            }
+            showNotification('Could not update your availability', 'error');
+        });
 }
 
 // Accept Blood Request
@@ -136,22 +161,26 @@ function acceptBloodRequest(requestId) {
         button.textContent = 'Processing...';
         button.disabled = true;
 
-        // Simulate API call
-        setTimeout(() => {
-            showNotification('Blood request accepted successfully!', 'success');
-            button.textContent = 'Accepted';
-            button.style.backgroundColor = '#4caf50';
-            
-            // In a real application, this would be an AJAX call:
-            // fetch(`/api/accept-request/${requestId}`, {
-            //     method: 'POST',
-            //     headers: { 'Content-Type': 'application/json' }
-            // })
-            // .then(response => response.json())
-            // .then(data => {
-            //     showNotification('Blood request accepted!', 'success');
-            // });
-        }, 1000);
+        postJSON(`/api/accept-request/${encodeURIComponent(requestId)}/`)
+            .then(({ data }) => {
+                if (data.result === 'accepted') {
+                    showNotification('Blood request accepted successfully!', 'success');
+                    button.textContent = 'Accepted';
+                    button.style.backgroundColor = '#4caf50';
+                } else if (data.result === 'already_taken') {
+                    showNotification('This request has already been taken by another donor', 'error');
+                    button.textContent = 'Taken';
+                } else {
+                    showNotification('This request could not be accepted', 'error');
+                    button.textContent = originalText;
+                    button.disabled = false;
+                }
+            })
+            .catch(() => {
+                showNotification('Network error, please try again', 'error');
+                button.textContent = originalText;
+                button.disabled = false;
+            });
     }
 }
 
@@ -275,18 +304,68 @@ function addSmoothScrolling() {
     });
 }
 
-// Real-time search/filter functionality (for admin dashboard)
+// Live feed of new and updated requests (Server-Sent Events)
+function initializeRequestFeed() {
+    const section = document.querySelector('.requests-section[data-feed-url]');
+    if (!section || !window.EventSource) {
+        return;
+    }
+
+    const source = new EventSource(section.getAttribute('data-feed-url'));
+
+    source.addEventListener('created', function(e) {
+        const request = JSON.parse(e.data);
+        if (request.status !== 'Pending' || section.querySelector(`[data-request-id="${request.request_id}"]`)) {
+            return;
+        }
+        const card = document.createElement('div');
+        card.className = 'request-card';
+        card.innerHTML = `
+            <div class="request-info">
+                <div class="blood-type-icon"></div>
+                <div class="request-details">
+                    <h4></h4>
+                    <p></p>
+                </div>
+            </div>
+            <button class="btn-accept">Accept Request</button>
+        `;
+        card.querySelector('.blood-type-icon').textContent = request.blood_group;
+        card.querySelector('h4').textContent = `Needed at ${request.hospital_name}`;
+        card.querySelector('p').textContent = `${request.units_required} Units`;
+        const button = card.querySelector('.btn-accept');
+        button.setAttribute('data-request-id', request.request_id);
+        button.addEventListener('click', function() {
+            acceptBloodRequest(request.request_id);
+        });
+        section.querySelector('h3').after(card);
+        showNotification(`New ${request.emergency_level} request for ${request.blood_group}`, 'info');
+    });
+
+    source.addEventListener('updated', function(e) {
+        const request = JSON.parse(e.data);
+        if (request.status === 'Pending') {
+            return;
+        }
+        const button = section.querySelector(`[data-request-id="${request.request_id}"]`);
+        if (button) {
+            button.closest('.request-card').remove();
+        }
+    });
+}
+
+// Server-side search: resubmit the filter form once typing pauses
 function initializeSearch() {
     const searchInput = document.querySelector('#searchInput');
-    if (searchInput) {
+    if (searchInput && searchInput.form) {
+        let timer = null;
         searchInput.addEventListener('input', function() {
-            const searchTerm = this.value.toLowerCase();
-            const rows = document.querySelectorAll('tbody tr');
-            
-            rows.forEach(row => {
-                const text = row.textContent.toLowerCase();
-                row.style.display = text.includes(searchTerm) ? '' : 'none';
-            });
+            clearTimeout(timer);
+            const query = this.value.trim();
+            if (query.length === 1) {
+                return;
+            }
+            timer = setTimeout(() => this.form.submit(), 400);
         });
     }
 }